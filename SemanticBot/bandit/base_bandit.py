@@ -1,8 +1,13 @@
+import copy
+from collections import deque
 import numpy as np
 import matplotlib.pyplot as plt
 
 
 class Bandit():
+    # number of values of the total average reward kept to plot, so the memory of a bandit is fixed
+    HISTORY = 1000
+
     def __init__(self, arms: int):
         """
         Base bandit constructor
@@ -14,8 +19,8 @@ class Bandit():
         self.narms_n = np.ones(self.narms)
         # mean reward for each arm
         self.narms_rmean = np.zeros(self.narms)
-        # total average reward on each step
-        self.reward = [0]
+        # total average reward on the last HISTORY steps
+        self.reward = deque([0], maxlen=self.HISTORY)
         # n times that any arm was pulled
         self.n = 1
 
@@ -31,6 +36,50 @@ class Bandit():
         """
         pass
 
+    def get_state(self):
+        """
+        Function that returns the learned state of the bandit, that can be written as json
+        :return: dictionary with the times each arm was used, the mean reward of each arm, the n times that any arm
+        was pulled and the total average reward
+        """
+        return {'narms_n': np.asarray(self.narms_n, dtype=float).tolist(),
+                'narms_rmean': np.asarray(self.narms_rmean, dtype=float).tolist(),
+                'n': float(self.n), 'reward': float(self.reward[-1])}
+
+    def set_state(self, state: dict):
+        """
+        Function that replaces the learned state of the bandit
+        :param state: state returned by get_state, with the same quantity of arms
+        """
+        if len(state['narms_n']) != self.narms:
+            raise ValueError("the state has " + str(len(state['narms_n'])) + " arms and the bandit " + str(self.narms))
+        self.narms_n = np.array(state['narms_n'], dtype=float)
+        self.narms_rmean = np.array(state['narms_rmean'], dtype=float)
+        self.n = state['n']
+        # the history of the total average reward starts again from the reward of the state
+        self.reward = deque([state['reward']], maxlen=self.HISTORY)
+
+    def merge(self, state: dict):
+        """
+        Function that adds the pulls and rewards of another bandit with the same arms to this one
+        :param state: state of the other bandit, see get_state
+        """
+        self.set_state(merge_states(self.get_state(), state))
+
+    def checkpoint(self):
+        """
+        Function that copies the state of the bandit, to return to it with rollback
+        :return: copy of the state
+        """
+        return copy.deepcopy(self.__dict__)
+
+    def rollback(self, saved):
+        """
+        Function that returns the bandit to a state copied by checkpoint
+        :param saved: state copied by checkpoint
+        """
+        self.__dict__.update(saved)
+
     def show_statistics(self):
         """
         Function that plots statistics of the arms
@@ -47,8 +96,33 @@ class Bandit():
 
         plt.figure(figsize=(14, 8))
         plt.title("Rewards")
-        plt.plot(self.reward, label="Rewards")
+        plt.plot(list(self.reward), label="Rewards")
         plt.legend(bbox_to_anchor=(1.2, 0.5))
         plt.xlabel("Iterations")
         plt.ylabel("Average Reward")
-        plt.show()
\ No newline at end of file
+        plt.show()
+
+def merge_states(state: dict, other: dict):
+    """
+    Function that adds the pulls and rewards of two states of bandits. The counters of the bandits start at one, so
+    the merged counters are the sum minus one and the means are weighted by the number of pulls
+    :param state: state of a bandit, see Bandit.get_state
+    :param other: state of other bandit with the same arms
+    :return: merged state
+    """
+    pulls = np.array(state['narms_n']) - 1
+    other_pulls = np.array(other['narms_n']) - 1
+    total = pulls + other_pulls
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rmean = (pulls * np.array(state['narms_rmean']) + other_pulls * np.array(other['narms_rmean'])) / total
+
+    n = state['n'] + other['n'] - 1
+    reward = ((state['n'] - 1) * state['reward'] + (other['n'] - 1) * other['reward']) / max(n - 1, 1)
+    merged = dict(state, narms_n=(total + 1).tolist(), narms_rmean=np.where(total > 0, rmean, 0).tolist(), n=n,
+                  reward=reward)
+
+    # the beta distributions also start at one
+    for name in ['alpha', 'beta']:
+        if name in state and name in other:
+            merged[name] = (np.array(state[name]) + np.array(other[name]) - 1).tolist()
+    return merged
@@ -0,0 +1,154 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+from bandit.base_bandit import merge_states
+
+
+class BanditPrior:
+    """
+    Prior of the bandits of new conversations learned from the completed ones. Each completed conversation adds the
+    pulls and rewards of its bandit, without the ones of the prior it started from, to its segment (eg the age group
+    of the user) and to the global prior. A new bandit starts from the prior of its segment, or from the global one when
+    the segment has few conversations, scaled to at most strength pulls so the bandit still adapts to the user
+    """
+
+    GLOBAL = 'all'
+
+    def __init__(self, arms: int, strength=20.0, min_sessions=30, path=None, snapshot_every=60.0):
+        """
+        Bandit prior constructor
+        :param arms: quantity of arms of the bandits
+        :param strength: maximum number of pulls of the prior of a new bandit
+        :param min_sessions: minimum number of conversations of a segment to use its prior instead of the global one
+        :param path: json file of the snapshots of the prior, None to not write them
+        :param snapshot_every: minimum seconds between two snapshots written when conversations are added
+        """
+        self.narms = arms
+        self.strength = strength
+        self.min_sessions = min_sessions
+        self.path = path
+        self.snapshot_every = snapshot_every
+        # state of the merged bandits of each segment, see Bandit.get_state, and the number of conversations
+        self.segments = {}
+        self.sessions = {}
+        self._last_snapshot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def start(self, bandit, segment=None):
+        """
+        Function that sets the state of a new bandit to the prior
+        :param bandit: bandit of a new conversation
+        :param segment: segment of the conversation, None to use the global prior
+        :return: state of the bandit with the prior, to be passed to add when the conversation is completed
+        """
+        with self._lock:
+            state = self.segments.get(segment)
+            if segment is None or self.sessions.get(segment, 0) < self.min_sessions:
+                state = self.segments.get(self.GLOBAL)
+
+        if state is not None:
+            bandit.set_state(_scale(state, self.strength))
+        return bandit.get_state()
+
+    def add(self, bandit, start: dict, segment=None):
+        """
+        Function that adds the pulls and rewards of the bandit of a completed conversation to the prior
+        :param bandit: bandit of the conversation
+        :param start: state returned by start when the conversation started
+        :param segment: segment of the conversation, None to add it only to the global prior
+        """
+        learned = _subtract(bandit.get_state(), start)
+        with self._lock:
+            for key in {self.GLOBAL, segment} - {None}:
+                self.segments[key] = learned if key not in self.segments else merge_states(self.segments[key], learned)
+                self.sessions[key] = self.sessions.get(key, 0) + 1
+
+        if self.path is not None and time.monotonic() - self._last_snapshot >= self.snapshot_every:
+            self.save()
+
+    def merge(self, other):
+        """
+        Function that adds the conversations of another prior, eg learned by other process
+        :param other: bandit prior with the same arms
+        """
+        with self._lock:
+            for key, state in other.segments.items():
+                self.segments[key] = state if key not in self.segments else merge_states(self.segments[key], state)
+                self.sessions[key] = self.sessions.get(key, 0) + other.sessions.get(key, 0)
+
+    def save(self, path=None):
+        """
+        Function that writes a snapshot of the prior, replacing the file only when it is complete
+        :param path: json file, None to use the path of the prior
+        """
+        path = path if path is not None else self.path
+        with self._lock:
+            snapshot = {'arms': self.narms, 'segments': self.segments, 'sessions': self.sessions}
+            self._last_snapshot = time.monotonic()
+            with open(path + ".tmp", 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def load(path: str, arms=2, strength=20.0, min_sessions=30, snapshot_every=60.0):
+        """
+        Function that reads a snapshot of a prior, the next snapshots are written on the same file. If the file does
+        not exist the prior is empty
+        :param path: json file written by save
+        :param arms: quantity of arms of the bandits, it must be the one of the file when it exists
+        :param strength: maximum number of pulls of the prior of a new bandit
+        :param min_sessions: minimum number of conversations of a segment to use its prior
+        :param snapshot_every: minimum seconds between two snapshots
+        :return: bandit prior
+        """
+        if not os.path.isfile(path):
+            return BanditPrior(arms, strength, min_sessions, path, snapshot_every)
+
+        with open(path) as f:
+            snapshot = json.load(f)
+        if snapshot['arms'] != arms:
+            raise ValueError("The prior of " + path + " has " + str(snapshot['arms']) + " arms, expected " + str(arms))
+        prior = BanditPrior(arms, strength, min_sessions, path, snapshot_every)
+        prior.segments = snapshot['segments']
+        prior.sessions = snapshot['sessions']
+        return prior
+
+
+def _subtract(state: dict, start: dict):
+    """
+    Function that removes the pulls and rewards of the starting state from the state of a bandit
+    :param state: state of the bandit, see Bandit.get_state
+    :param start: state of the bandit when it started
+    :return: state of a bandit with only the pulls and rewards after the start
+    """
+    narms_n = np.array(state['narms_n'])
+    start_n = np.array(start['narms_n'])
+    pulls = narms_n - start_n
+    rewards = (narms_n - 1) * np.array(state['narms_rmean']) - (start_n - 1) * np.array(start['narms_rmean'])
+    n = state['n'] - start['n']
+    reward = ((state['n'] - 1) * state['reward'] - (start['n'] - 1) * start['reward']) / max(n, 1)
+
+    rmean = np.divide(rewards, pulls, out=np.zeros(len(pulls)), where=pulls > 0)
+    learned = {'narms_n': (pulls + 1).tolist(), 'narms_rmean': rmean.tolist(), 'n': n + 1, 'reward': reward}
+    for name in ['alpha', 'beta']:
+        if name in state and name in start:
+            learned[name] = (np.array(state[name]) - np.array(start[name]) + 1).tolist()
+    return learned
+
+
+def _scale(state: dict, strength: float):
+    """
+    Function that scales the pulls of a state to at most strength pulls, keeping the means
+    :param state: state of a bandit, see Bandit.get_state
+    :param strength: maximum number of pulls
+    :return: scaled state
+    """
+    pulls = np.array(state['narms_n']) - 1
+    scale = min(1.0, strength / max(pulls.sum(), 1))
+    scaled = dict(state, narms_n=(pulls * scale + 1).tolist(), n=(state['n'] - 1) * scale + 1)
+    for name in ['alpha', 'beta']:
+        if name in state:
+            scaled[name] = ((np.array(state[name]) - 1) * scale + 1).tolist()
+    return scaled
@@ -0,0 +1,292 @@
+import threading
+import numpy as np
+from bandit.base_bandit import Bandit
+
+
+class BanditStore:
+    """
+    Bandits of many sessions in contiguous arrays, with one row for each session and one column for each arm, so the
+    arms of a batch of sessions are pulled and updated with one vectorized call. The total average reward of a session
+    is a running aggregate and only its last history values are kept on a ring buffer, so the memory of each session is
+    fixed. The policies are the ones of ThompsonSamplingBandit, UCBBandit, EGreedyBandit and RandomBandit
+    """
+
+    THOMPSON = 'thompson'
+    UCB = 'ucb'
+    EGREEDY = 'egreedy'
+    RANDOM = 'random'
+
+    def __init__(self, arms: int, policy=THOMPSON, c=1.0, eps=0.1, capacity=1024, history=100, seed=None):
+        """
+        Bandit store constructor
+        :param arms: quantity of arms of each bandit
+        :param policy: policy to select the arms, one of THOMPSON, UCB, EGREEDY and RANDOM
+        :param c: parameter of the ucb formula
+        :param eps: probability of a random arm of the e-greedy policy
+        :param capacity: initial number of rows, it doubles when all of them are used
+        :param history: number of values of the total average reward kept for each session
+        :param seed: seed of the random generator of the pulls
+        """
+        if policy not in [self.THOMPSON, self.UCB, self.EGREEDY, self.RANDOM]:
+            raise ValueError("unknown policy " + str(policy))
+        self.narms = arms
+        self.policy = policy
+        self.c = c
+        self.eps = eps
+        self.history = history
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+        # times each arm was used, mean reward for each arm and alpha and beta parameters of the beta distributions
+        self.narms_n = np.ones((0, arms))
+        self.narms_rmean = np.zeros((0, arms))
+        self.alpha = np.ones((0, arms))
+        self.beta = np.ones((0, arms))
+        # n times that any arm was pulled and total average reward
+        self.n = np.ones(0)
+        self.reward = np.zeros(0)
+        # last values of the total average reward, the next one is written on position and steps is their number
+        self.reward_history = np.zeros((0, history))
+        self.position = np.zeros(0, dtype=np.int64)
+        self.steps = np.zeros(0, dtype=np.int64)
+
+        self.used = np.zeros(0, dtype=bool)
+        self._free = []
+        self._grow(capacity)
+
+    def __len__(self):
+        return int(self.used.sum())
+
+    def open(self, count=1):
+        """
+        Function that creates the bandits of new sessions
+        :param count: number of sessions
+        :return: array with the row of each session
+        """
+        with self._lock:
+            while len(self._free) < count:
+                self._grow(len(self.used))
+            slots = np.array(self._free[-count:] if count > 0 else [], dtype=np.int64)
+            del self._free[len(self._free) - count:]
+            self._reset(slots)
+            self.used[slots] = True
+            return slots
+
+    def close(self, slots):
+        """
+        Function that removes the bandits of sessions, their rows are reused by the next sessions
+        :param slots: rows of the sessions
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        with self._lock:
+            slots = slots[self.used[slots]]
+            self.used[slots] = False
+            self._free.extend(slots.tolist())
+
+    def bandit(self, slot: int):
+        """
+        Function that returns the bandit of a session, with the interface of Bandit
+        :param slot: row of the session
+        :return: bandit of the row
+        """
+        return StoreBandit(self, slot)
+
+    def pull(self, slots):
+        """
+        Function that pulls one arm of each session
+        :param slots: rows of the sessions
+        :return: array with the arm selected for each session
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        with self._lock:
+            if self.policy == self.THOMPSON:
+                # select arm with the highest sample of its beta distribution
+                return np.argmax(self._rng.beta(self.alpha[slots], self.beta[slots]), axis=1)
+            if self.policy == self.UCB:
+                # select arm based on ucb formula
+                bound = self.c * np.sqrt(np.log(self.n[slots])[:, None] / self.narms_n[slots])
+                return np.argmax(self.narms_rmean[slots] + bound, axis=1)
+
+            random_arm = self._rng.integers(0, self.narms, len(slots))
+            if self.policy == self.RANDOM:
+                return random_arm
+            # e-greedy rule: if random value is less than eps, use random arm, else, use best arm so far
+            explore = (self._rng.random(len(slots)) < self.eps) | (self.eps == 0)
+            return np.where(explore, random_arm, np.argmax(self.narms_rmean[slots], axis=1))
+
+    def update(self, slots, arms_selected, rewards):
+        """
+        Function that updates the total average reward and the arm average of each session
+        :param slots: rows of the sessions, each session at most once
+        :param arms_selected: arm selected on each session
+        :param rewards: reward of each session
+        """
+        slots = np.asarray(slots, dtype=np.int64)
+        arms = np.asarray(arms_selected, dtype=np.int64)
+        rewards = np.asarray(rewards, dtype=float)
+        if len(np.unique(slots)) != len(slots):
+            raise ValueError("a session can only be updated once on each call")
+
+        with self._lock:
+            # update average reward vector for bandit and arm selected
+            self.reward[slots] = self.reward[slots] + (rewards - self.reward[slots]) / self.n[slots]
+            mean = self.narms_rmean[slots, arms]
+            self.narms_rmean[slots, arms] = mean + (rewards - mean) / self.narms_n[slots, arms]
+
+            # update beta and alpha for chosen arm, they are only used by the thompson sampling policy
+            self.alpha[slots, arms] = self.alpha[slots, arms] + rewards
+            self.beta[slots, arms] = self.beta[slots, arms] + (1 - rewards)
+
+            # increase counters n of bandit and of arm selected
+            self.n[slots] = self.n[slots] + 1
+            self.narms_n[slots, arms] = self.narms_n[slots, arms] + 1
+
+            self.reward_history[slots, self.position[slots]] = self.reward[slots]
+            self.position[slots] = (self.position[slots] + 1) % self.history
+            self.steps[slots] = self.steps[slots] + 1
+
+    def rewards(self, slot: int):
+        """
+        :param slot: row of a session
+        :return: last values of the total average reward of the session, from the oldest to the newest
+        """
+        kept = min(self.steps[slot], self.history)
+        return np.roll(self.reward_history[slot], -self.position[slot])[self.history - kept:]
+
+    def row(self, slot: int):
+        """
+        Function that copies the state of a session
+        :param slot: row of the session
+        :return: dictionary with the values of the row on each array
+        """
+        with self._lock:
+            return {name: np.copy(array[slot]) for name, array in self._arrays().items()}
+
+    def set_row(self, slot: int, values: dict):
+        """
+        Function that writes the state of a session copied by row
+        :param slot: row of the session
+        :param values: dictionary with the values of the row on each array
+        """
+        with self._lock:
+            for name, array in self._arrays().items():
+                array[slot] = values[name]
+
+    def set_state(self, slot: int, state: dict):
+        """
+        Function that replaces the learned state of a session
+        :param slot: row of the session
+        :param state: state of a bandit, see Bandit.get_state. Without alpha and beta they are kept
+        """
+        with self._lock:
+            self.narms_n[slot] = state['narms_n']
+            self.narms_rmean[slot] = state['narms_rmean']
+            self.n[slot] = state['n']
+            self.reward[slot] = state['reward']
+            # the history of the total average reward starts again from the reward of the state
+            self.reward_history[slot] = 0
+            self.reward_history[slot, 0] = state['reward']
+            self.position[slot] = 1 % self.history
+            self.steps[slot] = 1
+            if 'alpha' in state and 'beta' in state:
+                self.alpha[slot] = state['alpha']
+                self.beta[slot] = state['beta']
+
+    def _arrays(self):
+        """
+        :return: dictionary with the arrays that have one row for each session
+        """
+        return {'narms_n': self.narms_n, 'narms_rmean': self.narms_rmean, 'alpha': self.alpha, 'beta': self.beta,
+                'n': self.n, 'reward': self.reward, 'reward_history': self.reward_history,
+                'position': self.position, 'steps': self.steps}
+
+    def _reset(self, slots: np.ndarray):
+        """
+        Function that sets rows to the state of a new bandit
+        :param slots: rows to reset
+        """
+        self.narms_n[slots] = 1
+        self.narms_rmean[slots] = 0
+        self.alpha[slots] = 1
+        self.beta[slots] = 1
+        self.n[slots] = 1
+        self.reward[slots] = 0
+        self.reward_history[slots] = 0
+        self.position[slots] = 0
+        self.steps[slots] = 0
+
+    def _grow(self, rows: int):
+        """
+        Function that adds free rows at the end of the arrays
+        :param rows: number of rows to add
+        """
+        rows = max(rows, 1)
+        start = len(self.used)
+        for name, array in self._arrays().items():
+            setattr(self, name, np.concatenate([array, np.zeros((rows,) + array.shape[1:], dtype=array.dtype)]))
+        self.used = np.concatenate([self.used, np.zeros(rows, dtype=bool)])
+        self._free.extend(range(start + rows - 1, start - 1, -1))
+
+
+class StoreBandit(Bandit):
+    """
+    Bandit of a session of a BanditStore, so it is pulled and updated by the conversation as the other bandits
+    """
+
+    def __init__(self, store: BanditStore, slot: int):
+        """
+        Store bandit constructor
+        :param store: bandit store
+        :param slot: row of the session on the store
+        """
+        self.store = store
+        self.slot = slot
+        self.narms = store.narms
+
+    @property
+    def narms_n(self):
+        return self.store.narms_n[self.slot]
+
+    @property
+    def narms_rmean(self):
+        return self.store.narms_rmean[self.slot]
+
+    @property
+    def alpha(self):
+        return self.store.alpha[self.slot]
+
+    @property
+    def beta(self):
+        return self.store.beta[self.slot]
+
+    @property
+    def n(self):
+        return self.store.n[self.slot]
+
+    @property
+    def reward(self):
+        rewards = self.store.rewards(self.slot).tolist()
+        if self.store.steps[self.slot] < self.store.history:
+            rewards = [0] + rewards
+        return rewards
+
+    def pull(self):
+        return int(self.store.pull([self.slot])[0])
+
+    def update(self, arm_selected: int, reward: float):
+        self.store.update([self.slot], [arm_selected], [reward])
+
+    def get_state(self):
+        state = super().get_state()
+        state['alpha'] = self.alpha.tolist()
+        state['beta'] = self.beta.tolist()
+        return state
+
+    def set_state(self, state: dict):
+        self.store.set_state(self.slot, state)
+
+    def checkpoint(self):
+        return self.store.row(self.slot)
+
+    def rollback(self, saved):
+        self.store.set_row(self.slot, saved)
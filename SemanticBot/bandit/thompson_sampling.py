@@ -10,8 +10,8 @@ class ThompsonSamplingBandit(Bandit):
         self.beta = np.ones(self.narms)
 
     def pull(self):
-        # select arm based on ucb formula
-        an = np.argmax([np.random.beta(self.alpha[i], self.beta[i]) for i in range(self.narms)])
+        # select arm with the highest sample of its beta distribution, drawn for all arms at once
+        an = np.argmax(np.random.beta(self.alpha, self.beta))
         return an
 
     def update(self, arm_selected: int, reward: float):
@@ -25,4 +25,15 @@ class ThompsonSamplingBandit(Bandit):
 
         # increase counters n of bandit and of arm selected
         self.n = self.n + 1
-        self.narms_n[arm_selected] = self.narms_n[arm_selected] + 1
\ No newline at end of file
+        self.narms_n[arm_selected] = self.narms_n[arm_selected] + 1
+
+    def get_state(self):
+        state = super().get_state()
+        state['alpha'] = self.alpha.tolist()
+        state['beta'] = self.beta.tolist()
+        return state
+
+    def set_state(self, state: dict):
+        super().set_state(state)
+        self.alpha = np.array(state['alpha'], dtype=float)
+        self.beta = np.array(state['beta'], dtype=float)
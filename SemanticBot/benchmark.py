@@ -0,0 +1,297 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import scipy
+import conversation
+import relevance
+import utils
+from subgraph import SubGraph
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "WikidataIntegration"))
+import adjacency_matrix
+
+# age ratings of the synthetic movies
+RATINGS = ['G', 'PG', 'PG-13', 'R', 'NC-17', 'Not Rated', 'Unrated', 'TV-MA', 'TV-14', 'TV-PG']
+FORMAT_VERSION = 1
+# smallest exponent of the fit of a function and largest factor of the measured sizes to estimate the size at the
+# latency budget
+MIN_EXPONENT = 0.1
+MAX_EXTRAPOLATION = 100
+
+
+def synthetic_data(n_movies=1000, n_props=8, objs_per_prop=200, values_per_prop=2, n_users=None,
+                   ratings_per_movie=50, seed=0):
+    """
+    Function that generates a property graph and ratings with the columns of the datasets of the bot. The objects of
+    each property and the movies of the ratings follow a zipf like distribution, so a few of them are popular as on
+    the real datasets
+    :param n_movies: number of movies
+    :param n_props: number of properties, eg director, genre
+    :param objs_per_prop: number of objects of each property
+    :param values_per_prop: number of objects of each property of each movie
+    :param n_users: number of users, None to use half of the movies
+    :param ratings_per_movie: mean number of ratings of each movie
+    :param seed: seed of the generator
+    :return: full graph with the movie id as index, ratings with user_id, movie_id and rating columns and age rating
+    of the movies with the movie id as index
+    """
+    rng = np.random.default_rng(seed)
+    n_users = n_users if n_users is not None else max(n_movies // 2, 1)
+    movie_ids = np.arange(1, n_movies + 1) * 3
+
+    def zipf(n, size):
+        weights = 1.0 / np.arange(1, n + 1)
+        return rng.choice(n, size=size, p=weights / weights.sum())
+
+    # values_per_prop objects of each property for each movie, repeated objects of a movie are removed
+    prop = np.tile(np.repeat(np.arange(n_props), values_per_prop), n_movies)
+    movie = np.repeat(movie_ids, n_props * values_per_prop)
+    obj = zipf(objs_per_prop, len(prop))
+    graph = pd.DataFrame({'movie_id': movie, 'prop': prop, 'obj': obj}).drop_duplicates()
+    codes = graph['prop'].to_numpy() * objs_per_prop + graph['obj'].to_numpy()
+    full_graph = pd.DataFrame({'movie_id': graph['movie_id'].to_numpy(),
+                               'title': "Movie " + graph['movie_id'].astype(str).to_numpy(dtype=object),
+                               'prop': "prop " + graph['prop'].astype(str).to_numpy(dtype=object),
+                               'obj': "object " + pd.Series(codes).astype(str).to_numpy(dtype=object),
+                               'obj_code': "Q" + pd.Series(codes).astype(str).to_numpy(dtype=object),
+                               'imdbId': "tt" + graph['movie_id'].astype(str).to_numpy(dtype=object)})
+
+    n_ratings = n_movies * ratings_per_movie
+    ratings = pd.DataFrame({'user_id': rng.integers(1, n_users + 1, n_ratings),
+                            'movie_id': movie_ids[zipf(n_movies, n_ratings)],
+                            'rating': rng.integers(1, 6, n_ratings)}).drop_duplicates(['user_id', 'movie_id'])
+
+    movie_rate = pd.DataFrame({'rated': rng.choice(RATINGS, n_movies)}, index=pd.Index(movie_ids, name='movie_id'))
+    return full_graph.set_index('movie_id'), ratings.reset_index(drop=True), movie_rate
+
+
+def measure(function, setup=None, min_runs=3, min_time=0.5, max_runs=1000):
+    """
+    Function that measures the duration of a function, after one call to warm it up. When there is a setup function,
+    it is called before each call of the function out of the measured time and its result is the parameter of the
+    function, so no call reuses the state cached by a previous one
+    :param function: function without parameters, or with the result of setup as parameter
+    :param setup: function without parameters that creates the input of each call, None when there is no input
+    :param min_runs: minimum number of measured calls
+    :param min_time: minimum seconds of measured calls, more calls are made until it is reached
+    :param max_runs: maximum number of measured calls
+    :return: dictionary with the number of calls, the median, minimum and mean duration in milliseconds and the median
+    duration of the setup in milliseconds, about 0 when there is no setup
+    """
+    if setup is None:
+        setup, call = (lambda: None), (lambda value: function())
+    else:
+        call = function
+
+    call(setup())
+    durations = []
+    setups = []
+    start = time.perf_counter()
+    while len(durations) < max_runs and (len(durations) < min_runs or time.perf_counter() - start < min_time):
+        begin = time.perf_counter()
+        value = setup()
+        middle = time.perf_counter()
+        call(value)
+        durations.append((time.perf_counter() - middle) * 1000)
+        setups.append((middle - begin) * 1000)
+
+    durations = np.asarray(durations)
+    return {'runs': len(durations), 'median_ms': float(np.median(durations)), 'min_ms': float(durations.min()),
+            'mean_ms': float(durations.mean()), 'setup_ms': float(np.median(setups))}
+
+
+def cases(data: conversation.BotData, scratch: str):
+    """
+    Function that creates the benchmark of each function of utils.py and adjacency_matrix.py on the data of a size.
+    The functions of the turns of the conversation run on the first turn, the full graph, that is the largest one.
+    The sub graphs keep the counts of their pairs once calculated, so the functions of the sub graph run on a new one
+    created by the setup of each call
+    :param data: bot data of the synthetic datasets
+    :param scratch: directory of the files written by the functions
+    :return: dictionary with a (setup, function) tuple for each benchmark, see measure
+    """
+    index = data.prop_index
+
+    # the most popular pair, as the first value chosen by the user, and some watched movies
+    pair = int(np.argmax(index.pair_count))
+    prop, obj = index.props[index.pair_prop[pair]], index.objs[index.pair_obj[pair]]
+    objects = [index.pair_code[pair]]
+    watched = list(index.movies[:5])
+    weights = conversation.ConversationSession.WEIGHT_VEC_PR
+    weights_rank = conversation.ConversationSession.WEIGHT_VEC_RANK
+    files = iter(range(1 << 30))
+
+    def full():
+        return SubGraph(index)
+
+    def chosen():
+        return SubGraph(index).shrink(prop, obj)
+
+    return {
+        'utils.prop_most_pop': (full, lambda g: utils.prop_most_pop(g, prop)),
+        'utils.calculate_entropy': (full, lambda g: utils.calculate_entropy(g)),
+        'utils.show_props': (full, lambda g: utils.show_props(g, 0.33)),
+        'utils.shrink_graph': (full, lambda g: utils.shrink_graph(g, prop, obj)),
+        'utils.page_rank': (full, lambda g: utils.page_rank(g, data.pr_graph, watched, objects, weights, True)),
+        'utils.order_movies_by_pagerank': (chosen, lambda g: utils.order_movies_by_pagerank(
+            g, data.pr_graph, watched, objects, weights, True, k=1)),
+        'utils.movies_popularity': (None, lambda: utils.movies_popularity(index, data.ratings)),
+        'utils.order_movies_by_pop': (full, lambda g: utils.order_movies_by_pop(g, data.popularity, k=10)),
+        'utils.order_props_pr': (chosen, lambda g: utils.order_props_pr(g, data.g_pr_zscore, data.pr_graph, watched,
+                                                                        objects, [(prop, obj)], weights, weights_rank,
+                                                                        True)),
+        'utils.order_props_relevance': (chosen, lambda g: utils.order_props_relevance(g, data.g_zscore, [(prop, obj)],
+                                                                                      weights_rank)),
+        'utils.generate_global_zscore': (None, lambda: utils.generate_global_zscore(
+            data.full_prop_graph, data.ratings, os.path.join(scratch, "global_zscore.csv"), True)),
+        'utils.ask_parents': (None, lambda: utils.ask_parents(15)),
+        'utils.remove_films_by_age': (full, lambda g: utils.remove_films_by_age(10, data.movie_rate, g, False)),
+        'adjacency_matrix.movie_to_movie_adj_matrix': (None, lambda: adjacency_matrix.movie_to_movie_adj_matrix(
+            data.full_prop_graph, path=None)),
+        # the export resumes the completed chunks, so each call writes on a new directory
+        'adjacency_matrix.movie_user_prop_adj_matrix': (None, lambda: adjacency_matrix.movie_user_prop_adj_matrix(
+            data.full_prop_graph, data.ratings, os.path.join(scratch, "edges-" + str(next(files))), binary=True)),
+    }
+
+
+def run(sizes: list, budget_ms=200.0, min_time=0.5, max_ms=10000.0, only=None, seed=0, **generator_args):
+    """
+    Function that runs the benchmarks on synthetic datasets of increasing number of movies. When a function takes more
+    than max_ms on a size it is not run on the larger ones
+    :param sizes: numbers of movies of the datasets
+    :param budget_ms: latency budget of a turn of the conversation, in milliseconds
+    :param min_time: minimum seconds of measured calls of each function on each size
+    :param max_ms: duration of a call that stops the scaling of a function
+    :param only: names of the functions to run, None to run all of them
+    :param seed: seed of the generator of the datasets
+    :param generator_args: other arguments of synthetic_data
+    :return: report dictionary with the results of each function on each size and the scaling of each function
+    """
+    results = []
+    stopped = set()
+    with tempfile.TemporaryDirectory() as scratch:
+        for n_movies in sorted(sizes):
+            full_graph, ratings, movie_rate = synthetic_data(n_movies, seed=seed, **generator_args)
+            begin = time.perf_counter()
+            data = conversation.BotData(full_graph, ratings, movie_rate, relevance.compute(full_graph, ratings))
+            build_ms = (time.perf_counter() - begin) * 1000
+            size = {'movies': n_movies, 'rows': len(full_graph), 'ratings': len(ratings),
+                    'nodes': int(data.pr_graph.n_nodes), 'edges': int(len(data.pr_graph._indices) // 2)}
+            print("Size " + str(size) + " built in " + str(round(build_ms)) + " ms")
+
+            for name, (setup, function) in cases(data, scratch).items():
+                if (only is not None and name not in only) or name in stopped:
+                    continue
+                # the functions print their progress
+                with contextlib.redirect_stdout(io.StringIO()):
+                    measured = measure(function, setup, min_time=min_time)
+                results.append(dict(size, function=name, **measured))
+                print("  " + name + ": " + str(round(measured['median_ms'], 3)) + " ms")
+                if measured['median_ms'] > max_ms:
+                    stopped.add(name)
+
+    return {'format': FORMAT_VERSION,
+            'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                            'pandas': pd.__version__, 'scipy': scipy.__version__, 'machine': platform.machine(),
+                            'processor': platform.processor(), 'time': time.strftime("%Y-%m-%dT%H:%M:%S")},
+            'settings': dict(generator_args, sizes=sorted(sizes), budget_ms=budget_ms, seed=seed),
+            'results': results, 'scaling': scaling(results, budget_ms)}
+
+
+def scaling(results: list, budget_ms: float):
+    """
+    Function that fits the duration of each function as a power of the number of movies, median_ms = a * movies ^ b,
+    and finds the largest number of movies that meets the latency budget
+    :param results: results of the benchmarks, see run
+    :param budget_ms: latency budget, in milliseconds
+    :return: dictionary with the sizes, durations, exponent b, largest measured size within the budget and the size
+    where the fit reaches the budget of each function, None when it is far from the measured sizes
+    """
+    curves = {}
+    frame = pd.DataFrame(results)
+    for name, rows in frame.groupby('function', sort=False):
+        movies = rows['movies'].to_numpy(dtype=float)
+        median = rows['median_ms'].to_numpy()
+        within = movies[median <= budget_ms]
+
+        exponent = None
+        estimated = None
+        if len(rows) > 1 and (median > 0).all():
+            exponent, intercept = np.polyfit(np.log(movies), np.log(median), 1)
+            # a flat curve does not reach the budget on a useful size, so only close extrapolations are reported
+            if exponent >= MIN_EXPONENT:
+                estimated = float(np.exp((np.log(budget_ms) - intercept) / exponent))
+                estimated = estimated if estimated <= MAX_EXTRAPOLATION * movies.max() else None
+            exponent = float(exponent)
+
+        curves[name] = {'movies': movies.astype(int).tolist(), 'median_ms': median.tolist(), 'exponent': exponent,
+                        'max_movies_within_budget': int(within.max()) if len(within) else None,
+                        'estimated_movies_at_budget': estimated}
+    return curves
+
+
+def compare(report: dict, baseline: dict, tolerance=0.2):
+    """
+    Function that compares the durations of a report with a baseline report
+    :param report: report of run
+    :param baseline: report of run of a previous version
+    :param tolerance: relative increase of the median duration considered a regression
+    :return: list of dictionaries with the function, movies, the median durations and their ratio of the results of
+    both reports, and if it is a regression
+    """
+    keys = ['function', 'movies']
+    new = pd.DataFrame(report['results'])[keys + ['median_ms']]
+    old = pd.DataFrame(baseline['results'])[keys + ['median_ms']]
+    both = new.merge(old, on=keys, suffixes=('', '_baseline'))
+    both['ratio'] = both['median_ms'] / both['median_ms_baseline']
+    both['regression'] = both['ratio'] > 1 + tolerance
+    return both.to_dict('records')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the functions of utils.py and adjacency_matrix.py on "
+                                                 "synthetic datasets of increasing size")
+    parser.add_argument("--sizes", default="500,1000,2000,4000,8000", help="numbers of movies, comma separated")
+    parser.add_argument("--props", type=int, default=8, help="number of properties")
+    parser.add_argument("--objects", type=int, default=200, help="number of objects of each property")
+    parser.add_argument("--values", type=int, default=2, help="objects of each property of each movie")
+    parser.add_argument("--ratings", type=int, default=50, help="mean number of ratings of each movie")
+    parser.add_argument("--budget-ms", type=float, default=200, help="latency budget of a turn")
+    parser.add_argument("--min-time", type=float, default=0.5, help="minimum seconds measured of each function")
+    parser.add_argument("--max-ms", type=float, default=10000, help="duration that stops the scaling of a function")
+    parser.add_argument("--only", default=None, help="functions to run, comma separated, eg utils.page_rank")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="./benchmark.json", help="json file of the report")
+    parser.add_argument("--baseline", default=None, help="json report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="relative slowdown considered a regression")
+    args = parser.parse_args()
+
+    result = run([int(s) for s in args.sizes.split(",")], args.budget_ms, args.min_time, args.max_ms,
+                 args.only.split(",") if args.only else None, args.seed, n_props=args.props,
+                 objs_per_prop=args.objects, values_per_prop=args.values, ratings_per_movie=args.ratings)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+
+    print("\nFunction: largest size within " + str(args.budget_ms) + " ms (measured / estimated)")
+    for function, curve in result['scaling'].items():
+        estimated = curve['estimated_movies_at_budget']
+        print(function + ": " + str(curve['max_movies_within_budget']) + " / " +
+              (str(int(estimated)) if estimated is not None else "-"))
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            comparison = compare(result, json.load(f), args.tolerance)
+        regressions = [c for c in comparison if c['regression']]
+        for c in regressions:
+            print("Regression " + c['function'] + " with " + str(c['movies']) + " movies: " +
+                  str(round(c['median_ms_baseline'], 3)) + " ms -> " + str(round(c['median_ms'], 3)) + " ms")
+        print(str(len(regressions)) + " regressions of " + str(len(comparison)) + " results")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,215 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# name of the description of the columns of a table and default directory of the tables of the datasets
+TABLE = "table.json"
+STORE = "../dataset/columnar"
+
+
+def save_strings(path: str, values):
+    """
+    Function that saves a column of strings as a utf-8 buffer with the offsets of each string, so it can be memory
+    mapped by np.load
+    :param path: path of the column, the files path.bytes.npy and path.offsets.npy are written
+    :param values: strings of the column
+    """
+    encoded = [str(v).encode('utf-8') for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    np.save(path + ".bytes.npy", np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    np.save(path + ".offsets.npy", offsets)
+
+
+def load_strings(path: str, mmap_mode='r'):
+    """
+    Function that reads a column of strings saved by save_strings
+    :param path: path of the column
+    :param mmap_mode: mode to memory map the files, see np.load, None to read them
+    :return: array of python strings
+    """
+    buffer = np.load(path + ".bytes.npy", mmap_mode=mmap_mode)
+    offsets = np.load(path + ".offsets.npy", mmap_mode=mmap_mode)
+    data = buffer.tobytes()
+    values = np.empty(len(offsets) - 1, dtype=object)
+    values[:] = [data[a:b].decode('utf-8') for a, b in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    return values
+
+
+def file_checksum(path: str, block=1 << 20):
+    """
+    Function that calculates the sha256 of a file reading it by blocks
+    :param path: path of the file
+    :param block: size of the blocks in bytes
+    :return: hexadecimal digest
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def replace_dir(tmp: str, path: str):
+    """
+    Function that moves a directory written on a temporary path to its final path, replacing the old one
+    :param tmp: temporary directory
+    :param path: final directory
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+
+
+def save_table(directory: str, frame: pd.DataFrame, source=None):
+    """
+    Function that saves a DataFrame by columns, one npy file for each numeric column and, for the other columns, the
+    int32 code of each row and the dictionary of the distinct strings, so the codes are the integer ids of the values
+    :param directory: directory of the table
+    :param frame: DataFrame to save, the index is not saved
+    :param source: path of the file the table was converted from, its size and modification time are saved to check
+    if the table is up to date, see is_current
+    """
+    tmp = directory + ".tmp"
+    os.makedirs(tmp, exist_ok=True)
+
+    columns = []
+    for name in frame.columns:
+        column = frame[name]
+        if pd.api.types.is_numeric_dtype(column) or pd.api.types.is_bool_dtype(column):
+            np.save(os.path.join(tmp, name + ".npy"), column.to_numpy())
+            columns.append({'name': name, 'kind': 'numeric'})
+        else:
+            codes, dictionary = pd.factorize(column)
+            np.save(os.path.join(tmp, name + ".codes.npy"), codes.astype(np.int32))
+            save_strings(os.path.join(tmp, name + ".dict"), dictionary)
+            columns.append({'name': name, 'kind': 'dictionary', 'size': len(dictionary)})
+
+    description = {'rows': len(frame), 'columns': columns}
+    if source is not None:
+        stat = os.stat(source)
+        description['source'] = {'path': source, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                 'sha256': file_checksum(source)}
+    with open(os.path.join(tmp, TABLE), 'w') as f:
+        json.dump(description, f, indent=2)
+
+    replace_dir(tmp, directory)
+
+
+def load_codes(directory: str, name: str, mmap_mode='r'):
+    """
+    Function that reads a dictionary encoded column without decoding the strings of the rows
+    :param directory: directory of the table
+    :param name: name of the column
+    :param mmap_mode: mode to memory map the files, see np.load, None to read them
+    :return: memory mapped array with the code of each row, -1 for missing values, and array with the dictionary
+    """
+    return (np.load(os.path.join(directory, name + ".codes.npy"), mmap_mode=mmap_mode),
+            load_strings(os.path.join(directory, name + ".dict"), mmap_mode))
+
+
+def load_table(directory: str, columns=None, mmap_mode='r', decode=True):
+    """
+    Function that reads a table saved by save_table. The numeric columns are memory mapped, so processes reading the
+    same table share their pages
+    :param directory: directory of the table
+    :param columns: names of the columns to read, None to read all of them
+    :param mmap_mode: mode to memory map the files, see np.load, None to read them
+    :param decode: True to decode the dictionary encoded columns to strings, False to read them as categorical columns
+    with the codes of the table, so the string of each row is never created and pd.factorize uses the codes
+    :return: DataFrame with the columns
+    """
+    with open(os.path.join(directory, TABLE)) as f:
+        description = json.load(f)
+
+    data = {}
+    for column in description['columns']:
+        name = column['name']
+        if columns is not None and name not in columns:
+            continue
+        if column['kind'] == 'numeric':
+            data[name] = np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+        else:
+            codes, dictionary = load_codes(directory, name, mmap_mode)
+            if not decode:
+                data[name] = pd.Categorical.from_codes(codes, dictionary)
+                continue
+            # the code -1 of missing values selects the nan appended to the dictionary
+            data[name] = np.append(dictionary, np.nan)[codes]
+
+    names = [c['name'] for c in description['columns'] if columns is None or c['name'] in columns]
+    return pd.DataFrame({name: data[name] for name in names}, copy=False)
+
+
+def is_current(directory: str, source: str):
+    """
+    Function that checks if a table was converted from the current version of its source file
+    :param directory: directory of the table
+    :param source: path of the source file
+    :return: True if the table exists and the size and modification time of the source did not change, False if the
+    source does not exist
+    """
+    if not os.path.isfile(os.path.join(directory, TABLE)) or not os.path.exists(source):
+        return False
+
+    with open(os.path.join(directory, TABLE)) as f:
+        saved = json.load(f).get('source')
+    stat = os.stat(source)
+    return saved is not None and saved['size'] == stat.st_size and saved['mtime_ns'] == stat.st_mtime_ns
+
+
+def read_table(source: str, store=STORE, columns=None, decode=True, **read_csv_args):
+    """
+    Function that reads a dataset from the columnar store when its table is up to date, else from the csv file. The
+    store can be deployed without the csv files, then the table is read even though it can not be checked
+    :param source: path of the csv file
+    :param store: directory of the tables, the table of a file is named after it without the extension
+    :param columns: names of the columns to read, None to read all of them
+    :param decode: False to read the string columns of the table as categorical columns, see load_table
+    :param read_csv_args: arguments of pd.read_csv to read the csv file, eg sep and names
+    :return: DataFrame with the dataset
+    """
+    directory = table_path(source, store)
+    if store is not None and (is_current(directory, source) or
+                              (not os.path.exists(source) and os.path.isfile(os.path.join(directory, TABLE)))):
+        return load_table(directory, columns, decode=decode)
+
+    frame = pd.read_csv(source, **read_csv_args)
+    return frame if columns is None else frame[columns]
+
+
+def table_path(source: str, store=STORE):
+    """
+    :param source: path of the csv file
+    :param store: directory of the tables
+    :return: directory of the table of the file
+    """
+    if store is None:
+        return None
+    return os.path.join(store, os.path.splitext(os.path.basename(source))[0])
+
+
+# datasets of the bot and the arguments to read their csv files
+DATASETS = {'props': ("../WikidataIntegration/wikidata_integration_small.csv", {}),
+            'ratings': ("../dataset/1851_movies_ratings.txt",
+                        {'sep': '\t', 'header': None, 'names': ['user_id', 'movie_id', 'rating']}),
+            'rated': ("../WikidataIntegration/rated_movies.csv", {})}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the datasets of the bot to the columnar store")
+    parser.add_argument("--store", default=STORE)
+    parser.add_argument("--force", action="store_true", help="convert even if the tables are up to date")
+    args = parser.parse_args()
+
+    for path, read_args in DATASETS.values():
+        table = table_path(path, args.store)
+        if not args.force and is_current(table, path):
+            print("Up to date " + table)
+            continue
+        save_table(table, pd.read_csv(path, **read_args), source=path)
+        print("Converted " + path + " to " + table)
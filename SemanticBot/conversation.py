@@ -0,0 +1,498 @@
+import copy
+import numpy as np
+import pandas as pd
+import utils
+import columnar
+import instrumentation
+import pagerank
+import relevance
+from graph import PageRankGraph
+from property_index import PropertyIndex
+from subgraph import SubGraph
+from vocabulary import NodeVocabulary
+from bandit import thompson_sampling as ts
+
+
+class BotData:
+    """
+    Datasets and indexes of the bot. They are loaded once per process and shared, read only, by all the
+    conversations. Only the pagerank cache is updated by the conversations. New data creates a new BotData, see ingest
+    """
+
+    def __init__(self, full_prop_graph: pd.DataFrame, ratings: pd.DataFrame, movie_rate: pd.DataFrame,
+                 g_zscore):
+        """
+        Bot data constructor
+        :param full_prop_graph: full graph of the movie dataset with movie id as index
+        :param ratings: ratings dataset in the format user_id, movie_id, rating
+        :param movie_rate: age rating of the movies (PG, R, etc) with movie id as index
+        :param g_zscore: global relevance with the count and zscores of the (prop, obj) pairs, see
+        relevance.GlobalRelevance
+        """
+        self.full_prop_graph = full_prop_graph
+        self.ratings = ratings
+        self.movie_rate = movie_rate
+        self.g_zscore = g_zscore
+
+        self.vocabulary = NodeVocabulary.from_data(ratings, full_prop_graph)
+        self.prop_index = PropertyIndex(full_prop_graph, self.vocabulary)
+        self.pr_graph = PageRankGraph(ratings, full_prop_graph, self.vocabulary)
+        self.pr_cache = pagerank.PageRankCache()
+        self.g_pr_zscore = self.prop_index.pair_values(g_zscore['pr_zscore'])
+        self.popularity = utils.movies_popularity(self.prop_index, ratings)
+        self.titles = self.prop_index.table['title'].groupby(level=0).first()
+
+    def ingest(self, ratings=None, full_prop_graph=None, movie_rate=None):
+        """
+        Function that adds new ratings, property rows and age ratings to the data of the bot without reading the
+        datasets again. The pagerank graph is extended with the new edges, the counts and zscores of the pairs are
+        calculated from the new index and the global pagerank starts from the current one. This data is not changed,
+        so the conversations that already started keep using it and the new ones use the returned data
+        :param ratings: new ratings in the format user_id, movie_id, rating, None for no new ratings
+        :param full_prop_graph: new rows of the property graph with movie id as index, None for no new rows
+        :param movie_rate: age rating of new movies, or new age rating of movies, with movie id as index
+        :return: bot data with the new data
+        """
+        if ratings is None:
+            ratings = self.ratings.iloc[:0]
+        if full_prop_graph is None:
+            full_prop_graph = self.full_prop_graph.iloc[:0]
+        ratings = ratings[list(self.ratings.columns)]
+        full_prop_graph = full_prop_graph[list(self.full_prop_graph.columns)]
+        codes = full_prop_graph['obj_code'].astype(str).to_numpy(dtype=object)
+
+        data = BotData.__new__(BotData)
+        data.ratings = pd.concat([self.ratings, ratings], ignore_index=True)
+        data.full_prop_graph = pd.concat([self.full_prop_graph, full_prop_graph])
+        data.movie_rate = self.movie_rate
+        if movie_rate is not None:
+            data.movie_rate = pd.concat([self.movie_rate.drop(movie_rate.index, errors='ignore'),
+                                         movie_rate[list(self.movie_rate.columns)]])
+
+        data.vocabulary = self.vocabulary.extend(ratings['user_id'],
+                                                 np.concatenate([ratings['movie_id'].to_numpy(dtype=np.int64),
+                                                                 full_prop_graph.index.to_numpy(dtype=np.int64)]),
+                                                 codes)
+        data.pr_graph = self.pr_graph.extend(data.vocabulary, ratings, full_prop_graph)
+        data.pr_cache = pagerank.PageRankCache()
+
+        # the index only changes with new property rows, otherwise only its objects move to other nodes
+        if len(full_prop_graph) > 0:
+            data.prop_index = PropertyIndex(data.full_prop_graph, data.vocabulary)
+        else:
+            data.prop_index = copy.copy(self.prop_index)
+            data.prop_index.code_node = data.vocabulary.object_ids(
+                self.prop_index.codes.astype(str).to_numpy(dtype=object))
+
+        data.g_zscore = relevance.compute(data.full_prop_graph, data.ratings, self.g_zscore, data.prop_index)
+        data.g_pr_zscore = data.prop_index.pair_values(data.g_zscore['pr_zscore'])
+
+        popularity = np.zeros(len(data.prop_index.movies), dtype=np.int64)
+        popularity[data.prop_index.movie_codes(self.prop_index.movies)] = self.popularity
+        data.popularity = popularity + utils.movies_popularity(data.prop_index, ratings)
+
+        data.titles = self.titles
+        if len(full_prop_graph) > 0:
+            data.titles = pd.concat([self.titles, full_prop_graph['title']]).groupby(level=0).first()
+        return data
+
+
+def load_data(prop_path="../WikidataIntegration/wikidata_integration_small.csv",
+              ratings_path="../dataset/1851_movies_ratings.txt",
+              rated_path="../WikidataIntegration/rated_movies.csv",
+              relevance_path="./global_relevance", store_path=columnar.STORE):
+    """
+    Function that reads the datasets and builds the indexes of the bot
+    :param prop_path: path of the property graph obtained from wikidata
+    :param ratings_path: path of the ratings dataset
+    :param rated_path: path of the age rating of the movies
+    :param relevance_path: directory of the global relevance artifacts, see relevance.py. They are built if they do
+    not exist or are outdated
+    :param store_path: directory of the columnar tables of the datasets, see columnar.py. The csv files are read when
+    their tables do not exist or are outdated, None to always read the csv files
+    :return: bot data shared by the conversations
+    """
+    # the strings of the property graph are coded by the index, so they are read as the codes of the store
+    full_prop_graph = columnar.read_table(prop_path, store_path, decode=False)
+    full_prop_graph = full_prop_graph.set_index('movie_id')
+
+    ratings = columnar.read_table(ratings_path, store_path, sep='\t', header=None,
+                                  names=['user_id', 'movie_id', 'rating'])
+
+    movie_rate = columnar.read_table(rated_path, store_path, columns=['movie_id', 'rated'])
+    movie_rate = movie_rate.set_index('movie_id')
+
+    # the version of the artifacts is identified by the format and the checksums of the inputs, so they are only built
+    # when they do not exist, the datasets changed or the format changed
+    relevance.build(prop_path, ratings_path, relevance_path)
+    g_zscore = relevance.load(relevance_path)
+
+    return BotData(full_prop_graph, ratings, movie_rate, g_zscore)
+
+
+class LocalRanker:
+    """
+    Ranker of the properties and movies of the conversations that runs on the process of the conversation
+    """
+
+    def order_props(self, session):
+        """
+        Function that orders the properties of the sub graph of a conversation
+        :param session: conversation session
+        :return: ranked cursor of the properties, see utils.order_props_pr
+        """
+        return utils.order_props_pr(session.sub_graph, session.data.g_pr_zscore, session.data.pr_graph,
+                                    session.watched, session.prefered_objects, session.prefered_prop,
+                                    session.WEIGHT_VEC_PR, session.WEIGHT_VEC_RANK, True, session.pr_state,
+                                    session.data.pr_cache, lazy=True)
+
+    def order_movies(self, session):
+        """
+        Function that returns the best movie of the sub graph of a conversation
+        :param session: conversation session
+        :return: DataFrame with the best movie, see utils.order_movies_by_pagerank
+        """
+        return utils.order_movies_by_pagerank(session.sub_graph, session.data.pr_graph, session.watched,
+                                              session.prefered_objects, session.WEIGHT_VEC_PR, True, session.pr_state,
+                                              session.data.pr_cache, k=1)
+
+
+class ConversationSession:
+    """
+    Conversation with one user, without input and output. Each step function receives the answer of the user and
+    returns a dictionary with the state of the conversation, that is the kind of answer expected next, the text to show
+    to the user and the structured data of the turn. The states are:
+    age: expects the age of the user, see answer_age
+    parents: expects yes or no to the question if the movie will be watched with the parents, see respond
+    property: expects a property of the movies, see choose_property
+    object: expects a value of the property or "Next Page" and "Previous Page", see respond
+    ask: expects the number of a suggested property, "Next Page", "Previous Page" or "Recommend", see respond
+    recommend: expects yes, no or watched for the recommended movie, see respond
+    end: the conversation finished
+    """
+
+    # number of values of a property and of suggested properties on each page
+    OBJECTS_PAGE = 10
+    PROPERTIES_PAGE = 5
+
+    # weights of the personalization of the pagerank and of the formula of the properties ranking
+    WEIGHT_VEC_PR = [0.8, 0.2]
+    WEIGHT_VEC_RANK = [1/3, 1/3, 1/3]
+
+    def __init__(self, data: BotData, bandit=None, ranker=None, prior=None):
+        """
+        Conversation session constructor
+        :param data: bot data shared by the conversations
+        :param bandit: bandit to decide when to ask and recommend, None to use a thompson sampling bandit
+        :param ranker: ranker of the properties and movies, None to rank on this process with LocalRanker
+        :param prior: prior of the bandit learned from the completed conversations, see bandit.prior.BanditPrior.
+        The bandit starts from the prior of the segment of the user and the conversation is added to it when it ends.
+        None to start the bandit without prior
+        """
+        self.data = data
+        self.ban = bandit if bandit is not None else ts.ThompsonSamplingBandit(2)
+        self.prior = prior
+        self.ban_start = None
+        self.ranker = ranker if ranker is not None else LocalRanker()
+        self.pr_state = pagerank.PageRankState()
+
+        self.state = None
+        self.age = None
+        self.sub_graph = SubGraph(data.prop_index)
+        self.watched = []
+        self.prefered_objects = []
+        self.prefered_prop = []
+        self.p_chosen = None
+        self.o_chosen = None
+
+        # action of the bandit on the turn, its reward and if the user asked for a recommendation
+        self.ask = 0
+        self.reward = 0
+        self.force_rec = False
+
+        # properties offered to the user and pagination of the values of a property and of the suggested properties
+        self.properties = None
+        self.page_start = 0
+        self.page_end = 0
+        self.objects = None
+        self.top_p = None
+        self.options = None
+        self.top_m = None
+
+    @instrumentation.turn
+    def start(self):
+        """
+        Function that starts the conversation
+        :return: response asking the age of the user
+        """
+        return self._response('age', "Hello, I'm here to help you choose a movie. What's your age? ")
+
+    @instrumentation.turn
+    def answer_age(self, age: int):
+        """
+        Function that receives the age of the user
+        :param age: age of the user
+        :return: response asking if the movie will be watched with the parents or asking a property
+        """
+        self.age = age
+        if self.prior is not None:
+            with instrumentation.span('bandit.prior'):
+                self.ban_start = self.prior.start(self.ban, self.segment())
+        if utils.ask_parents(age):
+            return self._response('parents', "Are you watching this movie with your parents? [yes/no]")
+
+        return self._filter_age(True)
+
+    @instrumentation.turn
+    def choose_property(self, prop: str):
+        """
+        Function that receives the property the user is interested in exploring
+        :param prop: property, eg director, one of the properties offered on the last response
+        :return: response with the first page of the most popular values of the property
+        """
+        if self.state != 'property' or prop not in self.properties:
+            raise ValueError("The property " + str(prop) + " is not one of the offered properties")
+        self.p_chosen = prop
+        self.objects = utils.prop_most_pop(self.sub_graph, prop)
+        self.page_start = 0
+        self.page_end = self.page_start + self.OBJECTS_PAGE
+        return self._objects_page("\nThese are the favorites along the characteristic:")
+
+    @instrumentation.turn
+    def respond(self, answer: str):
+        """
+        Function that receives the answer of the user to the last question of the conversation
+        :param answer: text typed by the user
+        :return: response of the bot
+        """
+        if self.state == 'parents':
+            return self._filter_age(answer != "no")
+        if self.state == 'object':
+            return self._answer_object(answer)
+        if self.state == 'ask':
+            return self._answer_properties(answer)
+        if self.state == 'recommend':
+            return self._answer_recommendation(answer)
+
+        raise ValueError("The conversation is not expecting an answer on the state " + str(self.state))
+
+    def segment(self):
+        """
+        Function that returns the segment of the user, the bandits of the users of the same segment share the prior
+        :return: age group of the user, None if the age is not known
+        """
+        if self.age is None:
+            return None
+        if self.age < 13:
+            return 'child'
+        if self.age < 18:
+            return 'teen'
+        return 'adult'
+
+    def checkpoint(self):
+        """
+        Function that saves the state of the conversation, to restore it if a step fails before finishing
+        :return: saved state, see rollback
+        """
+        saved = dict(self.__dict__)
+        for name in ['watched', 'prefered_objects', 'prefered_prop', 'options']:
+            saved[name] = copy.copy(saved[name])
+        saved['ban_state'] = self.ban.checkpoint()
+        saved['pr_state'] = copy.copy(self.pr_state)
+        saved['pr_state'].iterations = list(self.pr_state.iterations)
+        return saved
+
+    def rollback(self, saved: dict):
+        """
+        Function that restores a saved state of the conversation
+        :param saved: state saved by checkpoint
+        """
+        saved = dict(saved)
+        ban_state = saved.pop('ban_state')
+        self.__dict__.update(saved)
+        self.ban.rollback(ban_state)
+
+    def _filter_age(self, with_parents: bool):
+        self.sub_graph = utils.remove_films_by_age(self.age, self.data.movie_rate, self.sub_graph, with_parents)
+
+        text = []
+        if self.age < 13 and not with_parents:
+            text.append("Be careful when watching PG and TV-G rated movies, they may contain some materials might not "
+                        "like for young children")
+
+        properties = utils.show_props(self.sub_graph, 0.33)
+        self.properties = list(properties)
+        text.append("We have these characteristics from our movie database: \n")
+        text.append("\n".join(properties) + "\n")
+        text.append("From which one are you interested in exploring today?")
+        return self._response('property', "\n".join(text), properties=properties)
+
+    def _objects_page(self, header=None):
+        page = list(self.objects[max(self.page_start, 0):max(self.page_end, 0)])
+
+        text = [] if header is None else [header]
+        text = text + page + ["Next Page ->"]
+        if self.page_start > 0:
+            text.append("<- Previous Page")
+        text.append("Which one are you looking for in one of these? "
+                    "Type \"Next Page\" or  \"Previous Page\"  to see more properties")
+        return self._response('object', "\n".join(text), objects=page)
+
+    def _answer_object(self, answer: str):
+        if answer == "Next Page":
+            self.page_start = self.page_end + 1
+            self.page_end = self.page_start + self.OBJECTS_PAGE
+            return self._objects_page()
+        if answer == "Previous Page":
+            self.page_end = self.page_start - 1
+            self.page_start = self.page_end - self.OBJECTS_PAGE
+            return self._objects_page()
+
+        if answer not in list(self.objects):
+            raise ValueError("The value " + str(answer) + " is not a value of the property " + str(self.p_chosen))
+
+        # create vectors of objects of preference and start to shrink the graph
+        self.o_chosen = answer
+        self.prefered_objects = [str(self.data.prop_index.obj_code(self.p_chosen, self.o_chosen))]
+        self.prefered_prop = [(self.p_chosen, self.o_chosen)]
+        return self._shrink_and_act()
+
+    def _shrink_and_act(self):
+        # get subgraph based on property chosen
+        self.sub_graph = utils.shrink_graph(self.sub_graph, self.p_chosen, self.o_chosen)
+        return self._act()
+
+    def _act(self):
+        # choose action, if ask suggest new properties else recommend movie
+        self.reward = 0
+        if not self.force_rec:
+            with instrumentation.span('bandit.pull'):
+                self.ask = self.ban.pull()
+        else:
+            self.ask = 0
+
+        if self.ask and len(self.sub_graph) > 1:
+            self.top_p = self.ranker.order_props(self)
+            self.page_start = 0
+            self.page_end = self.page_start + self.PROPERTIES_PAGE
+            return self._properties_page()
+
+        self.force_rec = False
+        self.top_m = self.ranker.order_movies(self)
+
+        # case if all movies with properties were recommended but no movies were accepted by user
+        if len(self.top_m.index) == 0:
+            return self._response('end', "\nYou have already watched all the movies with the properties you liked :(")
+
+        # show recommendation
+        m_id = self.top_m.index[0]
+        rated = self.data.movie_rate.loc[m_id, 'rated']
+        title = self.data.titles.loc[m_id]
+        text = ["\nBased on your current preferences, this " + rated + " rated movie may be suited for you: ",
+                "\"" + title + "\"",
+                "Because it has these properties that are relevant to you: "]
+        for i in range(0, len(self.prefered_prop)):
+            t = self.prefered_prop[i]
+            text.append(str(i + 1) + ") " + str(t[0]) + " - " + str(t[1]))
+        text.append("Did you like the recommendation, didn't like the recommendation or have you "
+                    "already watched the movie? (yes/no/watched)")
+
+        movie = {'movie_id': m_id, 'title': title, 'rated': rated, 'properties': list(self.prefered_prop)}
+        return self._response('recommend', "\n".join(text), movie=movie)
+
+    def _properties_page(self):
+        dif_properties = self.top_p.page(self.page_start, self.PROPERTIES_PAGE)
+        self.options = list(zip(dif_properties['prop'].astype(str), dif_properties['obj'].astype(str)))
+
+        text = ["\nWhich of these properties do you like the most? Type the number of the preferred attribute or type "
+                "\"Next Page\" or  \"Previous Page\"  to see more properties and \"Recommend\" to suggest a movie"]
+        for i in range(0, len(self.options)):
+            text.append(str(i + 1) + ") " + self.options[i][0] + " - " + self.options[i][1])
+        text.append("Recommend")
+        text.append("Next Page ->")
+        if self.page_start > 0:
+            text.append("<- Previous Page")
+
+        return self._response('ask', "\n".join(text), options=list(self.options))
+
+    def _answer_properties(self, answer: str):
+        try:
+            value = int(answer)
+
+        except ValueError:
+            if answer == "Next Page":
+                self.page_start = self.page_end
+                self.page_end = self.page_start + self.PROPERTIES_PAGE
+                return self._properties_page()
+            if answer == "Previous Page":
+                self.page_end = self.page_start
+                self.page_start = self.page_end - self.PROPERTIES_PAGE
+                return self._properties_page()
+
+            # any other answer asks for a recommendation
+            self.force_rec = True
+            value = 0
+
+        # if user chose prop, get the prop, the obj and obj code and append it to the favorites properties
+        if not self.force_rec and 0 < value <= len(self.options):
+            self.p_chosen, self.o_chosen = self.options[value - 1]
+            self.prefered_objects.append(str(self.data.prop_index.obj_code(self.p_chosen, self.o_chosen)))
+            self.prefered_prop.append((self.p_chosen, self.o_chosen))
+            if value == 1:
+                self.reward = 1
+
+        ended = self._update()
+        if ended is not None:
+            return ended
+        return self._shrink_and_act()
+
+    def _answer_recommendation(self, answer: str):
+        m_id = self.top_m.index[0]
+
+        # if liked the recommendation end conversation
+        # else if watched add movie to the watched ones
+        if answer == "yes":
+            self._update_bandit()
+            return self._response('end', "\nHave a good time watching the movie \"" + self.data.titles.loc[m_id] +
+                                  "\". Please come again!", movie_id=m_id)
+
+        if answer == "watched":
+            self.reward = 1
+            self.watched.append(m_id)
+        self.sub_graph = self.sub_graph.drop(m_id)
+
+        ended = self._update()
+        if ended is not None:
+            return ended
+
+        # while user did not like recommendation do not shrink graph again
+        if answer == "no" or answer == "watched":
+            return self._act()
+        return self._shrink_and_act()
+
+    def _update(self):
+        self._update_bandit()
+
+        # if there are no movies to recommend end conversation
+        if len(self.sub_graph) == 0:
+            return self._response('end', "\nThere are no movies that corresponds to your preferences on our database "
+                                         "or you already watched them all")
+        return None
+
+    def _update_bandit(self):
+        # updated bandit based on the response of the user
+        if not self.force_rec:
+            with instrumentation.span('bandit.update'):
+                self.ban.update(self.ask, self.reward)
+
+    def _response(self, state: str, text: str, **data):
+        # the bandit of a completed conversation is added to the prior once
+        if state == 'end' and self.ban_start is not None:
+            with instrumentation.span('bandit.prior'):
+                self.prior.add(self.ban, self.ban_start, self.segment())
+            self.ban_start = None
+
+        self.state = state
+        response = {'state': state, 'text': text}
+        response.update(data)
+        return response
@@ -0,0 +1,176 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from vocabulary import NodeVocabulary
+
+
+class PageRankGraph:
+    """
+    Integer indexed graph of users, movies and objects (eg Q1245) used on the personalized PageRank, with the nodes
+    of a NodeVocabulary. The graph is built only once from the ratings of the users and from the full property graph,
+    new ratings and properties create an extended graph (see extend). On each turn of the conversation the movies that
+    are not on the sub graph have their property edges masked instead of creating a new graph
+    """
+
+    # name of the node that represents the user of the conversation, that is connected to the watched movies
+    SESSION = 'session'
+
+    def __init__(self, ratings: pd.DataFrame, full_graph: pd.DataFrame, vocabulary=None):
+        """
+        PageRank graph constructor
+        :param ratings: ratings dataset with user_id and movie_id columns, each rating is an edge between the user and
+            the movie
+        :param full_graph: full graph of the movie dataset with the movie id as index
+        :param vocabulary: node vocabulary of the datasets, None to create it
+        """
+        if vocabulary is None:
+            vocabulary = NodeVocabulary.from_data(ratings, full_graph)
+        self._set_nodes(vocabulary)
+
+        rows, cols = self._edges(ratings, full_graph)
+        self._set_edges(rows, cols)
+
+    def extend(self, vocabulary: NodeVocabulary, ratings=None, full_graph=None):
+        """
+        Function that creates the graph with new ratings and property rows. The edges of this graph are moved to the
+        nodes of the extended vocabulary and only the new rows are encoded, so the graph is not built again from the
+        datasets
+        :param vocabulary: vocabulary extended with the new users, movies and objects, see NodeVocabulary.extend
+        :param ratings: new ratings with user_id and movie_id columns, None for no new ratings
+        :param full_graph: new rows of the property graph with the movie id as index, None for no new rows
+        :return: PageRank graph
+        """
+        graph = PageRankGraph.__new__(PageRankGraph)
+        graph._set_nodes(vocabulary)
+
+        nodes = np.append(vocabulary.remap(self.vocabulary), graph.session_node)
+        rows = nodes[np.repeat(np.arange(self.n_nodes), np.diff(self._indptr))]
+        cols = nodes[self._indices]
+        new_rows, new_cols = graph._edges(ratings, full_graph)
+
+        # the nodes keep their order on the extended vocabulary, so the old keys are still sorted and the stable sort
+        # only merges the new ones
+        graph._set_edges(np.concatenate([rows, new_rows]), np.concatenate([cols, new_cols]), kind='stable')
+        return graph
+
+    def _set_nodes(self, vocabulary: NodeVocabulary):
+        """
+        Function that sets the nodes of the graph, the ones of the vocabulary, ordered by type: users, movies and
+        objects, and the session user as the last node
+        :param vocabulary: node vocabulary of the datasets
+        """
+        self.vocabulary = vocabulary
+        self.movies = vocabulary.movies
+        self.movie_offset = vocabulary.movie_offset
+        self.object_offset = vocabulary.object_offset
+        self.session_node = vocabulary.n_nodes
+        self.n_nodes = self.session_node + 1
+
+    def _edges(self, ratings=None, full_graph=None):
+        """
+        Function that encodes the edges of the ratings and of the property graph, in both directions
+        :param ratings: ratings dataset with user_id and movie_id columns, None for no ratings
+        :param full_graph: full graph of the movie dataset with the movie id as index, None for no property rows
+        :return: arrays with the origin and destination nodes of the edges
+        """
+        rate_u = rate_m = prop_m = prop_o = np.empty(0, dtype=np.int32)
+
+        # user to movie edges are always on the graph, movie to object edges depend on the sub graph
+        if ratings is not None:
+            rate_u = self.vocabulary.user_ids(ratings['user_id'])
+            rate_m = self.vocabulary.movie_ids(ratings['movie_id'])
+        if full_graph is not None:
+            prop_m = self.vocabulary.movie_ids(full_graph.index)
+            prop_o = self.vocabulary.object_ids(full_graph['obj_code'].astype(str).to_numpy(dtype=object))
+
+        rows = np.concatenate([rate_u, rate_m, prop_m, prop_o]).astype(np.int64)
+        cols = np.concatenate([rate_m, rate_u, prop_o, prop_m]).astype(np.int64)
+        return rows, cols
+
+    def _set_edges(self, rows: np.ndarray, cols: np.ndarray, kind='quicksort'):
+        """
+        Function that creates the csr structure of the graph
+        :param rows: origin node of each edge
+        :param cols: destination node of each edge
+        :param kind: algorithm of the sort of the edges
+        """
+        # the graph is simple and undirected, so repeated edges are collapsed. The keys are sorted by row and column,
+        # that is the order of the entries of a csr matrix
+        keys = np.sort(rows * self.n_nodes + cols, kind=kind)
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+        rows = keys // self.n_nodes
+        cols = keys % self.n_nodes
+
+        self._indices = cols.astype(np.int32)
+        self._indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=self.n_nodes))]).astype(np.int64)
+
+        # entries of property edges and the movie of each one of them, to mask it when the movie is not on sub graph
+        is_prop = (rows >= self.object_offset) | (cols >= self.object_offset)
+        self._prop_entries = np.flatnonzero(is_prop)
+        self._prop_movies = np.minimum(rows[is_prop], cols[is_prop]) - self.movie_offset
+
+    def movie_mask(self, movie_ids):
+        """
+        Function that creates the mask of the movies of a sub graph
+        :param movie_ids: ids of the movies on the sub graph
+        :return: boolean array with one position for each movie on the graph
+        """
+        mask = np.zeros(len(self.movies), dtype=bool)
+        codes = self.movies.get_indexer(np.asarray(movie_ids, dtype=np.int64))
+        mask[codes[codes >= 0]] = True
+        return mask
+
+    def movie_nodes(self, movie_ids):
+        """
+        Function that returns the node of each movie, -1 if the movie is not on the graph
+        :param movie_ids: ids of the movies
+        :return: array with the node of the movies
+        """
+        return self.vocabulary.movie_ids(movie_ids)
+
+    def node_ids(self, names):
+        """
+        Function that returns the node of each name, -1 if the name is not on the graph
+        :param names: names of the nodes, eg U12, M456, Q1245 or session
+        :return: array with the node of the names
+        """
+        names = np.asarray(names, dtype=object)
+        nodes = self.vocabulary.encode(names)
+        nodes[names == self.SESSION] = self.session_node
+        return nodes
+
+    def node_names(self, nodes):
+        """
+        Function that returns the name of each node, to show or export the pagerank
+        :param nodes: nodes of the graph
+        :return: array with the names of the nodes
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        names = np.full(len(nodes), self.SESSION, dtype=object)
+        graph = nodes < self.session_node
+        names[graph] = self.vocabulary.decode(nodes[graph])
+        return names
+
+    def adjacency(self, movie_mask: np.ndarray, watched=()):
+        """
+        Function that creates the adjacency matrix of a turn of the conversation. The structure of the matrix is
+        shared with the full graph and the property edges of movies not on the mask are zero
+        :param movie_mask: boolean mask of the movies on the sub graph
+        :param watched: movies that the user watched, they are connected to the session node
+        :return: csr adjacency matrix with one row and column for each node
+        """
+        data = np.ones(len(self._indices))
+        data[self._prop_entries] = movie_mask[self._prop_movies]
+        adj = sparse.csr_matrix((data, self._indices, self._indptr), shape=(self.n_nodes, self.n_nodes))
+
+        watched_nodes = self.movie_nodes(np.unique(np.asarray(watched, dtype=np.int64)))
+        watched_nodes = watched_nodes[watched_nodes >= 0]
+        if len(watched_nodes) > 0:
+            session = np.full(len(watched_nodes), self.session_node)
+            session_edges = sparse.csr_matrix((np.ones(2 * len(watched_nodes)),
+                                               (np.concatenate([session, watched_nodes]),
+                                                np.concatenate([watched_nodes, session]))),
+                                              shape=(self.n_nodes, self.n_nodes))
+            adj = adj + session_edges
+
+        return adj
@@ -0,0 +1,470 @@
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import defaultdict
+import numpy as np
+
+# tracer of the process, None when the instrumentation is disabled
+_tracer = None
+_logger = logging.getLogger(__name__)
+_disabled = contextlib.nullcontext()
+
+# upper bounds of the buckets of the histograms, in seconds
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+CPROFILE = 'cprofile'
+TRACEMALLOC = 'tracemalloc'
+
+
+def enable(tracer):
+    """
+    Function that starts recording the spans and turns of the process
+    :param tracer: tracer that receives the measures
+    """
+    global _tracer
+    _tracer = tracer
+
+
+def disable():
+    """
+    Function that stops recording, the instrumented functions only check that the tracer is None
+    """
+    global _tracer
+    _tracer = None
+
+
+def traced(name=None):
+    """
+    Decorator that records the duration of each call of a function as a span
+    :param name: name of the span, None to use the name of the function
+    :return: decorator
+    """
+    def decorate(function):
+        label = name if name is not None else function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+            with tracer.span(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def span(name: str):
+    """
+    Function that records the duration of a block as a span, eg with span('bandit.pull'):
+    :param name: name of the span
+    :return: context manager
+    """
+    tracer = _tracer
+    return _disabled if tracer is None else tracer.span(name)
+
+
+def turn(function):
+    """
+    Decorator of the steps of a conversation session that records each call as a turn, see Tracer.turn
+    :param function: step of the session
+    :return: decorated step
+    """
+    @functools.wraps(function)
+    def wrapper(session, *args, **kwargs):
+        tracer = _tracer
+        if tracer is None:
+            return function(session, *args, **kwargs)
+        with tracer.turn(session, function.__name__):
+            return function(session, *args, **kwargs)
+    return wrapper
+
+
+def count(name: str, value=1):
+    """
+    Function that adds a value to a counter of the current turn, eg the pagerank iterations
+    :param name: name of the counter
+    :param value: value to add
+    """
+    tracer = _tracer
+    if tracer is not None:
+        tracer.count(name, value)
+
+
+class Tracer:
+    """
+    Receives the spans of the instrumented functions and the turns of the conversations and sends them to the sinks.
+    Each turn records its wall time, the size of the sub graph after it, the counters of the turn (eg pagerank
+    iterations and cache hits) and the time of each span called on it. The turns of a sampled fraction of the sessions
+    can also be profiled with cProfile or tracemalloc. The turn is kept per thread, so the spans of a ranking made on
+    other process are not added to it
+    """
+
+    def __init__(self, sinks: list, sample_rate=0.0, profile=CPROFILE, profile_dir="./profiles", seed=None):
+        """
+        Tracer constructor
+        :param sinks: sinks of the measures, see LogSink, HistogramSink and PrometheusSink
+        :param sample_rate: fraction of the sessions profiled
+        :param profile: CPROFILE to write the stats of each turn of a sampled session, that are read with pstats, or
+        TRACEMALLOC to record the peak memory of the turn and write its snapshot, that is read with
+        tracemalloc.Snapshot.load
+        :param profile_dir: directory of the profiles
+        :param seed: seed of the sampling of the sessions
+        """
+        if profile not in [CPROFILE, TRACEMALLOC]:
+            raise ValueError("unknown profile " + str(profile))
+        self.sinks = sinks
+        self.sample_rate = sample_rate
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self._random = random.Random(seed)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # only one turn is profiled at a time, the profilers are global to the process
+        self._profile_lock = threading.Lock()
+        # id, sampled and number of turns of each session
+        self._sessions = weakref.WeakKeyDictionary()
+        self._next_session = 0
+
+    @contextlib.contextmanager
+    def span(self, name: str):
+        """
+        Context manager that records the duration of a block
+        :param name: name of the span
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            record = getattr(self._local, 'turn', None)
+            if record is not None:
+                record['spans'][name] = record['spans'].get(name, 0.0) + seconds * 1000
+            for sink in self.sinks:
+                _safely(sink.span, name, seconds)
+
+    def count(self, name: str, value=1):
+        """
+        Function that adds a value to a counter of the current turn, it is ignored outside of the turns
+        :param name: name of the counter
+        :param value: value to add
+        """
+        record = getattr(self._local, 'turn', None)
+        if record is not None:
+            record['counts'][name] = record['counts'].get(name, 0) + value
+
+    @contextlib.contextmanager
+    def turn(self, session, step: str):
+        """
+        Context manager that records a turn of a conversation. A turn inside another turn of the same thread is part
+        of the outer one
+        :param session: conversation session
+        :param step: name of the step of the session
+        """
+        if getattr(self._local, 'turn', None) is not None:
+            yield
+            return
+
+        info = self._session(session)
+        record = {'session': info[0], 'turn': info[2], 'step': step, 'spans': {}, 'counts': {}}
+        profiler = _safely(self._start_profile) if info[1] else None
+        self._local.turn = record
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self._local.turn = None
+            if profiler is not None:
+                _safely(self._stop_profile, profiler, record)
+
+            record['wall_ms'] = seconds * 1000
+            record['state'] = session.state
+            record['nodes'], record['edges'] = _safely(_graph_size, session.sub_graph) or (None, None)
+            for sink in self.sinks:
+                _safely(sink.turn, record)
+
+    def flush(self):
+        """
+        Function that writes the measures of the sinks that keep them, eg at the end of the process
+        """
+        for sink in self.sinks:
+            _safely(sink.flush)
+
+    def _session(self, session):
+        """
+        Function that returns the information of a session and counts its turn, the session is sampled on its first
+        turn
+        :param session: conversation session
+        :return: list with the id of the session, if it is sampled and the number of the turn
+        """
+        with self._lock:
+            info = self._sessions.get(session)
+            if info is None:
+                info = [self._next_session, self._random.random() < self.sample_rate, 0]
+                self._next_session = self._next_session + 1
+                self._sessions[session] = info
+            info[2] = info[2] + 1
+            return list(info)
+
+    def _start_profile(self):
+        """
+        Function that starts the profiler of a turn of a sampled session
+        :return: profiler, True for tracemalloc and None if other turn is being profiled
+        """
+        if not self._profile_lock.acquire(blocking=False):
+            return None
+        try:
+            if self.profile == TRACEMALLOC:
+                started = not tracemalloc.is_tracing()
+                if started:
+                    tracemalloc.start()
+                tracemalloc.reset_peak()
+                return started
+
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return profiler
+        except Exception:
+            # eg other profiler of the process is active
+            self._profile_lock.release()
+            raise
+
+    def _stop_profile(self, profiler, record: dict):
+        """
+        Function that stops the profiler of a turn and writes the profile
+        :param profiler: profiler returned by _start_profile
+        :param record: measures of the turn, the path of the profile is added to it
+        """
+        # the profiler is stopped before writing, so the next turns can be profiled even if the write fails
+        snapshot = None
+        try:
+            if self.profile == TRACEMALLOC:
+                try:
+                    record['peak_memory_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+                    snapshot = tracemalloc.take_snapshot()
+                finally:
+                    if profiler:
+                        tracemalloc.stop()
+            else:
+                profiler.disable()
+        finally:
+            self._profile_lock.release()
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, "session-" + str(record['session']) + "-turn-" + str(record['turn']))
+        if snapshot is not None:
+            snapshot.dump(path + ".tracemalloc")
+            record['profile'] = path + ".tracemalloc"
+        else:
+            profiler.dump_stats(path + ".prof")
+            record['profile'] = path + ".prof"
+
+
+class LogSink:
+    """
+    Sink that logs each turn as a json line and, optionally, each span
+    """
+
+    def __init__(self, logger=None, level=logging.INFO, spans=False):
+        """
+        Log sink constructor
+        :param logger: logger of the measures, None to use the logger of the module
+        :param level: level of the messages
+        :param spans: True to also log each span, with level DEBUG
+        """
+        self.logger = logger if logger is not None else _logger
+        self.level = level
+        self.spans = spans
+
+    def span(self, name: str, seconds: float):
+        if self.spans:
+            self.logger.debug("span %s %.3f ms", name, seconds * 1000)
+
+    def turn(self, record: dict):
+        self.logger.log(self.level, "turn %s", json.dumps(record, default=str))
+
+    def flush(self):
+        pass
+
+
+class HistogramSink:
+    """
+    Sink that keeps in memory a histogram of the duration of each span and of the turns, the sum of the counters of
+    the turns and a histogram of the size of the graph
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        Histogram sink constructor
+        :param buckets: upper bounds of the buckets, in seconds
+        """
+        self.buckets = np.asarray(buckets, dtype=float)
+        # count of each bucket, the last one is infinite, and sum of the durations of each span and of the turns
+        self.counts = defaultdict(lambda: np.zeros(len(self.buckets) + 1, dtype=np.int64))
+        self.sums = defaultdict(float)
+        self.counters = defaultdict(float)
+        self.turns = 0
+        self.nodes = 0
+        self.edges = 0
+        self._lock = threading.Lock()
+
+    def span(self, name: str, seconds: float):
+        self._add(name, seconds)
+
+    def turn(self, record: dict):
+        with self._lock:
+            self.turns = self.turns + 1
+            self.nodes = self.nodes + record['nodes']
+            self.edges = self.edges + record['edges']
+            for name, value in record['counts'].items():
+                self.counters[name] = self.counters[name] + value
+        self._add('turn', record['wall_ms'] / 1000)
+
+    def flush(self):
+        pass
+
+    def percentile(self, name: str, q: float):
+        """
+        Function that estimates a percentile of the durations from the histogram
+        :param name: name of the span or 'turn'
+        :param q: percentile between 0 and 100
+        :return: upper bound of the bucket of the percentile, in seconds, infinity if it is on the last bucket and
+        None if there are no measures
+        """
+        with self._lock:
+            counts = self.counts[name].copy() if name in self.counts else None
+        if counts is None or counts.sum() == 0:
+            return None
+        position = int(np.searchsorted(np.cumsum(counts), q / 100 * counts.sum()))
+        return float(self.buckets[position]) if position < len(self.buckets) else float('inf')
+
+    def snapshot(self):
+        """
+        :return: dictionary with the count, sum in seconds and buckets of each histogram and the totals of the turns
+        """
+        with self._lock:
+            histograms = {name: {'count': int(counts.sum()), 'sum': self.sums[name], 'buckets': counts.tolist()}
+                          for name, counts in self.counts.items()}
+            return {'buckets': self.buckets.tolist(), 'histograms': histograms, 'counters': dict(self.counters),
+                    'turns': self.turns, 'nodes': self.nodes, 'edges': self.edges}
+
+    def _add(self, name: str, seconds: float):
+        """
+        Function that adds a duration to a histogram
+        :param name: name of the histogram
+        :param seconds: duration
+        """
+        bucket = int(np.searchsorted(self.buckets, seconds))
+        with self._lock:
+            self.counts[name][bucket] = self.counts[name][bucket] + 1
+            self.sums[name] = self.sums[name] + seconds
+
+
+class PrometheusSink(HistogramSink):
+    """
+    Histogram sink that writes the histograms on a file of the Prometheus text format, eg to the textfile collector of
+    the node exporter. The file is replaced only when it is complete
+    """
+
+    PREFIX = 'semanticbot'
+
+    def __init__(self, path: str, every=10.0, buckets=BUCKETS):
+        """
+        Prometheus sink constructor
+        :param path: prom file
+        :param every: minimum seconds between two writes of the file when turns are recorded
+        :param buckets: upper bounds of the buckets, in seconds
+        """
+        super().__init__(buckets)
+        self.path = path
+        self.every = every
+        self._last_write = time.monotonic()
+        # one write at a time, the turns of the threads of a server flush the same file
+        self._write_lock = threading.Lock()
+
+    def turn(self, record: dict):
+        super().turn(record)
+        if time.monotonic() - self._last_write >= self.every:
+            self.flush()
+
+    def flush(self):
+        with self._write_lock:
+            self._last_write = time.monotonic()
+            self._write(self.snapshot())
+
+    def _write(self, snapshot: dict):
+        """
+        Function that writes a snapshot of the histograms on a temporary file that replaces the prom file
+        :param snapshot: snapshot of the histograms, see HistogramSink.snapshot
+        """
+        bounds = [repr(b) for b in snapshot['buckets']] + ['+Inf']
+
+        lines = []
+        for metric, names in [('span', [n for n in snapshot['histograms'] if n != 'turn']), ('turn', ['turn'])]:
+            metric = self.PREFIX + "_" + metric + "_seconds"
+            lines.append("# HELP " + metric + " Duration of the " + ("instrumented functions" if 'span' in metric
+                                                                     else "turns of the conversations"))
+            lines.append("# TYPE " + metric + " histogram")
+            for name in names:
+                histogram = snapshot['histograms'].get(name)
+                if histogram is None:
+                    continue
+                label = 'name="' + name + '",' if name != 'turn' else ''
+                for bound, total in zip(bounds, np.cumsum(histogram['buckets'])):
+                    lines.append(metric + "_bucket{" + label + 'le="' + bound + '"} ' + str(int(total)))
+                lines.append(metric + "_sum" + ("{" + label[:-1] + "}" if label else "") + " " +
+                             repr(histogram['sum']))
+                lines.append(metric + "_count" + ("{" + label[:-1] + "}" if label else "") + " " +
+                             str(histogram['count']))
+
+        totals = dict(snapshot['counters'], turns=snapshot['turns'], graph_nodes=snapshot['nodes'],
+                      graph_edges=snapshot['edges'])
+        for name, value in sorted(totals.items()):
+            metric = self.PREFIX + "_" + name + "_total"
+            lines.append("# TYPE " + metric + " counter")
+            lines.append(metric + " " + repr(float(value)))
+
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            # mkstemp creates the file readable only by the owner, the collector may run as other user
+            os.chmod(tmp, 0o644)
+            with os.fdopen(fd, 'w') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+
+def _safely(function, *args):
+    """
+    Function that calls a function of the instrumentation, its errors are logged so they never fail the turn
+    :param function: function, eg of a sink
+    :param args: arguments of the function
+    :return: result of the function, None if it failed
+    """
+    try:
+        return function(*args)
+    except Exception:
+        _logger.exception("instrumentation error on " + getattr(function, '__qualname__', str(function)))
+        return None
+
+
+def _graph_size(sub_graph):
+    """
+    Function that measures the sub graph of a conversation
+    :param sub_graph: sub graph, see subgraph.SubGraph
+    :return: number of nodes, the movies and the objects of their properties, and of edges, the properties of the movies
+    """
+    index = sub_graph.prop_index
+    rows = sub_graph.rows()
+    objects = np.count_nonzero(np.bincount(index.row_code[rows], minlength=1))
+    return len(sub_graph) + int(objects), len(rows)
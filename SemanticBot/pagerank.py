@@ -0,0 +1,194 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import networkx as nx
+from scipy import sparse
+
+
+def personalization_vector(present: np.ndarray, preferences: np.ndarray, n_preferences: int, weight_vec: list):
+    """
+    Function that creates the personalization vector of the pagerank. The preferred nodes receive weight_vec[0]
+    divided by the number of preferences and the rest of the nodes weight_vec[1] divided by the number of nodes that
+    are not preferences, then the vector is normalized to sum one
+    :param present: boolean array with the nodes that are on the graph
+    :param preferences: nodes that the user liked, -1 for the ones that are not on the graph
+    :param n_preferences: number of preferences of the user, counting the ones that are not on the graph
+    :param weight_vec: list with size two and sum equal to one with the weights of the personalization to the preferred
+    nodes and the rest of the nodes
+    :return: personalization vector with one position for each node
+    """
+    n = present.sum()
+    value_watched = weight_vec[0] / n_preferences
+    value_all = weight_vec[1] / (n - n_preferences)
+
+    personalization = present * value_all
+    preferences = preferences[preferences >= 0]
+    personalization[preferences[present[preferences]]] = value_watched
+    return personalization / personalization.sum()
+
+
+def pagerank(adj: sparse.csr_matrix, personalization=None, alpha=0.85, tol=1.0e-6, max_iter=1000, x0=None):
+    """
+    Power iteration of the personalized pagerank on an undirected graph, with the same convergence criteria of the
+    networkx pagerank_scipy. Nodes without edges are not on the graph and have pagerank zero
+    :param adj: symmetric csr adjacency matrix of the graph
+    :param personalization: personalization vector that sums one, None to use the uniform distribution
+    :param alpha: damping factor
+    :param tol: error tolerance used to check convergence
+    :param max_iter: maximum number of iterations of the power method
+    :param x0: initial pagerank vector, None to start from the uniform distribution
+    :return: pagerank vector with one position for each node and the number of iterations
+    """
+    degree = np.asarray(adj.sum(axis=1)).ravel()
+    present = degree > 0
+    n = present.sum()
+    inv_degree = np.divide(1.0, degree, out=np.zeros(len(degree)), where=present)
+
+    if personalization is None:
+        personalization = present / n
+
+    # start from the warm start vector restricted to the nodes of the graph, if it is not empty
+    x = present / n
+    if x0 is not None:
+        start = x0 * present
+        if start.sum() > 0:
+            x = start / start.sum()
+
+    for i in range(max_iter):
+        xlast = x
+        x = alpha * adj.dot(xlast * inv_degree) + (1 - alpha) * personalization
+        if np.absolute(x - xlast).sum() < n * tol:
+            return x, i + 1
+
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+
+class PageRankState:
+    """
+    State of the pagerank of a conversation. Between the turns the graph changes very little, so each solve starts
+    from the pagerank of the last one and converges to the same values of a solve from the uniform distribution, within
+    the tolerance, in fewer iterations
+    """
+
+    def __init__(self, tol=1.0e-6, max_iter=1000):
+        """
+        PageRank state constructor
+        :param tol: error tolerance used to check convergence
+        :param max_iter: maximum number of iterations of the power method
+        """
+        self.tol = tol
+        self.max_iter = max_iter
+        # pagerank vector of the last solve
+        self.last = None
+        # number of iterations of each solve
+        self.iterations = []
+
+    def solve(self, adj: sparse.csr_matrix, personalization=None):
+        """
+        Function that runs the pagerank starting from the last vector of the conversation
+        :param adj: symmetric csr adjacency matrix of the graph
+        :param personalization: personalization vector that sums one, None to use the uniform distribution
+        :return: pagerank vector with one position for each node
+        """
+        x0 = self.last
+        if x0 is not None and len(x0) != adj.shape[0]:
+            x0 = None
+
+        x, n_iter = pagerank(adj, personalization, tol=self.tol, max_iter=self.max_iter, x0=x0)
+        self.last = x
+        self.iterations.append(n_iter)
+        return x
+
+
+class PageRankCache:
+    """
+    Least recently used cache of pagerank vectors, shared by all the conversations of the process. The solves are
+    identified by a fingerprint of the sub graph, the watched movies, the liked objects and the personalization
+    weights, so the property ranking and the movie ranking of the same turn run only one solve
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        """
+        PageRank cache constructor
+        :param max_bytes: maximum memory of the cached vectors, the least recently used are evicted when it is reached
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def fingerprint(n_nodes: int, movie_mask: np.ndarray, watched: list, objects: list, weight_vec: list,
+                    use_objs: bool):
+        """
+        Function that creates the key of a solve. The order of the watched movies and liked objects do not change the
+        pagerank, so they are sorted
+        :param n_nodes: number of nodes of the pagerank graph
+        :param movie_mask: boolean mask of the movies on the sub graph
+        :param watched: movies that the user watched
+        :param objects: codes of objects on the graph that the user liked (eg Q1245)
+        :param weight_vec: weights of the personalization to the preferences and the rest of the nodes
+        :param use_objs: boolean value to use on the pagerank or not the objects list that the user liked
+        :return: key of the solve
+        """
+        h = hashlib.blake2b(digest_size=16)
+        h.update(np.packbits(movie_mask).tobytes())
+        h.update(np.unique(np.asarray(watched, dtype=np.int64)).tobytes())
+        if use_objs:
+            h.update("\0".join(sorted(str(o) for o in objects)).encode())
+        return n_nodes, len(movie_mask), h.digest(), len(watched), tuple(weight_vec), bool(use_objs)
+
+    def get(self, key):
+        """
+        Function that returns the cached pagerank of a solve
+        :param key: fingerprint of the solve
+        :return: read only pagerank vector, None if it is not on the cache
+        """
+        with self._lock:
+            pr = self._entries.get(key)
+            if pr is None:
+                self.misses = self.misses + 1
+                return None
+
+            self.hits = self.hits + 1
+            self._entries.move_to_end(key)
+            return pr
+
+    def put(self, key, pr: np.ndarray):
+        """
+        Function that caches the pagerank of a solve and evicts the least recently used ones over the memory bound
+        :param key: fingerprint of the solve
+        :param pr: pagerank vector
+        """
+        if pr.nbytes > self.max_bytes:
+            return
+
+        pr = pr.copy()
+        pr.flags.writeable = False
+
+        with self._lock:
+            if key in self._entries:
+                self.nbytes = self.nbytes - self._entries.pop(key).nbytes
+
+            self._entries[key] = pr
+            self.nbytes = self.nbytes + pr.nbytes
+
+            while self.nbytes > self.max_bytes:
+                _, old = self._entries.popitem(last=False)
+                self.nbytes = self.nbytes - old.nbytes
+                self.evictions = self.evictions + 1
+
+    def clear(self):
+        """
+        Function that removes all the cached vectors, eg when the graph changes
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
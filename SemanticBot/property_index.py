@@ -0,0 +1,214 @@
+import numpy as np
+import pandas as pd
+
+
+class PropertyIndex:
+    """
+    Inverted index of the property graph. The rows of the graph are ordered by movie and the properties, objects and
+    (property, object) pairs are integer coded, so the lookups of the conversation take time proportional to the size
+    of the result instead of scanning the full graph
+    """
+
+    def __init__(self, full_graph: pd.DataFrame, vocabulary=None):
+        """
+        Property index constructor
+        :param full_graph: full graph of the movie dataset with the movie id as index and prop, obj and obj_code as
+        columns
+        :param vocabulary: node vocabulary of the pagerank graph, to map the object codes to their nodes. None to not
+        map them
+        """
+        # order rows by movie keeping the original order of the properties of each movie
+        movie_ids = full_graph.index.to_numpy().astype(np.int64)
+        order = np.argsort(movie_ids, kind='stable')
+        self.table = full_graph.iloc[order]
+        movie_ids = movie_ids[order]
+
+        # movie to row range
+        self.movies = pd.Index(np.unique(movie_ids))
+        self.row_movie = self.movies.get_indexer(movie_ids).astype(np.int32)
+        self.movie_ptr = np.concatenate([[0], np.cumsum(np.bincount(self.row_movie, minlength=len(self.movies)))])
+
+        # integer codes of properties, objects and (property, object) pairs
+        self.row_prop, self.props = _factorize(self.table['prop'])
+        self.row_obj, self.objs = _factorize(self.table['obj'])
+        self.row_code, self.codes = _factorize(self.table['obj_code'])
+        self.row_pair, pair_keys = pd.factorize(self.row_prop.astype(np.int64) * len(self.objs) + self.row_obj)
+        self.pair_prop = (pair_keys // len(self.objs)).astype(np.int32)
+        self.pair_obj = (pair_keys % len(self.objs)).astype(np.int32)
+        self.pair_count = np.bincount(self.row_pair, minlength=len(pair_keys))
+        self._pairs = {(self.props[p], self.objs[o]): i for i, (p, o) in enumerate(zip(self.pair_prop, self.pair_obj))}
+
+        # code of the object of each pair, the first one of the graph when different objects have the same name
+        _, first_row = np.unique(self.row_pair, return_index=True)
+        self.pair_code = self.codes[self.row_code[first_row]].to_numpy()
+
+        # (property, object) pair to rows, with the rows of each pair ordered by movie
+        self.pair_rows = np.lexsort((self.row_movie, self.row_pair))
+        self.pair_ptr = np.concatenate([[0], np.cumsum(self.pair_count)])
+
+        # property to its pairs ordered by count
+        self.prop_pairs = np.lexsort((-self.pair_count, self.pair_prop))
+        self.prop_ptr = np.concatenate([[0], np.cumsum(np.bincount(self.pair_prop, minlength=len(self.props)))])
+
+        # node of each object code on the vocabulary
+        self.code_node = None
+        if vocabulary is not None:
+            self.code_node = vocabulary.object_ids(self.codes.astype(str).to_numpy(dtype=object))
+
+    def pair_values(self, values: dict):
+        """
+        Function that aligns values of (property, object) pairs with the codes of the pairs
+        :param values: dictionary with (prop, obj) keys, eg the pr_zscore of the global zscore
+        :return: array with the value of each pair, nan for the pairs that are not on the dictionary
+        """
+        keys = pd.MultiIndex.from_arrays([self.props[self.pair_prop], self.objs[self.pair_obj]])
+        return pd.Series(values, dtype=float).reindex(keys).to_numpy()
+
+    def pair_id(self, prop: str, obj: str):
+        """
+        Function that returns the code of a (property, object) pair
+        :param prop: property, eg director
+        :param obj: value of the property, eg Martin Scorsese
+        :return: code of the pair, -1 if it is not on the graph
+        """
+        return self._pairs.get((prop, obj), -1)
+
+    def obj_code(self, prop: str, obj: str):
+        """
+        Function that returns the wikidata code of an object of a property
+        :param prop: property, eg director
+        :param obj: value of the property, eg Martin Scorsese
+        :return: code of the object (eg Q1245), None if the pair is not on the graph
+        """
+        pair = self.pair_id(prop, obj)
+        if pair < 0:
+            return None
+        return self.pair_code[pair]
+
+    def movies_with(self, prop: str, obj: str):
+        """
+        Function that returns the movies that have the value obj on the property prop
+        :param prop: property, eg director
+        :param obj: value of the property, eg Martin Scorsese
+        :return: sorted array of movie codes
+        """
+        pair = self.pair_id(prop, obj)
+        if pair < 0:
+            return np.array([], dtype=np.int32)
+        rows = self.pair_rows[self.pair_ptr[pair]:self.pair_ptr[pair + 1]]
+        return np.unique(self.row_movie[rows])
+
+    def objects_of(self, prop: str):
+        """
+        Function that returns the objects of a property on the full graph with the number of rows of each one
+        :param prop: property, eg director
+        :return: array of objects ordered by count and array of counts
+        """
+        p = self.props.get_indexer([prop])[0]
+        if p < 0:
+            return np.array([], dtype=object), np.array([], dtype=np.int64)
+        pairs = self.prop_pairs[self.prop_ptr[p]:self.prop_ptr[p + 1]]
+        return self.objs[self.pair_obj[pairs]].to_numpy(), self.pair_count[pairs]
+
+    def rows_of(self, movie_id: int):
+        """
+        Function that returns the rows of a movie on the table
+        :param movie_id: id of the movie
+        :return: slice of the rows of the movie
+        """
+        m = self.movies.get_loc(movie_id)
+        return slice(self.movie_ptr[m], self.movie_ptr[m + 1])
+
+    def movie_codes(self, movie_ids):
+        """
+        Function that returns the code of each movie, -1 if the movie is not on the graph
+        :param movie_ids: ids of the movies
+        :return: array of movie codes
+        """
+        return self.movies.get_indexer(np.asarray(movie_ids, dtype=np.int64))
+
+    def rows(self, codes: np.ndarray):
+        """
+        Function that returns the rows of a set of movies without scanning the table
+        :param codes: codes of the movies
+        :return: array with the rows of the movies, in the order of the codes
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        starts = self.movie_ptr[codes]
+        lengths = self.movie_ptr[codes + 1] - starts
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return offsets + np.arange(lengths.sum())
+
+
+class PairCounts:
+    """
+    Number of rows of each (property, object) pair on a set of movies, with the totals of each property needed to
+    calculate the entropy of the properties. When movies are removed from the set, only the pairs of their rows are
+    updated
+    """
+
+    def __init__(self, index: PropertyIndex, codes: np.ndarray):
+        """
+        Pair counts constructor
+        :param index: property index of the full graph
+        :param codes: codes of the movies on the set
+        """
+        self.index = index
+        self.counts = np.bincount(index.row_pair[index.rows(codes)], minlength=len(index.pair_prop))
+        # number of rows and sum of c * log2(c) of the pair counts c of each property
+        self.totals = np.bincount(index.pair_prop, weights=self.counts, minlength=len(index.props))
+        self.clogc = np.bincount(index.pair_prop, weights=_xlog2x(self.counts), minlength=len(index.props))
+
+    def copy(self):
+        """
+        :return: copy of the counts
+        """
+        other = PairCounts.__new__(PairCounts)
+        other.index = self.index
+        other.counts = self.counts.copy()
+        other.totals = self.totals.copy()
+        other.clogc = self.clogc.copy()
+        return other
+
+    def remove(self, codes: np.ndarray):
+        """
+        Function that removes movies from the set, updating the pairs of their rows
+        :param codes: codes of the movies to remove
+        """
+        pairs, removed = np.unique(self.index.row_pair[self.index.rows(codes)], return_counts=True)
+        props = self.index.pair_prop[pairs]
+        before = _xlog2x(self.counts[pairs])
+        self.counts[pairs] = self.counts[pairs] - removed
+        np.subtract.at(self.totals, props, removed)
+        np.add.at(self.clogc, props, _xlog2x(self.counts[pairs]) - before)
+
+    def entropy(self):
+        """
+        Function that calculates the entropy of the objects of each property with H = log2(n) - sum(c * log2(c)) / n
+        :return: array with the entropy of each property, nan for the properties without rows
+        """
+        n = self.totals
+        with np.errstate(divide='ignore', invalid='ignore'):
+            h = np.log2(n) - self.clogc / n
+        h[n <= 0] = np.nan
+        return np.maximum(h, 0)
+
+
+def _xlog2x(x):
+    """
+    :param x: array of counts
+    :return: x * log2(x), with zero when x is zero
+    """
+    x = np.asarray(x, dtype=float)
+    return x * np.log2(np.where(x > 0, x, 1))
+
+
+def _factorize(column: pd.Series):
+    """
+    Function that integer codes a column. The categorical columns of the columnar store are coded from the codes of
+    the store, without the strings of the rows
+    :param column: column of the property graph
+    :return: code of each row and index with the distinct values
+    """
+    codes, uniques = pd.factorize(column)
+    return codes, pd.Index(np.asarray(uniques, dtype=object))
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+
+def top_k(values: np.ndarray, k: int):
+    """
+    Function that selects the positions of the k biggest values without sorting all of them
+    :param values: array of values
+    :param k: number of positions to return
+    :return: positions of the k biggest values ordered by value, nan values are the last ones
+    """
+    neg = -np.asarray(values, dtype=float)
+    if k >= len(neg):
+        return np.argsort(neg, kind='stable')
+
+    part = np.argpartition(neg, k - 1)[:k]
+    return part[np.argsort(neg[part], kind='stable')]
+
+
+class RankedCursor:
+    """
+    Ranked view of a DataFrame that is sorted lazily. Only the rows needed to show the pages requested are selected,
+    with np.argpartition, and the duplicated rows are removed as the ranking is extended, so moving between pages
+    does not sort or remove duplicates again
+    """
+
+    def __init__(self, frame: pd.DataFrame, column='value', subset=None, block=32):
+        """
+        Ranked cursor constructor
+        :param frame: DataFrame to rank
+        :param column: column used to rank the rows, in descending order
+        :param subset: columns used to identify duplicated rows, None to use all columns
+        :param block: minimum number of rows ranked each time the ranking is extended, it doubles on each extension
+        """
+        self.frame = frame
+        self.subset = subset
+        self._values = -frame[column].to_numpy(dtype=float)
+        self._block = block
+        # positions of the rows not ranked yet, ranked positions without duplicates and hashes of the ranked rows
+        self._rest = np.arange(len(frame))
+        self._ranked = []
+        self._seen = set()
+
+    def _extend(self, n: int):
+        """
+        Function that ranks rows until there are n rows without duplicates or all rows were ranked
+        :param n: number of rows needed
+        """
+        while len(self._ranked) < n and len(self._rest) > 0:
+            m = max(n - len(self._ranked), self._block)
+            self._block = self._block * 2
+
+            # the m best rows of the ones not ranked are all worse than the ones ranked before
+            if m >= len(self._rest):
+                chunk = self._rest
+                self._rest = self._rest[:0]
+            else:
+                part = np.argpartition(self._values[self._rest], m - 1)
+                chunk = self._rest[part[:m]]
+                self._rest = self._rest[part[m:]]
+            chunk = chunk[np.argsort(self._values[chunk], kind='stable')]
+
+            rows = self.frame.iloc[chunk]
+            if self.subset is not None:
+                rows = rows[self.subset]
+            for pos, key in zip(chunk, pd.util.hash_pandas_object(rows, index=False).to_numpy()):
+                if key not in self._seen:
+                    self._seen.add(key)
+                    self._ranked.append(pos)
+
+    def page(self, start: int, length: int):
+        """
+        Function that returns a page of the ranking
+        :param start: rank of the first row of the page
+        :param length: number of rows of the page
+        :return: DataFrame with the rows of the page ordered by rank
+        """
+        start = max(start, 0)
+        self._extend(start + length)
+        return self.frame.iloc[self._ranked[start:start + length]]
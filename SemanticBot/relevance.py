@@ -0,0 +1,233 @@
+import argparse
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy import sparse
+import columnar
+import pagerank
+from property_index import PropertyIndex
+
+# version of the format of the artifacts, a new version is built when it changes
+FORMAT_VERSION = 2
+COLUMNS = ['count', 'global_zscore', 'pr', 'pr_zscore']
+MANIFEST = "manifest.json"
+CURRENT = "current"
+
+
+class GlobalRelevance:
+    """
+    Global relevance of the (property, object) pairs of the full graph: the number of rows of each pair, its zscore
+    among the pairs of the same property, the non personalized pagerank of the object and its zscore. It has the same
+    columns of the dictionary of utils.generate_global_zscore, eg relevance['pr_zscore'][(prop, obj)]. It also keeps the
+    pagerank of all the nodes, to warm start the pagerank when new ratings and properties are added
+    """
+
+    def __init__(self, props, objs, pair_prop: np.ndarray, pair_obj: np.ndarray, columns: dict, users=None,
+                 movies=None, node_pr=None):
+        """
+        Global relevance constructor
+        :param props: names of the properties
+        :param objs: names of the objects
+        :param pair_prop: property code of each pair
+        :param pair_obj: object code of each pair
+        :param columns: dictionary with an array for each column of COLUMNS, with one value for each pair
+        :param users: ids of the users of the graph of the pagerank
+        :param movies: ids of the movies of the graph of the pagerank
+        :param node_pr: pagerank of the nodes of the graph, ordered by users, movies and objects
+        """
+        self.props = props
+        self.objs = objs
+        self.pair_prop = pair_prop
+        self.pair_obj = pair_obj
+        self.columns = columns
+        self.users = users
+        self.movies = movies
+        self.node_pr = node_pr
+        self._keys = None
+
+    def __len__(self):
+        return len(self.pair_prop)
+
+    def __getitem__(self, column: str):
+        """
+        :param column: name of the column
+        :return: series with the values of the column and the (prop, obj) pairs as index
+        """
+        if self._keys is None:
+            self._keys = pd.MultiIndex.from_arrays([np.asarray(self.props, dtype=object)[self.pair_prop],
+                                                    np.asarray(self.objs, dtype=object)[self.pair_obj]],
+                                                   names=['prop', 'obj'])
+        return pd.Series(self.columns[column], index=self._keys)
+
+    def save(self, directory: str, manifest: dict):
+        """
+        Function that writes the artifacts on a directory, one npy file for each array
+        :param directory: directory of the artifacts
+        :param manifest: description of the build, written as json
+        """
+        columnar.save_strings(os.path.join(directory, "props"), self.props)
+        columnar.save_strings(os.path.join(directory, "objs"), self.objs)
+        np.save(os.path.join(directory, "pair_prop.npy"), np.asarray(self.pair_prop, dtype=np.int32))
+        np.save(os.path.join(directory, "pair_obj.npy"), np.asarray(self.pair_obj, dtype=np.int32))
+        for column in COLUMNS:
+            np.save(os.path.join(directory, column + ".npy"), self.columns[column])
+        np.save(os.path.join(directory, "users.npy"), np.asarray(self.users, dtype=np.int64))
+        np.save(os.path.join(directory, "movies.npy"), np.asarray(self.movies, dtype=np.int64))
+        np.save(os.path.join(directory, "node_pr.npy"), self.node_pr)
+
+        with open(os.path.join(directory, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+    @staticmethod
+    def read(directory: str):
+        """
+        Function that memory maps the artifacts of a directory
+        :param directory: directory of the artifacts
+        :return: global relevance
+        """
+        columns = {c: np.load(os.path.join(directory, c + ".npy"), mmap_mode='r') for c in COLUMNS}
+
+        # the artifacts of the first format do not have the pagerank of the nodes
+        nodes = [None, None, None]
+        if os.path.isfile(os.path.join(directory, "node_pr.npy")):
+            nodes = [np.load(os.path.join(directory, name + ".npy"), mmap_mode='r')
+                     for name in ["users", "movies", "node_pr"]]
+
+        return GlobalRelevance(columnar.load_strings(os.path.join(directory, "props")),
+                               columnar.load_strings(os.path.join(directory, "objs")),
+                               np.load(os.path.join(directory, "pair_prop.npy"), mmap_mode='r'),
+                               np.load(os.path.join(directory, "pair_obj.npy"), mmap_mode='r'), columns, *nodes)
+
+
+def compute(full_graph: pd.DataFrame, ratings: pd.DataFrame, previous=None, index=None):
+    """
+    Function that calculates the global relevance of the pairs of the full graph. The pagerank runs on the graph of
+    users, movies and objects, with the objects identified by name as in utils.generate_global_zscore
+    :param full_graph: full graph of the movie dataset with movie id as index
+    :param ratings: ratings dataset in the format user_id, movie_id, rating
+    :param previous: global relevance of a subset of the datasets, eg before new ratings were added. The pagerank
+    starts from its pagerank, so it converges in fewer iterations to the same values within the tolerance. None to
+    start from the uniform distribution
+    :param index: property index of full_graph, None to create it
+    :return: global relevance
+    """
+    if index is None:
+        index = PropertyIndex(full_graph)
+
+    # nodes ordered by users, movies and objects
+    user_codes, users = pd.factorize(ratings['user_id'])
+    movies = index.movies.union(pd.Index(ratings['movie_id'].unique()))
+    movie_offset = len(users)
+    object_offset = movie_offset + len(movies)
+    n = object_offset + len(index.objs)
+
+    origin = np.concatenate([user_codes, movie_offset + movies.get_indexer(index.movies)[index.row_movie]])
+    destination = np.concatenate([movie_offset + movies.get_indexer(ratings['movie_id']),
+                                  object_offset + index.row_obj])
+    adj = sparse.coo_matrix((np.ones(len(origin)), (origin, destination)), shape=(n, n)).tocsr()
+    adj = (adj + adj.T).tocsr()
+    # the graph is simple, repeated edges count once
+    adj.data[:] = 1
+
+    x0 = None
+    if previous is not None and previous.node_pr is not None:
+        x0 = _warm_start(previous, [users, movies, index.objs])
+    pr, _ = pagerank.pagerank(adj, x0=x0)
+    pair_pr = pr[object_offset + index.pair_obj]
+
+    # zscores over the rows of the graph, each pair has count rows
+    count = index.pair_count.astype(np.int64)
+    n_rows = np.bincount(index.pair_prop, weights=count, minlength=len(index.props))
+    mean = (np.bincount(index.pair_prop, weights=count * count, minlength=len(index.props)) / n_rows)[index.pair_prop]
+    var = np.bincount(index.pair_prop, weights=count * (count - mean) ** 2, minlength=len(index.props))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(var / (n_rows - 1))[index.pair_prop]
+        global_zscore = (count - mean) / std
+
+        pr_mean = np.sum(count * pair_pr) / count.sum()
+        pr_std = np.sqrt(np.sum(count * (pair_pr - pr_mean) ** 2) / (count.sum() - 1))
+        pr_zscore = (pair_pr - pr_mean) / pr_std
+
+    return GlobalRelevance(index.props.to_numpy(dtype=object), index.objs.to_numpy(dtype=object), index.pair_prop,
+                           index.pair_obj, {'count': count, 'global_zscore': global_zscore, 'pr': pair_pr,
+                                            'pr_zscore': pr_zscore},
+                           users.to_numpy(), movies.to_numpy(), pr)
+
+
+def _warm_start(previous: GlobalRelevance, nodes: list):
+    """
+    Function that creates the initial vector of the pagerank from the pagerank of a previous graph
+    :param previous: global relevance with the pagerank of the previous graph
+    :param nodes: list with the users, movies and objects of the new graph
+    :return: pagerank of the previous graph of each node, the new nodes have the mean pagerank
+    """
+    parts = []
+    offset = 0
+    for new, old in zip(nodes, [previous.users, previous.movies, previous.objs]):
+        codes = pd.Index(np.asarray(old)).get_indexer(np.asarray(new))
+        values = np.asarray(previous.node_pr)[offset + np.maximum(codes, 0)]
+        parts.append(np.where(codes >= 0, values, 1.0 / len(previous.node_pr)))
+        offset = offset + len(old)
+    return np.concatenate(parts)
+
+
+def build(prop_path: str, ratings_path: str, out: str, force=False):
+    """
+    Function that builds the global relevance artifacts on a versioned directory of out and points out/current to
+    it. The version is identified by the format and the checksums of the inputs, so when the inputs did not change the
+    build is skipped
+    :param prop_path: path of the property graph obtained from wikidata
+    :param ratings_path: path of the ratings dataset
+    :param out: directory of the versions
+    :param force: True to build even if the version already exists
+    :return: directory of the version and True if it was built, False if it was skipped
+    """
+    inputs = {'props': {'path': prop_path, 'sha256': columnar.file_checksum(prop_path)},
+              'ratings': {'path': ratings_path, 'sha256': columnar.file_checksum(ratings_path)}}
+    key = hashlib.sha256(json.dumps([FORMAT_VERSION, inputs['props']['sha256'],
+                                     inputs['ratings']['sha256']]).encode()).hexdigest()
+    version = "v" + str(FORMAT_VERSION) + "-" + key[:12]
+    directory = os.path.join(out, version)
+
+    built = force or not os.path.isfile(os.path.join(directory, MANIFEST))
+    if built:
+        full_graph = pd.read_csv(prop_path).set_index('movie_id')
+        ratings = pd.read_csv(ratings_path, sep='\t', header=None)
+        ratings.columns = ['user_id', 'movie_id', 'rating']
+        relevance = compute(full_graph, ratings)
+
+        tmp = directory + ".tmp"
+        os.makedirs(tmp, exist_ok=True)
+        relevance.save(tmp, {'format': FORMAT_VERSION, 'version': version, 'inputs': inputs, 'pairs': len(relevance)})
+        columnar.replace_dir(tmp, directory)
+
+    # point to the version atomically, so a bot starting during the build reads the old or the new one
+    with open(os.path.join(out, CURRENT + ".tmp"), 'w') as f:
+        f.write(version)
+    os.replace(os.path.join(out, CURRENT + ".tmp"), os.path.join(out, CURRENT))
+    return directory, built
+
+
+def load(out: str):
+    """
+    Function that memory maps the current version of the global relevance artifacts
+    :param out: directory of the versions
+    :return: global relevance
+    """
+    with open(os.path.join(out, CURRENT)) as f:
+        version = f.read().strip()
+    return GlobalRelevance.read(os.path.join(out, version))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the global relevance artifacts of the bot")
+    parser.add_argument("--props", default="../WikidataIntegration/wikidata_integration_small.csv")
+    parser.add_argument("--ratings", default="../dataset/1851_movies_ratings.txt")
+    parser.add_argument("--out", default="./global_relevance")
+    parser.add_argument("--force", action="store_true", help="build even if the inputs did not change")
+    args = parser.parse_args()
+
+    path, was_built = build(args.props, args.ratings, args.out, args.force)
+    print(("Built " if was_built else "Inputs unchanged, using ") + path)
@@ -0,0 +1,467 @@
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import numpy as np
+import pandas as pd
+import conversation
+import instrumentation
+import utils
+from bandit.prior import BanditPrior
+from bandit.store import BanditStore
+from subgraph import SubGraph
+
+# bot data of the worker processes, loaded once by each worker on its initializer
+_worker_data = None
+
+
+def _init_worker(load_args: dict):
+    """
+    Initializer of the worker processes, that loads the datasets and builds the indexes of the bot once per worker
+    :param load_args: arguments of conversation.load_data
+    """
+    global _worker_data
+    _worker_data = conversation.load_data(**load_args)
+
+
+def _worker_sub_graph(bits: np.ndarray, n_movies: int):
+    """
+    Function that rebuilds a sub graph on a worker from its packed mask
+    :param bits: mask of the movies of the sub graph packed with np.packbits
+    :param n_movies: number of movies of the property index
+    :return: sub graph over the property index of the worker
+    """
+    return SubGraph(_worker_data.prop_index, np.unpackbits(bits, count=n_movies).astype(bool))
+
+
+def _order_props(bits, n_movies, watched, objects, objects_names, weight_vec_pr, weight_vec_rank):
+    """
+    Function that orders the properties of a sub graph on a worker, see utils.order_props_pr
+    :return: ranked cursor of the properties
+    """
+    return utils.order_props_pr(_worker_sub_graph(bits, n_movies), _worker_data.g_pr_zscore, _worker_data.pr_graph,
+                                watched, objects, objects_names, weight_vec_pr, weight_vec_rank, True,
+                                cache=_worker_data.pr_cache, lazy=True)
+
+
+def _order_movies(bits, n_movies, watched, objects, weight_vec_pr):
+    """
+    Function that returns the best movie of a sub graph on a worker, see utils.order_movies_by_pagerank
+    :return: DataFrame with the best movie
+    """
+    return utils.order_movies_by_pagerank(_worker_sub_graph(bits, n_movies), _worker_data.pr_graph, watched, objects,
+                                          weight_vec_pr, True, cache=_worker_data.pr_cache, k=1)
+
+
+class PoolRanker:
+    """
+    Ranker of the properties and movies of the conversations that runs the pagerank on a pool of worker processes.
+    Only the packed mask of the sub graph and the preferences of the user are sent to the workers, that have their own
+    copy of the graphs and their own pagerank cache. A task that times out is cancelled if it did not start, a task
+    that started keeps running on its worker until it finishes, the pool can not interrupt it, so the next tasks of
+    the worker wait for it
+    """
+
+    def __init__(self, executor: ProcessPoolExecutor, timeout=None):
+        """
+        Pool ranker constructor
+        :param executor: process pool with workers initialized by _init_worker
+        :param timeout: seconds to wait for the result of a worker, None to wait until it finishes. The server has its
+        own timeout of the steps, see BotServer
+        """
+        self.executor = executor
+        self.timeout = timeout
+
+    def order_props(self, session):
+        """
+        Function that orders the properties of the sub graph of a conversation on a worker
+        :param session: conversation session
+        :return: ranked cursor of the properties
+        """
+        mask = session.sub_graph.mask
+        return self._result(self.executor.submit(_order_props, np.packbits(mask), len(mask), list(session.watched),
+                                                 list(session.prefered_objects), list(session.prefered_prop),
+                                                 session.WEIGHT_VEC_PR, session.WEIGHT_VEC_RANK))
+
+    def order_movies(self, session):
+        """
+        Function that returns the best movie of the sub graph of a conversation, computed on a worker
+        :param session: conversation session
+        :return: DataFrame with the best movie
+        """
+        mask = session.sub_graph.mask
+        return self._result(self.executor.submit(_order_movies, np.packbits(mask), len(mask), list(session.watched),
+                                                 list(session.prefered_objects), session.WEIGHT_VEC_PR))
+
+    def _result(self, future):
+        """
+        Function that waits for the result of a worker
+        :param future: future of the task submitted to the pool
+        :return: result of the task
+        """
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise TimeoutError("the ranking took more than " + str(self.timeout) + " seconds")
+
+
+class BotServer:
+    """
+    Server of conversations over line delimited JSON. Each line is a request with the id of the session, the action
+    and the answer of the user:
+    {"action": "start"} starts a session, the response has its id on the "session" key. A given id can not be started
+     again while the session is open
+    {"session": id, "action": "answer_age", "value": 25}
+    {"session": id, "action": "choose_property", "value": "director"}
+    {"session": id, "action": "respond", "value": "yes"}
+    {"session": id, "action": "close"}
+    {"action": "ingest", "ratings": [[user_id, movie_id, rating]], "properties": [{"movie_id": id, "title": title,
+     "prop": prop, "obj": obj, "obj_code": code, "imdbId": imdb}], "rated": [[movie_id, rated]]} adds new data to the
+     bot, see conversation.BotData.ingest. The open sessions keep the data they started with. It is only available
+     when the ranking runs on the threads of the server, the worker processes have their own data
+    The response is the dictionary of the step of the session (see conversation.ConversationSession) with the id of the
+    session, or {"session": id, "error": message}. The requests of different sessions run concurrently, the requests
+    of the same session run in order. When a step fails or times out, the session returns to its state before the step.
+    A step that times out is answered with an error at once, but its thread can not be interrupted, so the next
+    request of the session waits until the step finishes and is rolled back.
+    The sessions without requests for session_ttl seconds are closed when a new session starts.
+    The bandits of the sessions are rows of a BanditStore, so the memory of each session is fixed
+    """
+
+    def __init__(self, data: conversation.BotData, ranker=None, max_inflight=64, max_sessions=10000, prior=None,
+                 session_ttl=1800.0, timeout=None):
+        """
+        Bot server constructor
+        :param data: bot data shared by the conversations
+        :param ranker: ranker of the conversations, None to rank on the threads of the server
+        :param max_inflight: maximum number of requests processed at the same time, the next lines are only read when
+        the response of one of them is written
+        :param max_sessions: maximum number of open sessions
+        :param prior: prior of the bandits of the sessions, see bandit.prior.BanditPrior, None to start them without
+        prior
+        :param session_ttl: seconds without requests after which a session is abandoned and can be closed
+        :param timeout: seconds to wait for each step of a session, None to wait until it finishes
+        """
+        self.data = data
+        self.prior = prior
+        self.ranker = ranker
+        self.max_inflight = max_inflight
+        self.max_sessions = max_sessions
+        self.session_ttl = session_ttl
+        self.timeout = timeout
+        self.sessions = {}
+        # time of the last request of each session
+        self._last_used = {}
+        self.bandits = BanditStore(2, capacity=min(max_sessions, 1024))
+        self._locks = {}
+        self._threads = ThreadPoolExecutor(max_inflight)
+        self._inflight = None
+        self._ingest_lock = None
+
+    async def handle(self, request: dict):
+        """
+        Function that runs one request
+        :param request: dictionary with the session, action and value keys
+        :return: response dictionary
+        """
+        action = request.get('action')
+        sid = request.get('session')
+
+        if action == 'ingest':
+            return await self._ingest(request)
+
+        if action == 'start':
+            if len(self.sessions) >= self.max_sessions:
+                self._expire()
+            if len(self.sessions) >= self.max_sessions:
+                return {'session': sid, 'error': "too many open sessions"}
+            if sid in self.sessions:
+                # the open session keeps its bandit row and lock, it has to be closed before starting again
+                return {'session': sid, 'error': "session already started"}
+            sid = sid if sid is not None else uuid.uuid4().hex
+            bandit = self.bandits.bandit(int(self.bandits.open()[0]))
+            self.sessions[sid] = conversation.ConversationSession(self.data, bandit, self.ranker, self.prior)
+            self._locks[sid] = asyncio.Lock()
+            self._last_used[sid] = time.monotonic()
+
+        session = self.sessions.get(sid)
+        if session is None:
+            return {'session': sid, 'error': "unknown session"}
+
+        self._last_used[sid] = time.monotonic()
+        lock = self._locks[sid]
+        await lock.acquire()
+        release = True
+        try:
+            if action == 'close':
+                self._close(sid)
+                return {'session': sid, 'state': 'end'}
+
+            saved = session.checkpoint()
+            loop = asyncio.get_running_loop()
+            step = loop.run_in_executor(self._threads, _step, session, action, request.get('value'))
+            try:
+                response = await asyncio.wait_for(asyncio.shield(step), self.timeout)
+            except asyncio.TimeoutError:
+                # the session keeps its lock until the step finishes
+                release = False
+                step.add_done_callback(lambda future: _discard(future, session, saved, lock))
+                return {'session': sid, 'error': "the step took more than " + str(self.timeout) + " seconds"}
+            except Exception as e:
+                # any failure of the step, eg of the ranking, only fails the request and not the connection
+                session.rollback(saved)
+                return {'session': sid, 'error': str(e) or type(e).__name__}
+            finally:
+                self._last_used[sid] = time.monotonic()
+        finally:
+            if release:
+                lock.release()
+
+        if response['state'] == 'end' and self.sessions.get(sid) is session:
+            self._close(sid)
+        return dict(response, session=sid)
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Function that answers the requests of a stream, one JSON per line, until the stream is closed
+        :param reader: stream of the requests
+        :param writer: stream of the responses
+        """
+        if self._inflight is None:
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+
+        tasks = set()
+        write_lock = asyncio.Lock()
+        while True:
+            # backpressure: the next line is only read when there is room for one more request
+            await self._inflight.acquire()
+            line = await reader.readline()
+            if not line:
+                self._inflight.release()
+                break
+            task = asyncio.ensure_future(self._answer(line, writer, write_lock))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        writer.close()
+
+    async def _answer(self, line: bytes, writer: asyncio.StreamWriter, write_lock: asyncio.Lock):
+        """
+        Function that answers one line of a stream. The request only leaves its place of the max_inflight ones when its
+        response is written, so a client that does not read the responses stops the reading of its requests
+        :param line: JSON request
+        :param writer: stream of the responses
+        :param write_lock: lock of the writes of the stream, the responses are written and drained one at a time
+        """
+        try:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'error': "invalid JSON"}
+            else:
+                if not isinstance(request, dict):
+                    request = {}
+                try:
+                    response = await self.handle(request)
+                except Exception as e:
+                    # the client always receives one response for each line
+                    response = {'session': request.get('session'), 'error': str(e) or type(e).__name__}
+
+            async with write_lock:
+                writer.write((json.dumps(response, default=_to_json) + "\n").encode())
+                await writer.drain()
+        finally:
+            self._inflight.release()
+
+    async def _ingest(self, request: dict):
+        """
+        Function that adds the data of an ingest request to the bot, the sessions started after it use the new data
+        :param request: dictionary with the ratings, properties and rated keys
+        :return: response dictionary
+        """
+        if isinstance(self.ranker, PoolRanker):
+            return {'error': "ingest is not available with worker processes"}
+        if self._ingest_lock is None:
+            self._ingest_lock = asyncio.Lock()
+
+        # one ingest at a time, so each one extends the data of the previous one
+        async with self._ingest_lock:
+            try:
+                loop = asyncio.get_running_loop()
+                self.data = await loop.run_in_executor(self._threads, _ingest, self.data, request)
+            except Exception as e:
+                return {'error': str(e) or type(e).__name__}
+
+        return {'state': 'ingested', 'ratings': len(self.data.ratings), 'movies': len(self.data.prop_index.movies)}
+
+    def _expire(self):
+        """
+        Function that closes the sessions without requests for session_ttl seconds, except the ones running a step
+        """
+        deadline = time.monotonic() - self.session_ttl
+        for sid in [s for s, used in self._last_used.items() if used <= deadline]:
+            if not self._locks[sid].locked():
+                self._close(sid)
+
+    def _close(self, sid):
+        """
+        Function that removes a session
+        :param sid: id of the session
+        """
+        session = self.sessions.pop(sid, None)
+        self._locks.pop(sid, None)
+        self._last_used.pop(sid, None)
+        if session is not None:
+            self.bandits.close([session.ban.slot])
+
+
+def _step(session: conversation.ConversationSession, action: str, value):
+    """
+    Function that runs a step of a session
+    :param session: conversation session
+    :param action: name of the step
+    :param value: answer of the user
+    :return: response of the step
+    """
+    if action == 'start':
+        return session.start()
+    if action == 'answer_age':
+        return session.answer_age(int(value))
+    if action == 'choose_property':
+        return session.choose_property(str(value))
+    if action == 'respond':
+        return session.respond(str(value))
+    raise ValueError("unknown action " + str(action))
+
+
+def _discard(future: asyncio.Future, session: conversation.ConversationSession, saved: dict, lock: asyncio.Lock):
+    """
+    Function that rolls back a step that timed out when it finishes and lets the session run its next request
+    :param future: future of the step
+    :param session: conversation session
+    :param saved: state of the session before the step, see conversation.ConversationSession.checkpoint
+    :param lock: lock of the session
+    """
+    if not future.cancelled():
+        # the error of the step was already answered as a timeout
+        future.exception()
+    session.rollback(saved)
+    lock.release()
+
+
+def _ingest(data: conversation.BotData, request: dict):
+    """
+    Function that adds the data of an ingest request to the bot data
+    :param data: bot data
+    :param request: dictionary with the ratings, properties and rated keys, see BotServer
+    :return: bot data with the new data
+    """
+    ratings = None
+    full_prop_graph = None
+    movie_rate = None
+    if request.get('ratings'):
+        ratings = pd.DataFrame(request['ratings'], columns=['user_id', 'movie_id', 'rating'])
+    if request.get('properties'):
+        full_prop_graph = pd.DataFrame(request['properties']).set_index('movie_id')
+    if request.get('rated'):
+        movie_rate = pd.DataFrame(request['rated'], columns=['movie_id', 'rated']).set_index('movie_id')
+    return data.ingest(ratings, full_prop_graph, movie_rate)
+
+
+def _to_json(value):
+    """
+    Function that converts the numpy values of the responses to JSON
+    :param value: value not supported by the json module
+    :return: python value
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError("not JSON serializable: " + type(value).__name__)
+
+
+async def _stdio():
+    """
+    Function that opens the standard input and output as streams
+    :return: reader and writer streams
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    transport, protocol = await loop.connect_write_pipe(asyncio.streams.FlowControlMixin, sys.stdout)
+    writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+    return reader, writer
+
+
+async def _main(args):
+    """
+    Function that loads the bot and serves the conversations on TCP or on the standard input and output
+    :param args: command line arguments
+    """
+    data = conversation.load_data()
+
+    executor = None
+    ranker = None
+    if args.workers > 0:
+        executor = ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=({},))
+        ranker = PoolRanker(executor, args.timeout)
+
+    prior = BanditPrior.load(args.prior, snapshot_every=args.snapshot_every)
+    server = BotServer(data, ranker, args.max_inflight, args.max_sessions, prior, args.session_ttl, args.timeout)
+
+    # the measures of the turns are logged on the standard error, the standard output can be the protocol
+    sinks = []
+    tracer = None
+    if args.trace_log:
+        logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+        sinks.append(instrumentation.LogSink())
+    if args.prometheus is not None:
+        sinks.append(instrumentation.PrometheusSink(args.prometheus, args.prometheus_every))
+    if sinks or args.profile_rate > 0:
+        tracer = instrumentation.Tracer(sinks, args.profile_rate, args.profile, args.profile_dir)
+        instrumentation.enable(tracer)
+    try:
+        if args.stdio:
+            reader, writer = await _stdio()
+            await server.serve(reader, writer)
+        else:
+            tcp = await asyncio.start_server(server.serve, args.host, args.port)
+            async with tcp:
+                await tcp.serve_forever()
+    finally:
+        prior.save()
+        if tracer is not None:
+            tracer.flush()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve conversations of the bot over line delimited JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stdio", action="store_true", help="serve on the standard input and output instead of TCP")
+    parser.add_argument("--workers", type=int, default=2, help="processes of the pagerank pool, 0 to rank on threads")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds to wait for each step of a session")
+    parser.add_argument("--max-inflight", type=int, default=64, help="maximum number of requests being processed")
+    parser.add_argument("--max-sessions", type=int, default=10000, help="maximum number of open sessions")
+    parser.add_argument("--session-ttl", type=float, default=1800, help="seconds after which an idle session is closed")
+    parser.add_argument("--prior", default="./bandit_prior.json", help="file of the prior of the bandits")
+    parser.add_argument("--snapshot-every", type=float, default=60, help="seconds between snapshots of the prior")
+    parser.add_argument("--trace-log", action="store_true", help="log the time, graph size and pagerank of each turn")
+    parser.add_argument("--prometheus", default=None, help="prom file of the histograms of the turns and functions")
+    parser.add_argument("--prometheus-every", type=float, default=10, help="seconds between writes of the prom file")
+    parser.add_argument("--profile-rate", type=float, default=0, help="fraction of the sessions profiled")
+    parser.add_argument("--profile", default=instrumentation.CPROFILE,
+                        choices=[instrumentation.CPROFILE, instrumentation.TRACEMALLOC])
+    parser.add_argument("--profile-dir", default="./profiles", help="directory of the profiles of the sessions")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,269 @@
+import argparse
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import conversation
+import relevance
+import utils
+from bandit.prior import BanditPrior
+from property_index import PropertyIndex
+
+# functions of utils timed on each turn of the simulated conversations
+TIMED = ['shrink_graph', 'page_rank', 'order_props_pr', 'order_movies_by_pagerank']
+
+
+class SyntheticUser:
+    """
+    Simulated user of the bot built from the ratings of a user of the dataset. Some of the movies the user liked are
+    held out as the targets and the other rated movies are the profile. The user chooses the properties and values
+    that appear the most on the movies of the profile, accepts a recommended movie if it is a target and answers that
+    already watched the movies of the profile
+    """
+
+    # maximum pages of values of a property the user looks before choosing one
+    MAX_PAGES = 3
+
+    def __init__(self, user_id: int, profile, targets, index: PropertyIndex, age=25):
+        """
+        Synthetic user constructor
+        :param user_id: id of the user on the ratings dataset
+        :param profile: ids of the movies the user rated and were not held out
+        :param targets: ids of the held out movies the user liked
+        :param index: property index of the bot
+        :param age: age answered to the bot
+        """
+        self.user_id = user_id
+        self.profile = set(int(m) for m in profile)
+        self.targets = set(int(m) for m in targets)
+        self.index = index
+        self.age = age
+
+        # number of movies of the profile with each (property, object) pair and each property
+        codes = index.movie_codes(list(self.profile))
+        pairs = index.row_pair[index.rows(codes[codes >= 0])]
+        self.pair_count = np.bincount(pairs, minlength=len(index.pair_prop))
+        self.prop_count = np.bincount(index.pair_prop, weights=self.pair_count, minlength=len(index.props))
+
+        self.prop = None
+        self.pages = 0
+
+    def answer(self, response: dict):
+        """
+        Function that answers a response of the bot
+        :param response: response of a step of the conversation, see conversation.ConversationSession
+        :return: name of the step of the session (answer_age, choose_property or respond) and the answer
+        """
+        state = response['state']
+        if state == 'age':
+            return 'answer_age', self.age
+        if state == 'parents':
+            return 'respond', "no"
+        if state == 'property':
+            props = response['properties']
+            counts = [self.prop_count[self.index.props.get_loc(p)] for p in props]
+            self.prop = props[int(np.argmax(counts))]
+            self.pages = 0
+            return 'choose_property', self.prop
+        if state == 'object':
+            objects = response['objects']
+            counts = [self._count(self.prop, o) for o in objects]
+            if (len(objects) == 0 or max(counts) == 0) and self.pages < self.MAX_PAGES:
+                self.pages = self.pages + 1
+                return 'respond', "Next Page"
+            if len(objects) == 0:
+                return 'respond', "Previous Page"
+            return 'respond', objects[int(np.argmax(counts))]
+        if state == 'ask':
+            counts = [self._count(p, o) for p, o in response['options']]
+            if len(counts) == 0 or max(counts) == 0:
+                return 'respond', "Recommend"
+            return 'respond', str(int(np.argmax(counts)) + 1)
+        if state == 'recommend':
+            movie_id = int(response['movie']['movie_id'])
+            if movie_id in self.targets:
+                return 'respond', "yes"
+            if movie_id in self.profile:
+                return 'respond', "watched"
+            return 'respond', "no"
+
+        raise ValueError("The user can not answer the state " + str(state))
+
+    def _count(self, prop: str, obj: str):
+        """
+        :param prop: property, eg director
+        :param obj: value of the property
+        :return: number of movies of the profile with the pair
+        """
+        pair = self.index.pair_id(prop, obj)
+        return self.pair_count[pair] if pair >= 0 else 0
+
+
+def split_ratings(ratings: pd.DataFrame, movies, n_users=100, holdout=0.2, like=4, min_ratings=10, seed=0):
+    """
+    Function that chooses the users to simulate and holds out some of the movies each one liked
+    :param ratings: ratings dataset in the format user_id, movie_id, rating
+    :param movies: ids of the movies that can be recommended, the targets are only these movies
+    :param n_users: number of users to simulate
+    :param holdout: fraction of the liked movies of each user held out as targets
+    :param like: minimum rating of a liked movie
+    :param min_ratings: minimum number of ratings of a simulated user
+    :param seed: seed of the choice of the users and of the held out movies
+    :return: ratings without the held out ones and dictionary with the profile and targets of each user
+    """
+    rng = np.random.default_rng(seed)
+    counts = ratings['user_id'].value_counts()
+    candidates = counts.index[counts >= min_ratings].to_numpy()
+    chosen = rng.choice(candidates, size=min(n_users, len(candidates)), replace=False)
+
+    held = np.zeros(len(ratings), dtype=bool)
+    users = {}
+    by_user = ratings[ratings['user_id'].isin(chosen)].groupby('user_id')
+    for user_id in chosen:
+        rated = by_user.get_group(user_id)
+        liked = rated.index[(rated['rating'] >= like).to_numpy() & rated['movie_id'].isin(movies).to_numpy()]
+        if len(liked) < 2:
+            continue
+        targets = rng.choice(liked, size=max(1, int(len(liked) * holdout)), replace=False)
+        held[ratings.index.get_indexer(targets)] = True
+        users[int(user_id)] = {'profile': rated.loc[rated.index.difference(targets), 'movie_id'].to_numpy(),
+                               'targets': ratings.loc[targets, 'movie_id'].to_numpy()}
+
+    return ratings[~held], users
+
+
+@contextmanager
+def timed_functions(names=TIMED):
+    """
+    Context manager that records the time of the calls of functions of utils, including the calls made by other
+    functions of utils
+    :param names: names of the functions
+    :return: dictionary with the list of durations of each function, in seconds
+    """
+    durations = defaultdict(list)
+    originals = {name: getattr(utils, name) for name in names}
+
+    def wrap(name, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                durations[name].append(time.perf_counter() - start)
+        return timed
+
+    for name, function in originals.items():
+        setattr(utils, name, wrap(name, function))
+    try:
+        yield durations
+    finally:
+        for name, function in originals.items():
+            setattr(utils, name, function)
+
+
+def simulate(data: conversation.BotData, users: dict, max_turns=50, age=25, prior=None):
+    """
+    Function that runs one conversation with each synthetic user and measures them
+    :param data: bot data without the held out ratings
+    :param users: dictionary with the profile and targets of each user, see split_ratings
+    :param max_turns: maximum number of turns of a conversation, it fails after them
+    :param age: age of the users
+    :param prior: bandit prior shared by the conversations, None to start each bandit without prior
+    :return: report dictionary with the throughput, the latency of the turns, the time of each function of TIMED and
+    the accuracy of the recommendations
+    """
+    latencies = []
+    sessions = []
+    with timed_functions() as durations:
+        start = time.perf_counter()
+        for user_id, split in users.items():
+            user = SyntheticUser(user_id, split['profile'], split['targets'], data.prop_index, age)
+            session = conversation.ConversationSession(data, prior=prior)
+
+            turn = time.perf_counter()
+            response = session.start()
+            latencies.append(time.perf_counter() - turn)
+
+            turns = 1
+            recommendations = 0
+            while response['state'] != 'end' and turns < max_turns:
+                recommendations = recommendations + (response['state'] == 'recommend')
+                action, value = user.answer(response)
+                turn = time.perf_counter()
+                response = getattr(session, action)(value)
+                latencies.append(time.perf_counter() - turn)
+                turns = turns + 1
+
+            hit = response['state'] == 'end' and response.get('movie_id') is not None
+            sessions.append({'turns': turns, 'recommendations': recommendations, 'hit': hit,
+                             'finished': response['state'] == 'end'})
+        elapsed = time.perf_counter() - start
+
+    return report(latencies, durations, sessions, elapsed)
+
+
+def report(latencies: list, durations: dict, sessions: list, elapsed: float):
+    """
+    Function that summarizes the measures of a simulation
+    :param latencies: duration of each turn, in seconds
+    :param durations: durations of the calls of each function, see timed_functions
+    :param sessions: list with the turns, recommendations, hit and finished of each conversation
+    :param elapsed: total seconds of the simulation
+    :return: report dictionary
+    """
+    latencies = np.asarray(latencies) * 1000
+    sessions = pd.DataFrame(sessions, columns=['turns', 'recommendations', 'hit', 'finished'])
+    turn_time = latencies.sum() / 1000
+
+    functions = {}
+    for name in TIMED:
+        calls = np.asarray(durations.get(name, []))
+        functions[name] = {'calls': len(calls), 'total_s': float(calls.sum()),
+                           'mean_ms': float(calls.mean() * 1000) if len(calls) else 0.0,
+                           'share_of_turns': float(calls.sum() / turn_time) if turn_time > 0 else 0.0}
+
+    recommendations = int(sessions['recommendations'].sum())
+    return {'sessions': len(sessions), 'turns': len(latencies), 'elapsed_s': elapsed,
+            'turns_per_s': len(latencies) / elapsed if elapsed > 0 else 0.0,
+            'latency_ms': {'p50': float(np.percentile(latencies, 50)), 'p95': float(np.percentile(latencies, 95)),
+                           'p99': float(np.percentile(latencies, 99)), 'max': float(latencies.max())},
+            'functions': functions,
+            'accuracy': {'hit_rate': float(sessions['hit'].mean()),
+                         'finished_rate': float(sessions['finished'].mean()),
+                         'mean_turns': float(sessions['turns'].mean()),
+                         'mean_recommendations': float(sessions['recommendations'].mean()),
+                         'precision': float(sessions['hit'].sum() / recommendations) if recommendations else 0.0}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay conversations of synthetic users built from the ratings "
+                                                 "dataset and measure the throughput, latency and accuracy of the bot")
+    parser.add_argument("--users", type=int, default=100, help="number of users to simulate")
+    parser.add_argument("--holdout", type=float, default=0.2, help="fraction of the liked movies held out")
+    parser.add_argument("--like", type=float, default=4, help="minimum rating of a liked movie")
+    parser.add_argument("--min-ratings", type=int, default=10, help="minimum number of ratings of a simulated user")
+    parser.add_argument("--max-turns", type=int, default=50, help="maximum number of turns of a conversation")
+    parser.add_argument("--age", type=int, default=25)
+    parser.add_argument("--prior", action="store_true", help="share a bandit prior across the conversations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="json file of the report")
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+    full_data = conversation.load_data()
+    train, synthetic = split_ratings(full_data.ratings, full_data.prop_index.movies, args.users, args.holdout,
+                                     args.like, args.min_ratings, args.seed)
+
+    # the bot of the simulation does not know the held out ratings
+    print("Building the bot without " + str(len(full_data.ratings) - len(train)) + " held out ratings")
+    train = train.reset_index(drop=True)
+    data = conversation.BotData(full_data.full_prop_graph, train, full_data.movie_rate,
+                                relevance.compute(full_data.full_prop_graph, train, full_data.g_zscore))
+
+    result = simulate(data, synthetic, args.max_turns, args.age, BanditPrior(2) if args.prior else None)
+    print(json.dumps(result, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
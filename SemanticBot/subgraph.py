@@ -0,0 +1,101 @@
+import numpy as np
+from property_index import PropertyIndex, PairCounts
+
+
+class SubGraph:
+    """
+    Sub graph of a conversation, represented by a mask of the movies over the property index that is shared by all
+    the conversations. Shrinking the graph and removing movies only change the mask, the rows of the properties are
+    never copied
+    """
+
+    def __init__(self, prop_index: PropertyIndex, mask=None):
+        """
+        Sub graph constructor
+        :param prop_index: property index of the full graph
+        :param mask: boolean mask of the movies of the index on the sub graph, None to use all movies
+        """
+        self.prop_index = prop_index
+        if mask is None:
+            mask = np.ones(len(prop_index.movies), dtype=bool)
+        self.mask = mask
+        # counts of the (property, object) pairs, calculated when the entropy is needed for the first time
+        self._counts = None
+
+    def __len__(self):
+        """
+        :return: number of movies on the sub graph
+        """
+        return int(np.count_nonzero(self.mask))
+
+    def codes(self):
+        """
+        :return: sorted array with the codes on the index of the movies on the sub graph
+        """
+        return np.flatnonzero(self.mask)
+
+    def movies(self):
+        """
+        :return: sorted array with the ids of the movies on the sub graph
+        """
+        return self.prop_index.movies[self.codes()].to_numpy()
+
+    def rows(self):
+        """
+        :return: rows of the index table of the movies on the sub graph, ordered by movie
+        """
+        return self.prop_index.rows(self.codes())
+
+    def frame(self):
+        """
+        Function that materializes the properties of the sub graph, to show them to the user
+        :return: DataFrame with the movie id as index and the property graph columns
+        """
+        return self.prop_index.table.iloc[self.rows()]
+
+    def shrink(self, prop: str, obj: str):
+        """
+        Function that keeps only the movies that have the value obj on the property prop
+        :param prop: property the user is looking for
+        :param obj: value of property the user is looking for
+        :return: new sub graph with the movies of this one that match the property
+        """
+        mask = np.zeros(len(self.mask), dtype=bool)
+        mask[self.prop_index.movies_with(prop, obj)] = True
+        return self._derive(self.mask & mask)
+
+    def drop(self, movie_ids):
+        """
+        Function that removes movies from the sub graph
+        :param movie_ids: id or list of ids of the movies to remove
+        :return: new sub graph without the movies
+        """
+        codes = self.prop_index.movie_codes(np.atleast_1d(movie_ids))
+        mask = self.mask.copy()
+        mask[codes[codes >= 0]] = False
+        return self._derive(mask)
+
+    def pair_counts(self):
+        """
+        :return: counts of the (property, object) pairs on the sub graph
+        """
+        if self._counts is None:
+            self._counts = PairCounts(self.prop_index, self.codes())
+        return self._counts
+
+    def _derive(self, mask: np.ndarray):
+        """
+        Function that creates a sub graph with a subset of the movies of this one. If the pair counts of this sub graph
+        were calculated, the counts of the new one are updated with the removed movies when they are fewer than the
+        remaining ones
+        :param mask: boolean mask of the movies of the new sub graph
+        :return: new sub graph
+        """
+        sub_graph = SubGraph(self.prop_index, mask)
+        if self._counts is not None:
+            removed = np.flatnonzero(self.mask & ~mask)
+            if len(removed) < len(sub_graph):
+                sub_graph._counts = self._counts.copy()
+                sub_graph._counts.remove(removed)
+
+        return sub_graph
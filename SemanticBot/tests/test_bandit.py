@@ -0,0 +1,42 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bandit.prior import BanditPrior
+from bandit.store import BanditStore
+from bandit.thompson_sampling import ThompsonSamplingBandit
+from bandit.ucb import UCBBandit
+
+
+class BanditStateTest(unittest.TestCase):
+
+    def test_state_round_trip(self):
+        state = {'narms_n': [4.0, 2.0], 'narms_rmean': [0.5, 1.0], 'n': 5.0, 'reward': 0.6, 'alpha': [3.0, 2.0],
+                 'beta': [3.0, 1.0]}
+        store = BanditStore(2)
+        for bandit in [ThompsonSamplingBandit(2), store.bandit(int(store.open()[0]))]:
+            bandit.set_state(state)
+            self.assertEqual(bandit.get_state(), state)
+            bandit.set_state(state)
+            self.assertEqual(bandit.get_state(), state)
+        self.assertEqual(len(ThompsonSamplingBandit(2).reward), 1)
+
+    def test_state_with_other_arms_is_rejected(self):
+        with self.assertRaises(ValueError):
+            UCBBandit(1.0, 3).set_state(ThompsonSamplingBandit(2).get_state())
+
+    def test_prior_with_other_arms_is_rejected(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "prior.json")
+            with open(path, 'w') as f:
+                json.dump({'arms': 3, 'segments': {}, 'sessions': {}}, f)
+            self.assertEqual(BanditPrior.load(path, arms=3).narms, 3)
+            with self.assertRaises(ValueError):
+                BanditPrior.load(path, arms=2)
+
+
+if __name__ == "__main__":
+    unittest.main()
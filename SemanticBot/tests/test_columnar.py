@@ -0,0 +1,51 @@
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import columnar
+import conversation
+from test_server import small_data
+
+
+class ColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        data = small_data()
+        self.source = os.path.join(self.directory.name, "props.csv")
+        data.full_prop_graph.reset_index().to_csv(self.source, index=False)
+        self.store = os.path.join(self.directory.name, "store")
+        columnar.save_table(columnar.table_path(self.source, self.store), data.full_prop_graph.reset_index(),
+                            source=self.source)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_table_without_source_is_not_current_but_is_read(self):
+        table = columnar.table_path(self.source, self.store)
+        self.assertTrue(columnar.is_current(table, self.source))
+
+        os.remove(self.source)
+        self.assertFalse(columnar.is_current(table, self.source))
+        self.assertEqual(len(columnar.read_table(self.source, self.store)), 24)
+
+    def test_codes_are_read_without_decoding(self):
+        table = columnar.read_table(self.source, self.store, decode=False)
+        self.assertEqual(table['obj_code'].dtype, 'category')
+        codes, dictionary = columnar.load_codes(columnar.table_path(self.source, self.store), 'obj_code')
+        np.testing.assert_array_equal(table['obj_code'].cat.codes.to_numpy(), codes)
+
+        # the index of the coded graph is the same of the decoded one
+        coded = conversation.PropertyIndex(table.set_index('movie_id'))
+        decoded = conversation.PropertyIndex(columnar.read_table(self.source, None).set_index('movie_id'))
+        for name in ['props', 'objs', 'codes']:
+            self.assertTrue(getattr(coded, name).equals(getattr(decoded, name)))
+        for name in ['row_prop', 'row_obj', 'row_code', 'pair_code']:
+            np.testing.assert_array_equal(getattr(coded, name), getattr(decoded, name))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import conversation
+from test_server import small_data
+
+
+class LoadDataTest(unittest.TestCase):
+
+    def write_datasets(self, directory: str, ratings):
+        """
+        Function that writes the csv files of the datasets of the small catalog
+        :param directory: directory of the files
+        :param ratings: ratings DataFrame
+        :return: paths of the property graph, ratings and age rating files
+        """
+        data = small_data()
+        paths = [os.path.join(directory, name) for name in ["props.csv", "ratings.txt", "rated.csv"]]
+        data.full_prop_graph.reset_index().to_csv(paths[0], index=False)
+        ratings.to_csv(paths[1], sep='\t', header=False, index=False)
+        data.movie_rate.reset_index().to_csv(paths[2], index=False)
+        return paths
+
+    def test_relevance_is_rebuilt_when_the_ratings_change(self):
+        ratings = small_data().ratings
+        with tempfile.TemporaryDirectory() as directory:
+            relevance_path = os.path.join(directory, "relevance")
+            paths = self.write_datasets(directory, ratings)
+            first = conversation.load_data(*paths, relevance_path=relevance_path, store_path=None)
+
+            # one movie receives many more ratings, so its properties are more relevant
+            more = ratings.iloc[[0] * 20].assign(user_id=np.arange(100, 120))
+            paths = self.write_datasets(directory, pd.concat([ratings, more]))
+            second = conversation.load_data(*paths, relevance_path=relevance_path, store_path=None)
+
+            self.assertEqual(len(os.listdir(relevance_path)), 3)
+            self.assertFalse(np.allclose(first.g_pr_zscore, second.g_pr_zscore))
+
+
+class ConversationSessionTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = small_data()
+
+    def test_answers_must_be_offered(self):
+        session = conversation.ConversationSession(self.data)
+        session.start()
+        self.assertIn("genre", session.answer_age(25)['properties'])
+        with self.assertRaises(ValueError):
+            session.choose_property("writer")
+
+        self.assertIn("genre 1", session.choose_property("genre")['objects'])
+        with self.assertRaises(ValueError):
+            session.respond("genre 7")
+        self.assertEqual(len(session.sub_graph), len(self.data.prop_index.movies))
+
+    def test_accepted_recommendation_updates_the_bandit(self):
+        session = conversation.ConversationSession(self.data)
+        session.start()
+        session.answer_age(25)
+        session.choose_property("genre")
+        response = session.respond("genre 1")
+        while response['state'] == 'ask':
+            response = session.respond("Recommend")
+        self.assertEqual(response['state'], 'recommend')
+
+        pulls = session.ban.n
+        self.assertEqual(session.respond("yes")['state'], 'end')
+        self.assertEqual(session.ban.n, pulls + 1)
+
+    def test_preferred_objects_have_one_type(self):
+        for _ in range(50):
+            session = conversation.ConversationSession(self.data)
+            session.start()
+            session.answer_age(25)
+            session.choose_property("genre")
+            if session.respond("genre 1")['state'] == 'ask':
+                break
+        self.assertEqual(session.state, 'ask')
+
+        session.respond("1")
+        self.assertEqual(len(session.prefered_objects), 2)
+        self.assertEqual([type(o) for o in session.prefered_objects], [str, str])
+        self.assertEqual(session.prefered_objects[0], "QG1")
+
+
+if __name__ == "__main__":
+    unittest.main()
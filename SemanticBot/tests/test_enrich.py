@@ -0,0 +1,114 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "WikidataIntegration"))
+import rated_movies
+from omdb_stub import OmdbStub
+
+
+class EnrichTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, "rated_movies.csv")
+        self.cache_path = os.path.join(self.directory.name, "omdb_cache.jsonl")
+        self.movies = pd.DataFrame({'title': ["Movie " + str(m) for m in range(1, 21)],
+                                    'imdbId': ["tt%07d" % (1000 + m) for m in range(1, 21)]},
+                                   index=pd.Index(range(1, 21), name='movie_id'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def enrich(self, stub: OmdbStub, **args):
+        """
+        Function that obtains the ratings of all the movies from the stub with small waits
+        :param stub: OMDb stub
+        :param args: other arguments of enrich
+        :return: number of ratings obtained and the ratings of the movies
+        """
+        ratings = pd.DataFrame({'rated': np.nan}, index=self.movies.index, dtype=object)
+        args = dict(dict(concurrency=4, retries=10, backoff=0.001, timeout=5), **args)
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            n = rated_movies.enrich(self.movies, ratings, self.output, rated_movies.OmdbCache(self.cache_path),
+                                    stub.url, "key", **args)
+        return n, ratings
+
+    def cached(self):
+        """
+        :return: responses written on the cache file
+        """
+        with open(self.cache_path) as f:
+            return [json.loads(line)['response'] for line in f]
+
+    def test_requests_do_not_exceed_the_concurrency(self):
+        with OmdbStub(latency=0.02) as stub:
+            n, ratings = self.enrich(stub, concurrency=3)
+
+        self.assertEqual(n, len(self.movies))
+        self.assertEqual(stub.requests, len(self.movies))
+        self.assertLessEqual(stub.max_active, 3)
+        self.assertGreater(stub.max_active, 1)
+        self.assertEqual(ratings['rated'].tolist(), [stub.rating(imdb) for imdb in self.movies['imdbId']])
+
+    def test_cached_movies_are_not_requested_again(self):
+        with OmdbStub(not_found_rate=0.3) as stub:
+            n, _ = self.enrich(stub)
+        not_found = sum(stub.rating(imdb) is None for imdb in self.movies['imdbId'])
+        self.assertGreater(not_found, 0)
+        self.assertEqual(n, len(self.movies) - not_found)
+
+        # the ratings and the movies not found are answered by the cache
+        with OmdbStub(not_found_rate=0.3) as stub:
+            n_again, _ = self.enrich(stub)
+        self.assertEqual(stub.requests, 0)
+        self.assertEqual(n_again, n)
+
+    def test_transient_errors_are_retried_and_not_cached(self):
+        with OmdbStub(failure_rate=0.4, seed=3) as stub:
+            n, _ = self.enrich(stub)
+        self.assertGreater(stub.failures, 0)
+        self.assertEqual(stub.requests, len(self.movies) + stub.failures)
+        self.assertEqual(n, len(self.movies))
+        self.assertTrue(all(response['Response'] == "True" for response in self.cached()))
+
+        # the movies that fail on every retry are not cached and are requested on the next run
+        os.remove(self.cache_path)
+        with OmdbStub(failure_rate=1.0) as stub:
+            n, ratings = self.enrich(stub, retries=1)
+        self.assertEqual(n, 0)
+        self.assertEqual(stub.requests, 2 * len(self.movies))
+        self.assertFalse(os.path.isfile(self.cache_path))
+        self.assertTrue(ratings['rated'].isnull().all())
+
+    def test_output_is_written_incrementally_and_atomically(self):
+        written = []
+        save_ratings = rated_movies.save_ratings
+
+        def save(ratings: pd.DataFrame, path: str):
+            save_ratings(ratings, path)
+            # the file is complete after each write and the temporary file was renamed
+            self.assertFalse(os.path.isfile(path + ".tmp"))
+            saved = pd.read_csv(path)
+            self.assertEqual(saved['movie_id'].tolist(), list(self.movies.index))
+            written.append(int(saved['rated'].notnull().sum()))
+
+        with OmdbStub(latency=0.005) as stub, mock.patch.object(rated_movies, 'save_ratings', save):
+            n, _ = self.enrich(stub, concurrency=2, flush_every=5)
+
+        self.assertEqual(n, len(self.movies))
+        self.assertGreaterEqual(len(written), len(self.movies) // 5)
+        self.assertEqual(written, sorted(written))
+        self.assertLess(written[0], len(self.movies))
+        self.assertEqual(written[-1], len(self.movies))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "WikidataIntegration"))
+from fake_sparql import FakeSparqlEndpoint
+
+try:
+    import wikidata_integration
+except ImportError:
+    wikidata_integration = None
+
+
+def movies_set(n: int):
+    """
+    Function that creates a movie data set sorted by imdb id as the one of wikidata_integration.py
+    :param n: number of movies
+    :return: DataFrame with the movie id as index and the full_imdbId column
+    """
+    movies = pd.DataFrame({'movie_id': range(1, n + 1), 'full_imdbId': ["tt%07d" % (100 + 3 * m) for m in range(n)]})
+    return movies.set_index('movie_id')
+
+
+@unittest.skipIf(wikidata_integration is None, "SPARQLWrapper is not installed")
+class HarvestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, "props.csv")
+        self.checkpoints = os.path.join(self.directory.name, "checkpoints")
+        self.movies = movies_set(7)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def harvest(self, endpoint: FakeSparqlEndpoint, **args):
+        """
+        Function that harvests the movies from the endpoint with small batches and waits
+        :param endpoint: fake endpoint
+        :param args: other arguments of harvest
+        :return: ids of the movies with properties
+        """
+        args = dict(dict(batch_size=3, concurrency=3, rate=200, retries=10, backoff=0.001), **args)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return wikidata_integration.harvest(self.movies, self.output, self.checkpoints, endpoint.url, **args)
+
+    def assertOutput(self, endpoint: FakeSparqlEndpoint):
+        """
+        Function that checks that the output has the properties of all the movies in the order of the movie data set
+        :param endpoint: fake endpoint
+        """
+        props = pd.read_csv(self.output)
+        self.assertEqual(list(props.columns), wikidata_integration.COLUMNS)
+        expected = [m for m in self.movies.index for _ in range(endpoint.props_per_movie)]
+        self.assertEqual(props['movie_id'].tolist(), expected)
+        self.assertEqual(props['imdbId'].tolist(), list(self.movies.loc[expected, 'full_imdbId']))
+
+    def test_harvest_keeps_the_last_partial_batch(self):
+        with FakeSparqlEndpoint(props_per_movie=4) as endpoint:
+            obtained = self.harvest(endpoint)
+
+        self.assertEqual(obtained, set(self.movies.index))
+        self.assertEqual(endpoint.requests, 3)
+        self.assertOutput(endpoint)
+
+    def test_failed_requests_are_retried(self):
+        with FakeSparqlEndpoint(props_per_movie=4, failure_rate=0.5, seed=1) as endpoint:
+            obtained = self.harvest(endpoint, batch_size=1, concurrency=4)
+
+        self.assertGreater(endpoint.failures, 0)
+        self.assertEqual(endpoint.requests, len(self.movies) + endpoint.failures)
+        self.assertEqual(obtained, set(self.movies.index))
+        self.assertOutput(endpoint)
+
+    def test_failed_requests_stop_after_the_retries(self):
+        with FakeSparqlEndpoint(failure_rate=1.0) as endpoint:
+            with self.assertRaises(wikidata_integration.RETRY_ERRORS):
+                self.harvest(endpoint, concurrency=1, retries=2)
+
+        self.assertEqual(endpoint.requests, 3)
+
+    def test_harvest_resumes_from_the_checkpoints(self):
+        with FakeSparqlEndpoint(props_per_movie=4) as endpoint:
+            self.harvest(endpoint)
+
+        # only the batch without checkpoint is queried again
+        os.remove(os.path.join(self.checkpoints, "batch-00001.csv"))
+        with FakeSparqlEndpoint(props_per_movie=4) as endpoint:
+            obtained = self.harvest(endpoint)
+        self.assertEqual(endpoint.requests, 1)
+        self.assertEqual(obtained, set(self.movies.index))
+        self.assertOutput(endpoint)
+
+        # the checkpoints of other batch size are not reused
+        with FakeSparqlEndpoint(props_per_movie=4) as endpoint:
+            self.harvest(endpoint, batch_size=2)
+        self.assertEqual(endpoint.requests, 4)
+        self.assertOutput(endpoint)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import conversation
+import instrumentation
+from test_server import small_data
+
+
+class FailingSink(instrumentation.HistogramSink):
+    """
+    Sink that fails on every measure
+    """
+
+    def span(self, name: str, seconds: float):
+        raise OSError("disk full")
+
+    def turn(self, record: dict):
+        raise OSError("disk full")
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = small_data()
+
+    def tearDown(self):
+        instrumentation.disable()
+
+    def test_concurrent_prometheus_flushes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "bot.prom")
+            sink = instrumentation.PrometheusSink(path, every=0)
+            sink.span('page_rank', 0.01)
+            errors = []
+
+            def flush():
+                try:
+                    for _ in range(50):
+                        sink.flush()
+                except Exception as e:
+                    errors.append(e)
+
+            threads = [threading.Thread(target=flush) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            self.assertEqual(os.listdir(directory), ["bot.prom"])
+            with open(path) as f:
+                self.assertIn('semanticbot_span_seconds_count{name="page_rank"} 1', f.read())
+
+    def test_sink_errors_do_not_fail_the_turn(self):
+        histogram = instrumentation.HistogramSink()
+        with tempfile.TemporaryDirectory() as directory:
+            instrumentation.enable(instrumentation.Tracer([FailingSink(), histogram], sample_rate=1.0,
+                                                          profile_dir=os.path.join(directory, "profiles")))
+            session = conversation.ConversationSession(self.data)
+            with self.assertLogs('instrumentation', level='ERROR'):
+                self.assertEqual(session.start()['state'], 'age')
+                self.assertEqual(session.answer_age(25)['state'], 'property')
+            self.assertEqual(len(os.listdir(os.path.join(directory, "profiles"))), 2)
+
+        self.assertEqual(histogram.turns, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
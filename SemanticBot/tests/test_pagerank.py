@@ -0,0 +1,88 @@
+import os
+import sys
+import unittest
+import networkx as nx
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pagerank
+import utils
+from subgraph import SubGraph
+from test_server import small_data
+
+
+def networkx_pagerank(data, sub_graph: SubGraph, watched: list, objects: list, weight_vec: list, use_objs: bool):
+    """
+    Function that runs the pagerank of a turn with networkx on a graph built from the datasets, as the bot did before
+    the PageRankGraph: the ratings, the properties of the sub graph and the watched movies connected to the user
+    :return: dictionary with the pagerank of each node name, eg U1, M2, QG1 or session
+    """
+    ratings = data.ratings
+    frame = sub_graph.frame()
+    edges = [("U" + str(u), "M" + str(m)) for u, m in zip(ratings['user_id'], ratings['movie_id'])]
+    edges += [("M" + str(m), str(c)) for m, c in zip(frame.index, frame['obj_code'])]
+    edges += [("session", "M" + str(m)) for m in watched]
+    graph = nx.Graph(edges)
+
+    preferences = ["M" + str(m) for m in watched] + (list(objects) if use_objs else [])
+    personalization = None
+    if len(preferences) > 0:
+        value_watched = weight_vec[0] / len(preferences)
+        value_all = weight_vec[1] / (graph.number_of_nodes() - len(preferences))
+        personalization = {node: value_watched if node in preferences else value_all for node in graph.nodes}
+
+    return nx.pagerank(graph, personalization=personalization, max_iter=1000, tol=1.0e-12)
+
+
+class PageRankTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = small_data()
+        cls.full = SubGraph(cls.data.prop_index)
+        cls.shrunk = cls.full.shrink("genre", "genre 1")
+
+    def assertSamePagerank(self, pr: np.ndarray, expected: dict):
+        """
+        Function that checks that a pagerank vector has the values of the networkx pagerank and zero for the nodes that
+        are not on the graph
+        :param pr: pagerank vector with one position for each node of the pagerank graph
+        :param expected: pagerank of each node name
+        """
+        nodes = self.data.pr_graph.node_ids(list(expected))
+        self.assertTrue((nodes >= 0).all())
+        np.testing.assert_allclose(pr[nodes], list(expected.values()), rtol=1e-4)
+        self.assertEqual(np.count_nonzero(np.delete(pr, nodes)), 0)
+        self.assertAlmostEqual(pr.sum(), 1.0)
+
+    def test_pagerank_without_personalization(self):
+        for sub_graph in [self.full, self.shrunk]:
+            pr = utils.page_rank(sub_graph, self.data.pr_graph, [], [], [0.8, 0.2], False)
+            self.assertSamePagerank(pr, networkx_pagerank(self.data, sub_graph, [], [], [0.8, 0.2], False))
+
+    def test_pagerank_with_personalization(self):
+        for watched, objects in [([3, 7], []), ([3, 7], ["QG1"]), ([], ["QG1", "QD2"])]:
+            pr = utils.page_rank(self.shrunk, self.data.pr_graph, watched, objects, [0.8, 0.2], True)
+            self.assertSamePagerank(pr, networkx_pagerank(self.data, self.shrunk, watched, objects, [0.8, 0.2], True))
+
+    def test_warm_start_converges_to_the_same_pagerank(self):
+        state = pagerank.PageRankState()
+        turns = [(self.full, [], ["QG1"]), (self.shrunk, [], ["QG1"]), (self.shrunk, [4], ["QG1", "QD0"])]
+        for sub_graph, watched, objects in turns:
+            pr = utils.page_rank(sub_graph, self.data.pr_graph, watched, objects, [0.8, 0.2], True, state=state)
+            self.assertSamePagerank(pr, networkx_pagerank(self.data, sub_graph, watched, objects, [0.8, 0.2], True))
+            self.assertIs(state.last, pr)
+        self.assertEqual(len(state.iterations), 3)
+
+    def test_personalization_vector(self):
+        present = np.array([True, True, False, True, True])
+        vector = pagerank.personalization_vector(present, np.array([1, 2, -1]), 3, [0.8, 0.2])
+
+        # the preferences that are not on the graph count on the weights and have no value
+        value_watched, value_all = 0.8 / 3, 0.2 / (4 - 3)
+        expected = np.array([value_all, value_watched, 0, value_all, value_all])
+        np.testing.assert_allclose(vector, expected / expected.sum())
+
+
+if __name__ == "__main__":
+    unittest.main()
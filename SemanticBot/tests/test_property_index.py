@@ -0,0 +1,123 @@
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+from scipy.stats import entropy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import utils
+from property_index import PropertyIndex, PairCounts
+from subgraph import SubGraph
+from test_server import small_data
+
+
+def shuffled_graph():
+    """
+    Function that creates the property graph of the small catalog with the rows out of movie order and an object name
+    shared by two properties
+    :return: full graph with the movie id as index
+    """
+    full_graph = small_data().full_prop_graph
+    extra = full_graph[full_graph['prop'] == "director"].copy()
+    extra['prop'] = "writer"
+    extra['obj_code'] = extra['obj_code'].str.replace("QD", "QW")
+    return pd.concat([full_graph, extra]).sample(frac=1, random_state=0)
+
+
+def frame_entropy(sub_graph: pd.DataFrame):
+    """
+    Function that calculates the entropy of the properties of a graph with value counts, as the bot did before the
+    PairCounts
+    :param sub_graph: property graph
+    :return: entropies of properties on dictionary
+    """
+    entropies = {}
+    for prop in sub_graph['prop'].value_counts().index:
+        o_values = sub_graph[(sub_graph['prop'] == prop)]['obj'].value_counts()
+        entropies[prop] = entropy(o_values.values / o_values.values.sum(), base=2)
+    return entropies
+
+
+class PropertyIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.graph = shuffled_graph()
+        cls.index = PropertyIndex(cls.graph)
+
+    def test_movies_with(self):
+        for (prop, obj), rows in self.graph.groupby(['prop', 'obj']):
+            movies = self.index.movies[self.index.movies_with(prop, obj)]
+            self.assertEqual(list(movies), sorted(rows.index.unique()))
+        self.assertEqual(len(self.index.movies_with("director", "genre 1")), 0)
+        self.assertEqual(len(self.index.movies_with("actor", "director 1")), 0)
+
+    def test_objects_of(self):
+        for prop, rows in self.graph.groupby('prop'):
+            objs, counts = self.index.objects_of(prop)
+            expected = rows['obj'].value_counts()
+            self.assertEqual(dict(zip(objs, counts)), expected.to_dict())
+            self.assertEqual(list(counts), sorted(counts, reverse=True))
+        self.assertEqual(len(self.index.objects_of("actor")[0]), 0)
+
+    def test_obj_code(self):
+        self.assertEqual(self.index.obj_code("director", "director 1"), "QD1")
+        self.assertEqual(self.index.obj_code("writer", "director 1"), "QW1")
+        self.assertIsNone(self.index.obj_code("genre", "director 1"))
+
+    def test_rows_of_the_movies(self):
+        codes = self.index.movie_codes([7, 2, 99])
+        self.assertEqual(codes[2], -1)
+        for code in codes[:2]:
+            movie = self.index.movies[code]
+            table = self.index.table.iloc[self.index.rows_of(movie)]
+            self.assertTrue((table.index == movie).all())
+            self.assertEqual(len(table), len(self.graph.loc[[movie]]))
+
+        rows = self.index.table.iloc[self.index.rows(codes[:2])]
+        self.assertEqual(list(rows.index.unique()), [7, 2])
+        self.assertEqual(len(rows), len(self.graph.loc[[7, 2]]))
+
+
+class PairCountsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.index = PropertyIndex(shuffled_graph())
+
+    def assertSameEntropy(self, sub_graph: SubGraph):
+        """
+        Function that checks the entropy of a sub graph against the entropy of its rows and of new pair counts
+        :param sub_graph: sub graph
+        """
+        expected = frame_entropy(sub_graph.frame())
+        entropies = utils.calculate_entropy(sub_graph)
+        self.assertEqual(set(entropies), set(expected))
+        for prop, h in expected.items():
+            self.assertAlmostEqual(entropies[prop], h)
+        np.testing.assert_allclose(sub_graph.pair_counts().entropy(),
+                                   PairCounts(self.index, sub_graph.codes()).entropy())
+
+    def test_entropy(self):
+        sub_graph = SubGraph(self.index)
+        self.assertSameEntropy(sub_graph)
+        self.assertSameEntropy(SubGraph(self.index).shrink("genre", "genre 1"))
+
+    def test_entropy_is_updated_when_the_sub_graph_shrinks(self):
+        sub_graph = SubGraph(self.index)
+        sub_graph.pair_counts()
+        for step in [lambda g: g.drop([1, 2]), lambda g: g.drop(3), lambda g: g.shrink("writer", "director 1")]:
+            derived = step(sub_graph)
+            # the counts are derived from the ones of the previous sub graph when few movies are removed
+            self.assertEqual(derived._counts is not None, len(sub_graph) - len(derived) < len(derived))
+            self.assertSameEntropy(derived)
+            sub_graph = derived
+
+        counts = PairCounts(self.index, SubGraph(self.index).codes())
+        counts.remove(SubGraph(self.index).codes())
+        self.assertTrue(np.isnan(counts.entropy()).all())
+
+
+if __name__ == "__main__":
+    unittest.main()
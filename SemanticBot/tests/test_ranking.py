@@ -0,0 +1,85 @@
+import os
+import sys
+import unittest
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import ranking
+import utils
+from subgraph import SubGraph
+from test_server import small_data
+
+
+class TopKTest(unittest.TestCase):
+
+    def test_top_k(self):
+        values = np.random.default_rng(0).permutation(100).astype(float)
+        for k in [1, 5, 99, 100, 150]:
+            self.assertEqual(list(ranking.top_k(values, k)), list(np.argsort(-values)[:k]))
+
+    def test_ties_and_nan(self):
+        values = np.array([1.0, np.nan, 3.0, 1.0, 3.0])
+        self.assertEqual(list(ranking.top_k(values, 5)), [2, 4, 0, 3, 1])
+        self.assertEqual(sorted(ranking.top_k(values, 2)), [2, 4])
+        self.assertEqual(list(ranking.top_k(values, 4)[2:]), [0, 3])
+
+
+class RankedCursorTest(unittest.TestCase):
+
+    def setUp(self):
+        # properties with repeated rows, each with a different value
+        rng = np.random.default_rng(1)
+        self.frame = pd.DataFrame({'prop': rng.choice(["genre", "director"], 300),
+                                   'obj': rng.integers(0, 60, 300).astype(str),
+                                   'value': rng.permutation(300).astype(float)})
+        self.expected = self.frame.sort_values(by=['value'], ascending=False).drop_duplicates(['prop', 'obj'])
+
+    def test_pages_are_the_sorted_rows_without_duplicates(self):
+        cursor = ranking.RankedCursor(self.frame, 'value', ['prop', 'obj'], block=4)
+        for start in [0, 5, 10, 40, 5, 0, len(self.expected) - 3]:
+            page = cursor.page(start, 5)
+            pd.testing.assert_frame_equal(page, self.expected.iloc[start:start + 5])
+
+        self.assertEqual(len(cursor.page(len(self.expected), 5)), 0)
+        pd.testing.assert_frame_equal(cursor.page(-5, 5), self.expected.iloc[:5])
+
+    def test_duplicates_of_all_columns(self):
+        frame = pd.concat([self.frame, self.frame]).reset_index(drop=True)
+        cursor = ranking.RankedCursor(frame)
+        page = cursor.page(0, len(frame))
+        self.assertEqual(len(page), len(self.frame))
+        self.assertEqual(list(page['value']), sorted(self.frame['value'], reverse=True))
+
+
+class OrderMoviesTest(unittest.TestCase):
+
+    def test_top_k_movies_are_the_first_of_the_ordering(self):
+        data = small_data()
+        sub_graph = SubGraph(data.prop_index).drop([2])
+        ordered = utils.order_movies_by_pagerank(sub_graph, data.pr_graph, [3], ["QG1"], [0.8, 0.2], True)
+        self.assertEqual(len(ordered), len(sub_graph))
+        for k in [1, 3]:
+            top = utils.order_movies_by_pagerank(sub_graph, data.pr_graph, [3], ["QG1"], [0.8, 0.2], True, k=k)
+            self.assertEqual(list(top.index), list(ordered.index[:k]))
+            np.testing.assert_allclose(top['value'], ordered['value'].iloc[:k].astype(float))
+
+    def test_movies_by_popularity(self):
+        data = small_data()
+        # the ratings of movies without properties are not counted
+        ratings = pd.concat([data.ratings, pd.DataFrame({'user_id': [1, 2], 'movie_id': [99, 4], 'rating': 4})])
+        popularity = utils.movies_popularity(data.prop_index, ratings)
+        counts = ratings['movie_id'].value_counts()
+        self.assertEqual(list(popularity), [counts.get(m, 0) for m in data.prop_index.movies])
+
+        sub_graph = SubGraph(data.prop_index).shrink("genre", "genre 1")
+        ordered = utils.order_movies_by_pop(sub_graph, popularity)
+        self.assertEqual(sorted(ordered.index), list(sub_graph.movies()))
+        self.assertEqual(list(ordered['value']), [counts.get(m, 0) for m in ordered.index])
+        self.assertEqual(list(ordered['value']), sorted(ordered['value'], reverse=True))
+        top = utils.order_movies_by_pop(sub_graph, popularity, k=2)
+        self.assertEqual(list(top['value']), list(ordered['value'][:2]))
+
+
+if __name__ == "__main__":
+    unittest.main()
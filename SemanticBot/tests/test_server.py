@@ -0,0 +1,205 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import unittest
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import conversation
+import relevance
+import server
+
+
+def small_data():
+    """
+    Function that creates the bot data of a small catalog of movies
+    :return: bot data
+    """
+    rows = []
+    for m in range(1, 13):
+        rows.append((m, "Movie " + str(m), "genre", "genre " + str(m % 3), "QG" + str(m % 3), "tt" + str(m)))
+        rows.append((m, "Movie " + str(m), "director", "director " + str(m % 4), "QD" + str(m % 4), "tt" + str(m)))
+    full_graph = pd.DataFrame(rows, columns=['movie_id', 'title', 'prop', 'obj', 'obj_code', 'imdbId'])
+    full_graph = full_graph.set_index('movie_id')
+    ratings = pd.DataFrame({'user_id': [u for u in range(1, 7) for _ in range(4)],
+                            'movie_id': [(u * 5 + i) % 12 + 1 for u in range(1, 7) for i in range(4)],
+                            'rating': 4})
+    movie_rate = pd.DataFrame({'rated': 'PG'}, index=pd.Index(range(1, 13), name='movie_id'))
+    return conversation.BotData(full_graph, ratings, movie_rate, relevance.compute(full_graph, ratings))
+
+
+class FailingRanker:
+    """
+    Ranker that fails with an error that is not raised by the steps of the conversation
+    """
+
+    def order_props(self, session):
+        raise ZeroDivisionError("ranking failed")
+
+    def order_movies(self, session):
+        raise ZeroDivisionError("ranking failed")
+
+
+class SlowRanker(conversation.LocalRanker):
+    """
+    Ranker that waits for an event before ranking
+    """
+
+    def __init__(self):
+        self.resume = threading.Event()
+        self.resume.set()
+
+    def order_props(self, session):
+        self.resume.wait(5)
+        return super().order_props(session)
+
+    def order_movies(self, session):
+        self.resume.wait(5)
+        return super().order_movies(session)
+
+
+class Writer:
+    """
+    Stream of the responses of the server kept on memory
+    """
+
+    def __init__(self):
+        self.lines = []
+
+    def write(self, data: bytes):
+        self.lines.extend(json.loads(line) for line in data.decode().splitlines())
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class PausedWriter(Writer):
+    """
+    Stream of the responses that does not drain until it is resumed, as the stream of a client that stops reading
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.resume = asyncio.Event()
+        self.draining = 0
+        self.max_draining = 0
+
+    async def drain(self):
+        self.draining = self.draining + 1
+        self.max_draining = max(self.max_draining, self.draining)
+        await self.resume.wait()
+        self.draining = self.draining - 1
+
+
+class BotServerTest(unittest.IsolatedAsyncioTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = small_data()
+
+    async def serve(self, bot: server.BotServer, requests: list):
+        """
+        Function that sends requests in order to the server, each one after the response of the previous one
+        :param bot: server
+        :param requests: request dictionaries
+        :return: responses
+        """
+        responses = []
+        for request in requests:
+            reader = asyncio.StreamReader()
+            reader.feed_data((json.dumps(request) + "\n").encode())
+            reader.feed_eof()
+            writer = Writer()
+            await bot.serve(reader, writer)
+            responses.extend(writer.lines)
+        return responses
+
+    async def test_unexpected_error_rolls_back_the_step(self):
+        bot = server.BotServer(self.data, FailingRanker())
+        responses = await self.serve(bot, [{'session': 's', 'action': 'start'},
+                                           {'session': 's', 'action': 'answer_age', 'value': 25},
+                                           {'session': 's', 'action': 'choose_property', 'value': "genre"},
+                                           {'session': 's', 'action': 'respond', 'value': "genre 1"}])
+
+        self.assertEqual(len(responses), 4)
+        self.assertEqual(responses[3], {'session': 's', 'error': "ranking failed"})
+        self.assertEqual(bot.sessions['s'].state, 'object')
+
+        # the session continues from the state before the failed step
+        bot.ranker = None
+        bot.sessions['s'].ranker = conversation.LocalRanker()
+        response = await bot.handle({'session': 's', 'action': 'respond', 'value': "genre 1"})
+        self.assertIn(response['state'], ['ask', 'recommend'])
+
+    async def test_start_does_not_replace_an_open_session(self):
+        bot = server.BotServer(self.data)
+        await bot.handle({'session': 's', 'action': 'start'})
+        session = bot.sessions['s']
+        slot = session.ban.slot
+
+        response = await bot.handle({'session': 's', 'action': 'start'})
+        self.assertIn('error', response)
+        self.assertIs(bot.sessions['s'], session)
+        self.assertTrue(bot.bandits.used[slot])
+
+        await bot.handle({'session': 's', 'action': 'close'})
+        response = await bot.handle({'session': 's', 'action': 'start'})
+        self.assertEqual(response['state'], 'age')
+
+    async def test_responses_are_drained_one_at_a_time(self):
+        bot = server.BotServer(self.data, max_inflight=2)
+        reader = asyncio.StreamReader()
+        for i in range(5):
+            reader.feed_data((json.dumps({'session': str(i), 'action': 'close'}) + "\n").encode())
+        reader.feed_eof()
+        writer = PausedWriter()
+        serving = asyncio.ensure_future(bot.serve(reader, writer))
+
+        # the client does not read, so only the requests that fit on max_inflight are answered
+        for _ in range(20):
+            await asyncio.sleep(0)
+        self.assertEqual(len(writer.lines), 1)
+
+        writer.resume.set()
+        await asyncio.wait_for(serving, 5)
+        self.assertEqual([r['session'] for r in writer.lines], [str(i) for i in range(5)])
+        self.assertEqual(writer.max_draining, 1)
+
+    async def test_step_timeout(self):
+        ranker = SlowRanker()
+        bot = server.BotServer(self.data, ranker, timeout=0.05)
+        await self.serve(bot, [{'session': 's', 'action': 'start'},
+                               {'session': 's', 'action': 'answer_age', 'value': 25},
+                               {'session': 's', 'action': 'choose_property', 'value': "genre"}])
+        ranker.resume.clear()
+        response = await bot.handle({'session': 's', 'action': 'respond', 'value': "genre 1"})
+        self.assertEqual(response, {'session': 's', 'error': "the step took more than 0.05 seconds"})
+        self.assertTrue(bot._locks['s'].locked())
+
+        # the next request waits for the step that timed out, that is rolled back
+        ranker.resume.set()
+        bot.timeout = None
+        response = await bot.handle({'session': 's', 'action': 'respond', 'value': "genre 1"})
+        self.assertIn(response['state'], ['ask', 'recommend'])
+        self.assertFalse(bot._locks['s'].locked())
+
+    async def test_idle_sessions_expire(self):
+        bot = server.BotServer(self.data, max_sessions=2, session_ttl=60)
+        for sid in ['a', 'b']:
+            await bot.handle({'session': sid, 'action': 'start'})
+        self.assertIn('error', await bot.handle({'session': 'c', 'action': 'start'}))
+
+        bot.session_ttl = 0
+        response = await bot.handle({'session': 'c', 'action': 'start'})
+        self.assertEqual(response['state'], 'age')
+        self.assertEqual(list(bot.sessions), ['c'])
+        self.assertEqual(len(bot.bandits), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,39 +1,45 @@
+import numpy as np
 import pandas as pd
-import networkx as nx
-from scipy.stats import entropy
+import instrumentation
+import pagerank
+import ranking
+import relevance
+from graph import PageRankGraph
+from property_index import PropertyIndex
+from subgraph import SubGraph
 
 
-def prop_most_pop(sub_graph: pd.DataFrame, prop: str):
+def prop_most_pop(sub_graph: SubGraph, prop: str):
     """
     Function that returns the most popular values for property prop
     :param sub_graph: sub graph that represents the current graph that matches the users preferences
     :param prop: property the user is looking for
     :return: ordered list of most popular values of property
     """
-    return sub_graph[(sub_graph['prop'] == prop)]['obj'].value_counts().index.values
+    index = sub_graph.prop_index
+    rows = sub_graph.rows()
+    p = index.props.get_indexer([prop])[0]
+    objs = index.row_obj[rows[index.row_prop[rows] == p]]
 
+    counts = np.bincount(objs, minlength=len(index.objs))
+    ordered = np.argsort(-counts, kind='stable')
+    return index.objs[ordered[:np.count_nonzero(counts)]].to_numpy()
 
-def calculate_entropy(sub_graph: pd.DataFrame):
+
+@instrumentation.traced()
+def calculate_entropy(sub_graph: SubGraph):
     """
-    Function that calculates the entropy for all properties
+    Function that calculates the entropy for all properties. The counts of the values of the properties are updated
+    incrementally when the sub graph shrinks
     :param sub_graph: sub graph that represents the current graph that matches the users preferences
     :return: entropies of properties on dictionary
     """
-    entropies = {}
-    for prop in sub_graph['prop'].value_counts().index:
-        o_values = sub_graph[(sub_graph['prop'] == prop)]['obj'].value_counts()
-        denom = sum(o_values.values)
-        prob = []
-        for value in o_values.index:
-            num = o_values[value]
-            prob.append(num / denom)
-
-        entropies[prop] = entropy(prob, base=2)
-
-    return entropies
+    h = sub_graph.pair_counts().entropy()
+    present = ~np.isnan(h)
+    return dict(zip(sub_graph.prop_index.props[present], h[present]))
 
 
-def show_props(graph: pd.DataFrame, percentage: float):
+def show_props(graph: SubGraph, percentage: float):
     """
     Function that returns the properties that appear in a bigger percentage that that one passed as a parameter to the
     function
@@ -41,19 +47,19 @@ def show_props(graph: pd.DataFrame, percentage: float):
     :param percentage: threshold of movies with prop to show to the user
     :return: list of properties that have higher threshold
     """
-    props_t_show = []
-    total_movies = len(graph.index.unique())
-    for p in graph['prop'].unique():
-        movies_prop = len(graph[(graph['prop'] == p)].index.unique())
+    index = graph.prop_index
+    rows = graph.rows()
 
-        rel = movies_prop/total_movies
-        if rel >= percentage:
-            props_t_show.append(p)
+    # number of different movies of each property
+    prop_movies = np.unique(index.row_prop[rows].astype(np.int64) * len(index.movies) + index.row_movie[rows])
+    movies_prop = np.bincount(prop_movies // len(index.movies), minlength=len(index.props))
 
-    return props_t_show
+    rel = movies_prop / len(graph)
+    return index.props[(movies_prop > 0) & (rel >= percentage)].to_list()
 
 
-def shrink_graph(sub_graph: pd.DataFrame, prop: str, obj: str):
+@instrumentation.traced()
+def shrink_graph(sub_graph: SubGraph, prop: str, obj: str):
     """
     Function that shrinks the graph to a sub graph based on the property and value passed on the parameters.
     :param sub_graph: sub graph that represents the current graph that matches the users preferences
@@ -61,119 +67,142 @@ def shrink_graph(sub_graph: pd.DataFrame, prop: str, obj: str):
     :param obj: value of property the user is looking for
     :return: shirked graph of the one passed as parameter
     """
-    shrinked = sub_graph[(sub_graph['prop'] == prop) & (sub_graph['obj'] == obj)]
-
-    for movie_id in shrinked.index.unique():
-        shrinked = pd.concat([shrinked, sub_graph.loc[movie_id]])
-
-    return shrinked.sort_index()
+    return sub_graph.shrink(prop, obj)
 
 
-def page_rank(graph: pd.DataFrame, edgelist: pd.DataFrame, watched: list, objects: list, weight_vec: list,
-              use_objs=False):
+@instrumentation.traced()
+def page_rank(graph: SubGraph, pr_graph: PageRankGraph, watched: list, objects: list, weight_vec: list,
+              use_objs=False, state=None, cache=None):
     """
     Run the page rank on the graph
 
     :param graph: sub graph that represents the current graph that matches the users preferences
-    :param edgelist: edge list of users and movies from the dataset. The dataframe has two columns, the origin of the
-        edge and the destination
+    :param pr_graph: graph of users, movies and objects of the dataset built once when the bot starts
     :param watched: movies that the user watched
     :param objects: codes of objects on the graph that the user liked (eg Q1245)
     :param weight_vec: list with size two and sum equal to one with the weights of the personalization to the watched
     movies and the rest of the nodes
     :param use_objs: boolean value to use on the pagerank or not the objects list that the user liked
-    :return:
+    :param state: pagerank state of the conversation to warm start the solve, None to start from the uniform
+    distribution
+    :param cache: pagerank cache of the process to reuse equivalent solves, None to always solve
+    :return: array with the pagerank of each node of pr_graph, zero for the nodes that are not on the graph
     """
 
-    # append edgelist that only hast movies and user edges and add the movies to values on the wikidata edges
-    copy = graph.copy()
-    copy['origin'] = ['M' + x for x in copy.index.astype(str)]
-    copy['destination'] = copy['obj_code']
-    full_edgelist = pd.concat([edgelist, copy[['origin', 'destination']]])
-
-    # create graph
-    G = nx.from_pandas_edgelist(full_edgelist, 'origin', 'destination')
-
-    # get movie codes for the watched movies
-    movie_codes = ['M' + str(x) for x in watched]
+    # return the cached pagerank if the same solve was made before
+    movie_mask = pr_graph.movie_mask(graph.movies())
+    key = None
+    if cache is not None:
+        key = cache.fingerprint(pr_graph.n_nodes, movie_mask, watched, objects, weight_vec, use_objs)
+        pr = cache.get(key)
+        if pr is not None:
+            instrumentation.count('pagerank_cache_hits')
+            if state is not None:
+                state.last = pr
+            return pr
+        instrumentation.count('pagerank_cache_misses')
+
+    # mask the properties of the movies that are not on the sub graph and connect the watched movies to the user
+    adj = pr_graph.adjacency(movie_mask, watched)
 
     # if user did not watched any movies and dont want to use the prop values on the personalized PR
     # then personalization is none
-    # else create personalization and assign weights on personalization dict
-    preferences = movie_codes
-    personalization = {}
-    if not use_objs and (len(preferences) == 0):
-        personalization = None
-    elif use_objs:
-        preferences = preferences + objects
-
-    if personalization is not None:
-        value_watched = weight_vec[0] / len(preferences)
-        value_all = weight_vec[1] / (G.number_of_nodes() - len(preferences))
-
-        for node in G.nodes:
-            if node in preferences:
-                personalization[node] = value_watched
-            else:
-                personalization[node] = value_all
+    # else create personalization vector with the nodes of watched movies and liked objects
+    preferences = pr_graph.movie_nodes(watched)
+    n_preferences = len(watched)
+    if use_objs:
+        preferences = np.concatenate([preferences, pr_graph.vocabulary.object_ids(objects)])
+        n_preferences = n_preferences + len(objects)
+
+    personalization = None
+    if use_objs or n_preferences > 0:
+        present = np.asarray(adj.sum(axis=1)).ravel() > 0
+        personalization = pagerank.personalization_vector(present, preferences, n_preferences, weight_vec)
 
     # calculate pagerank
-    pr_np = nx.pagerank_scipy(G, personalization=personalization, max_iter=1000)
-    return pr_np
+    if state is not None:
+        pr = state.solve(adj, personalization)
+        n_iter = state.iterations[-1]
+    else:
+        pr, n_iter = pagerank.pagerank(adj, personalization, max_iter=1000)
+    instrumentation.count('pagerank_iterations', n_iter)
+
+    if cache is not None:
+        cache.put(key, pr)
+
+    return pr
 
 
-def order_movies_by_pagerank(sub_graph: pd.DataFrame, edgelist: pd.DataFrame, watched: list, objects: list,
-                             weight_vec: list, use_objs=False):
+@instrumentation.traced()
+def order_movies_by_pagerank(sub_graph: SubGraph, pr_graph: PageRankGraph, watched: list, objects: list,
+                             weight_vec: list, use_objs=False, state=None, cache=None, k=None):
     """
     Function that order the movies based on its' pagerank on the graph. The adj matrix is created on the
     WikidataIntegration project, in the adjacency_matrix.py
     :param sub_graph: sub graph that represents the current graph that matches the users preferences
-    :param edgelist: edge list of users and movies from the dataset. The dataframe has two columns, the origin of the
-        edge and the destination
+    :param pr_graph: graph of users, movies and objects of the dataset built once when the bot starts
     :param watched: movies that the user watched
     :param objects: codes of objects on the graph that the user liked (eg Q1245)
     :param weight_vec: list with size two and sum equal to one with the weights of the personalization to the watched
     movies and the rest of the nodes
     :param use_objs: boolean value to use on the pagerank or not the objects list that the user liked
+    :param state: pagerank state of the conversation to warm start the solve
+    :param cache: pagerank cache of the process to reuse equivalent solves
+    :param k: number of movies to return, None to order all movies
     :return: ordered movies on a DataFrame
     """
 
-    pr = page_rank(sub_graph, edgelist, watched, objects, weight_vec, use_objs)
+    pr = page_rank(sub_graph, pr_graph, watched, objects, weight_vec, use_objs, state, cache)
 
     # order movies
-    ordered_movies = pd.DataFrame(index=sub_graph.index.unique(), columns=['value'])
-    for m in sub_graph.index.unique():
-        movie_code = 'M' + str(m)
-        ordered_movies.at[m] = pr[movie_code]
+    movies = sub_graph.movies()
+    values = pr[pr_graph.movie_nodes(movies)]
+    if k is not None:
+        top = ranking.top_k(values, k)
+        return pd.DataFrame({'value': values[top]}, index=pd.Index(movies[top], name='movie_id'))
 
+    ordered_movies = pd.DataFrame({'value': values}, index=movies)
     return ordered_movies.sort_values(by=['value'], ascending=False)
 
 
-def order_movies_by_pop(sub_graph: pd.DataFrame, ratings: pd.DataFrame):
+def movies_popularity(index: PropertyIndex, ratings: pd.DataFrame):
+    """
+    Function that counts the ratings of each movie of the property index, to compute it only once when the bot starts
+    :param index: property index of the full graph
+    :param ratings: ratings dataset in the format user_id, movie_id, rating
+    :return: array with the number of ratings of each movie of the index
+    """
+    codes = index.movie_codes(ratings['movie_id'])
+    return np.bincount(codes[codes >= 0], minlength=len(index.movies))
+
+
+def order_movies_by_pop(sub_graph: SubGraph, popularity: np.ndarray, k=None):
     """
     Function that order the movies based on its' popularity
     :param sub_graph: sub graph that represents the current graph that matches the users preferences
-    :param ratings: ratings dataset in the format user_id, movie_id, rating
+    :param popularity: number of ratings of each movie of the property index, see movies_popularity
+    :param k: number of movies to return, None to order all movies
     :return: ordered movies on a DataFrame
     """
-    ordered_movies = pd.DataFrame(index=sub_graph.index.unique(), columns=['value'])
-    for m in sub_graph.index.unique():
-        ordered_movies.at[m] = len(ratings[(ratings['movie_id'] == m)])
+    movies = sub_graph.movies()
+    values = popularity[sub_graph.codes()]
+    top = ranking.top_k(values, len(values) if k is None else k)
 
-    return ordered_movies.sort_values(by=['value'], ascending=False)
+    return pd.DataFrame({'value': values[top]}, index=pd.Index(movies[top], name='movie_id'))
 
 
-def order_props_pr(sub_graph: pd.DataFrame, global_zscore: pd.DataFrame, edgelist: pd.DataFrame, watched: list,
-                   objects: list, objects_names: list, weight_vec_pr: list, weight_vec_rank: list, use_objs=False):
+@instrumentation.traced()
+def order_props_pr(sub_graph: SubGraph, global_zscore: np.ndarray, pr_graph: PageRankGraph, watched: list,
+                   objects: list, objects_names: list, weight_vec_pr: list, weight_vec_rank: list, use_objs=False,
+                   state=None, cache=None, lazy=False):
     """
     Order the properties by the page rank and the entropy of the properties. The formula is:
     (weight_vec_rank[0] * entropy of property (actor, genre, etc)) +
     (weight_vec_rank[1] * pr of full graph of value (di Caprio, etc)) +
     (weight_vec_rank[2] * pr of sub graph of value
     :param sub_graph: sub graph that represents the current graph that matches the users preferences
-    :param global_zscore: global zscore property
-    :param edgelist: edge list of users and movies from the dataset. The dataframe has two columns, the origin of the
-        edge and the destination
+    :param global_zscore: global pr zscore of each (prop, obj) pair of the property index, see PropertyIndex.pair_values
+    :param pr_graph: graph of users, movies and objects of the dataset built once when the bot starts
     :param watched: movies that the user watched
     :param objects: codes of objects on the graph that the user liked (eg Q1245)
     :param objects_names: names of the objects on the graph that the user liked (e.g. Martin Scorsese, Leonardo Di Caprio, Bred Pitt, Disney, etc)
@@ -181,40 +210,53 @@ def order_props_pr(sub_graph: pd.DataFrame, global_zscore: pd.DataFrame, edgelis
     movies and the rest of the nodes
     :param weight_vec_rank: weight to compute on the formula to obtain value of property
     :param use_objs: boolean value to use on the pagerank or not the objects list that the user liked
-    :return: pandas df with the properties orderded by value
+    :param state: pagerank state of the conversation to warm start the solve
+    :param cache: pagerank cache of the process to reuse equivalent solves
+    :param lazy: True to return a ranked cursor that orders only the pages requested, without duplicated rows
+    :return: pandas df with the properties orderded by value, or the ranked cursor of the properties if lazy is True
     """
 
-    sub_slice = sub_graph[['prop', 'obj', 'obj_code']]
+    index = sub_graph.prop_index
+    rows = sub_graph.rows()
 
-    # page rank of local graph and value of local relevance
-    pr = page_rank(sub_graph, edgelist, watched, objects, weight_vec_pr, use_objs)
+    # page rank of local graph and value of local relevance, gathered by the node of the object code of each row
+    pr = page_rank(sub_graph, pr_graph, watched, objects, weight_vec_pr, use_objs, state, cache)
 
-    rank = sub_slice.copy()
-    rank['local_pr'] = rank.apply(lambda x: pr[x['obj_code']], axis=1)
-    rank['local_zscore'] = (rank['local_pr'] - rank['local_pr'].mean()) / rank['local_pr'].std()
+    code_node = index.code_node
+    if code_node is None:
+        code_node = pr_graph.vocabulary.object_ids(index.codes.astype(str).to_numpy(dtype=object))
+    local_pr = pr[code_node[index.row_code[rows]]]
+    local_zscore = (local_pr - local_pr.mean()) / local_pr.std(ddof=1)
 
-    # calculate entropy and create entropy column
-    entrs = calculate_entropy(sub_graph)
-    rank['h'] = rank.apply(lambda x: entrs[x['prop']], axis=1)
-    rank['h_zscore'] = (rank['h'] - rank['h'].mean()) / rank['h'].std()
+    # calculate entropy of each property and gather it by the property of each row
+    h = sub_graph.pair_counts().entropy()[index.row_prop[rows]]
+    h_zscore = (h - h.mean()) / h.std(ddof=1)
 
     # global relevance
-    rank['global_zscore'] = rank.apply(lambda x: global_zscore['pr_zscore'][(x['prop'], x['obj'])],
-                                                 axis=1)
+    g_zscore = global_zscore[index.row_pair[rows]]
 
     # sum the zscores for the total relevance
-    rank['value'] = (weight_vec_rank[0] * rank['h_zscore']) + \
-                         (weight_vec_rank[1] * rank['local_zscore']) + \
-                         (weight_vec_rank[2] * rank['global_zscore'])
+    value = (weight_vec_rank[0] * h_zscore) + (weight_vec_rank[1] * local_zscore) + (weight_vec_rank[2] * g_zscore)
 
     # remove liked objects
-    for p in objects_names:
-        rank = rank[(rank['obj'] != p[1])]
+    liked = index.objs.get_indexer([p[1] for p in objects_names])
+    keep = ~np.isin(index.row_obj[rows], liked[liked >= 0])
+
+    rank = index.table.iloc[rows[keep]][['prop', 'obj', 'obj_code']].copy()
+    rank['local_pr'] = local_pr[keep]
+    rank['local_zscore'] = local_zscore[keep]
+    rank['h'] = h[keep]
+    rank['h_zscore'] = h_zscore[keep]
+    rank['global_zscore'] = g_zscore[keep]
+    rank['value'] = value[keep]
+
+    if lazy:
+        return ranking.RankedCursor(rank, 'value', ['prop', 'obj', 'obj_code'])
 
     return rank.sort_values(by=['value'], ascending=False)
 
 
-def order_props_relevance(sub_graph: pd.DataFrame, global_zscore: dict, properties: list, weight_vec: list):
+def order_props_relevance(sub_graph: SubGraph, global_zscore: dict, properties: list, weight_vec: list):
     """
     Function that order the properties based on the entropy of the property, the relevance of the value locally
     normalized measured by the zscore of the count of the property on the sub graph and the relevance of the value
@@ -230,7 +272,7 @@ def order_props_relevance(sub_graph: pd.DataFrame, global_zscore: dict, properti
     """
 
     # make slice of subgraph of just property and obj
-    sub_slice = sub_graph[['prop', 'obj']]
+    sub_slice = sub_graph.frame()[['prop', 'obj']]
 
     # calculate zscore locally
     split_dfs = pd.DataFrame(columns=['prop', 'obj', 'count'])
@@ -266,86 +308,63 @@ def order_props_relevance(sub_graph: pd.DataFrame, global_zscore: dict, properti
     return split_dfs.sort_values(by=['value'], ascending=False)
 
 
-def generate_global_zscore(full_graph: pd.DataFrame, edgelist: pd.DataFrame, path: str, flag=False):
+def generate_global_zscore(full_graph: pd.DataFrame, ratings: pd.DataFrame, path: str, flag=False):
     """
     Function that generates a dictionary with all the zscore of movies. If flag is true, generate file,
-    else only reads the file
+    else only reads the file. The bot reads the precomputed artifacts of relevance.py instead
     :param full_graph: full graph of the movie dataset
+    :param ratings: ratings dataset with user_id and movie_id columns
     :param path: path to save the generated DataFrame
     :param flag: True to generate file of DataFrame with global zscores, False to read it
     :return: dictionary with prop and obj keys and count and zscores as columns
     """
     if flag:
-        full_slice = full_graph[['prop', 'obj']]
-        full_split_dfs = pd.DataFrame()
-
-        copy = full_graph.copy()
-        copy['origin'] = ['M' + x for x in copy.index.astype(str)]
-        copy['destination'] = copy['obj']
-        full_edgelist = pd.concat([edgelist, copy[['origin', 'destination']]])
-
-        # create graph
-        G = nx.from_pandas_edgelist(full_edgelist, 'origin', 'destination')
-        pr_np = nx.pagerank_scipy(G, max_iter=1000)
-
-        for prop in full_slice['prop'].unique():
-            df_prop = full_slice[full_slice['prop'] == prop]
-            df_gzscore = df_prop.copy()
-            df_gzscore['count'] = df_prop.groupby(by='obj')['obj'].transform('count')
-            df_gzscore['global_zscore'] = (df_gzscore['count'] - df_gzscore['count'].mean()) / df_gzscore['count'].std()
-            full_split_dfs = pd.concat([full_split_dfs, df_gzscore])
-
-        full_split_dfs['pr'] = full_split_dfs.apply(lambda x: pr_np[x['obj']], axis=1)
-        full_split_dfs['pr_zscore'] = (full_split_dfs['pr'] - full_split_dfs['pr'].mean()) / full_split_dfs['pr'].std()
-
+        g_relevance = relevance.compute(full_graph, ratings)
+        full_split_dfs = pd.DataFrame({c: g_relevance[c] for c in relevance.COLUMNS}).reset_index()
         full_split_dfs.to_csv(path, mode='w', header=True, index=False)
 
     return pd.read_csv(path, usecols=['prop', 'obj', 'count', 'global_zscore', 'pr', 'pr_zscore']).set_index(['prop', 'obj']).to_dict()
 
 
-def remove_films_by_age(age: int, rate_set: pd.DataFrame, graph: pd.DataFrame):
+def ask_parents(age: int):
+    """
+    Function that checks if the user has to be asked if the movie will be watched with the parents
+    :param age: age of the user
+    :return: True if the question has to be asked
+    """
+    return age < 13 or 13 < age <= 17
+
+
+@instrumentation.traced()
+def remove_films_by_age(age: int, rate_set: pd.DataFrame, graph: SubGraph, with_parents=True):
     """
     Function that removes the films by age of the dataset
     :param age: age of the user
     :param rate_set: rating dataset of the movies
     :param graph: graph with all movies
+    :param with_parents: answer of the user to the question if the movie will be watched with the parents, see
+    ask_parents
     :return: graph with only appropriate movies
     """
-    appropriate_graph = graph.copy()
     remove_labels = []
     if age > 17:
-        return appropriate_graph
+        return graph
 
     remove_labels.append('Unrated')
     remove_labels.append('Not Rated')
     remove_labels.append('NC-17')
     remove_labels.append('TV-MA')
-    if age > 13:
-        print("Are you watching this movie with your parents? [yes/no]")
-        aws = str(input())
-
-        if aws == "no":
-            remove_labels.append('R')
+    if age > 13 and not with_parents:
+        remove_labels.append('R')
 
     if age < 13:
         remove_labels.append('R')
         remove_labels.append('TV-14')
-        print("Are you watching this movie with your parents? [yes/no]")
-        aws = str(input())
 
-        if aws == "no":
+        if not with_parents:
             remove_labels.append('PG-13')
             remove_labels.append('TV-PG')
-            print("Be careful when watching PG and TV-G rated movies, they may contain some materials might not "
-                  "like for young children")
-
-    remove_movies = rate_set[rate_set['rated'].isna()].index.to_list()
-    rate_set = rate_set.drop(remove_movies)
-    for label in remove_labels:
-        movies_with_label = rate_set[rate_set['rated'] == label].index.to_list()
-        remove_movies = remove_movies + movies_with_label
-        rate_set = rate_set.drop(movies_with_label)
 
-    appropriate_graph = appropriate_graph.drop(remove_movies)
+    remove_movies = rate_set[rate_set['rated'].isna() | rate_set['rated'].isin(remove_labels)].index
 
-    return appropriate_graph
+    return graph.drop(remove_movies)
@@ -0,0 +1,160 @@
+import os
+import numpy as np
+import pandas as pd
+import columnar
+
+
+class NodeVocabulary:
+    """
+    Dense int32 ids of the nodes of the graphs of the bot, ordered by type: the users, the movies and the objects (eg
+    Q1245). The graphs and their pageranks use the ids and the names (eg U12, M456 and Q1245) are only created to show
+    or export them
+    """
+
+    USER = 'U'
+    MOVIE = 'M'
+
+    def __init__(self, users, movies, objects):
+        """
+        Node vocabulary constructor
+        :param users: ids of the users
+        :param movies: ids of the movies
+        :param objects: codes of the objects
+        """
+        self.users = pd.Index(np.asarray(users, dtype=np.int64))
+        self.movies = pd.Index(np.asarray(movies, dtype=np.int64))
+        self.objects = pd.Index(np.asarray(objects, dtype=object))
+
+        self.movie_offset = len(self.users)
+        self.object_offset = self.movie_offset + len(self.movies)
+        self.n_nodes = self.object_offset + len(self.objects)
+
+    def __len__(self):
+        return self.n_nodes
+
+    @staticmethod
+    def from_data(ratings: pd.DataFrame, full_graph: pd.DataFrame):
+        """
+        Function that creates the vocabulary of the datasets. The users and the objects are in order of appearance
+        and the movies are sorted by id. The ones added by extend are after them
+        :param ratings: ratings dataset with user_id and movie_id columns
+        :param full_graph: full graph of the movie dataset with the movie id as index and obj_code column
+        :return: node vocabulary
+        """
+        users = pd.unique(ratings['user_id'].to_numpy().astype(np.int64))
+        movies = np.unique(np.concatenate([ratings['movie_id'].to_numpy().astype(np.int64),
+                                           full_graph.index.to_numpy().astype(np.int64)]))
+        objects = pd.unique(full_graph['obj_code'].astype(str).to_numpy(dtype=object))
+        return NodeVocabulary(users, movies, objects)
+
+    def extend(self, user_ids=(), movie_ids=(), codes=()):
+        """
+        Function that creates the vocabulary with new users, movies and objects, each one after the ones of its type
+        that are already on the vocabulary. The order of the nodes is kept, so the nodes of this vocabulary can be
+        moved to the extended one with remap
+        :param user_ids: ids of users, the ones that are on the vocabulary are ignored
+        :param movie_ids: ids of movies, the ones that are on the vocabulary are ignored
+        :param codes: codes of objects, the ones that are on the vocabulary are ignored
+        :return: node vocabulary
+        """
+        users = np.asarray(user_ids, dtype=np.int64)
+        movies = np.asarray(movie_ids, dtype=np.int64)
+        codes = np.asarray(codes, dtype=object)
+        return NodeVocabulary(np.concatenate([self.users.to_numpy(),
+                                              pd.unique(users[self.users.get_indexer(users) < 0])]),
+                              np.concatenate([self.movies.to_numpy(),
+                                              pd.unique(movies[self.movies.get_indexer(movies) < 0])]),
+                              np.concatenate([self.objects.to_numpy(dtype=object),
+                                              pd.unique(codes[self.objects.get_indexer(codes) < 0])]))
+
+    def remap(self, previous):
+        """
+        Function that returns the node of this vocabulary of each node of a vocabulary it extends
+        :param previous: vocabulary extended by this one, see extend
+        :return: array with the node of each node of previous
+        """
+        return np.concatenate([np.arange(len(previous.users)),
+                               self.movie_offset + np.arange(len(previous.movies)),
+                               self.object_offset + np.arange(len(previous.objects))]).astype(np.int64)
+
+    def user_ids(self, user_ids):
+        """
+        :param user_ids: ids of users on the dataset
+        :return: array with the node of each user, -1 for the ones that are not on the vocabulary
+        """
+        return _offset(self.users.get_indexer(np.asarray(user_ids, dtype=np.int64)), 0)
+
+    def movie_ids(self, movie_ids):
+        """
+        :param movie_ids: ids of movies on the dataset
+        :return: array with the node of each movie, -1 for the ones that are not on the vocabulary
+        """
+        return _offset(self.movies.get_indexer(np.asarray(movie_ids, dtype=np.int64)), self.movie_offset)
+
+    def object_ids(self, codes):
+        """
+        :param codes: codes of objects, eg Q1245
+        :return: array with the node of each object, -1 for the ones that are not on the vocabulary
+        """
+        return _offset(self.objects.get_indexer(np.asarray(codes, dtype=object)), self.object_offset)
+
+    def encode(self, names):
+        """
+        Function that returns the node of names of any type
+        :param names: names of the nodes, eg U12, M456 or Q1245
+        :return: array with the node of each name, -1 for the ones that are not on the vocabulary
+        """
+        names = pd.Series(np.asarray(names, dtype=object), dtype=object).astype(str)
+        nodes = self.object_ids(names.to_numpy(dtype=object))
+        for prefix, encode in [(self.USER, self.user_ids), (self.MOVIE, self.movie_ids)]:
+            typed = (nodes < 0) & names.str.match(prefix + r'\d+$').to_numpy()
+            if typed.any():
+                nodes[typed] = encode(names[typed].str[1:].astype(np.int64).to_numpy())
+        return nodes
+
+    def decode(self, nodes):
+        """
+        Function that returns the names of nodes, to show or export them
+        :param nodes: nodes of the vocabulary
+        :return: array with the name of each node
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        names = np.empty(len(nodes), dtype=object)
+
+        user = nodes < self.movie_offset
+        movie = ~user & (nodes < self.object_offset)
+        obj = ~user & ~movie
+        names[user] = self.USER + self.users[nodes[user]].astype(str)
+        names[movie] = self.MOVIE + self.movies[nodes[movie] - self.movie_offset].astype(str)
+        names[obj] = self.objects[nodes[obj] - self.object_offset]
+        return names
+
+    def save(self, directory: str):
+        """
+        Function that saves the vocabulary, so files with the nodes of the graphs can be decoded
+        :param directory: directory of the vocabulary
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "users.npy"), self.users.to_numpy())
+        np.save(os.path.join(directory, "movies.npy"), self.movies.to_numpy())
+        columnar.save_strings(os.path.join(directory, "objects"), self.objects)
+
+    @staticmethod
+    def load(directory: str):
+        """
+        Function that reads a vocabulary saved by save
+        :param directory: directory of the vocabulary
+        :return: node vocabulary
+        """
+        return NodeVocabulary(np.load(os.path.join(directory, "users.npy")),
+                              np.load(os.path.join(directory, "movies.npy")),
+                              columnar.load_strings(os.path.join(directory, "objects")))
+
+
+def _offset(codes: np.ndarray, offset: int):
+    """
+    :param codes: positions on a type of node, -1 for missing
+    :param offset: node of the first position
+    :return: int32 nodes, -1 for missing
+    """
+    return np.where(codes >= 0, codes + offset, -1).astype(np.int32)
@@ -1,98 +1,170 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SemanticBot"))
+import columnar
+from property_index import PropertyIndex
+from vocabulary import NodeVocabulary
 
-def movie_props_list(movie_id: int, all_movies_props: pd.DataFrame):
+
+def movie_to_movie_adj_matrix(full_graph: pd.DataFrame, threshold=1, top_k=None,
+                              path="./movie_to_movie_adj_matrix.npz", block=1024):
     """
-    Get the movies properties from the data frame all_movie_props
-    :param all_movies_props: data frame to extract movie properties from
-    :param movie_id: id of the movie to extract the properties
-    :return: a list of tuples with all of the movie properties
+    Generates the movie to movie adjacency matrix, with the weight of the edge as the number of (property, value)
+    pairs shared by the movies. The sparse movie x (property, value) incidence matrix is multiplied by its transpose,
+    by blocks of movies so only the edges kept are stored
+    :param full_graph: full graph of the movie dataset with the movie id as index
+    :param threshold: minimum number of shared pairs of an edge
+    :param top_k: maximum number of edges of each movie, the ones with more shared pairs, None to keep all of them.
+    With top_k the matrix may not be symmetric
+    :param path: path of the npz file of the sparse matrix, see scipy.sparse.load_npz. The ids of the movies of the
+    rows and columns are saved on the movies key. None to not save it
+    :param block: number of movies multiplied at a time
+    :return: sparse csr matrix and the ids of the movies of its rows and columns
     """
-
-    try:
-        movie_props = all_movies_props.loc[movie_id]
-
-        # when movie_props size is two, it means that there is only one line of return
-        # and the command on line 63 wont work
-        if len(movie_props) > 2:
-            movie_tuples = [tuple(x) for x in movie_props.to_numpy()]
-        else:
-            movie_tuples = [(movie_props[0], movie_props[1])]
-
-    except KeyError:
-        movie_tuples = []
-
-    return movie_tuples
-
-
-def movie_to_movie_adj_matrix(full_graph: pd.DataFrame):
-    movies = full_graph.index.unique().sort_values()
-
-    # create empty dataFrame with  movie id as column and index
-    adj_matrix = pd.DataFrame(index=movies, columns=movies)
-    adj_matrix = adj_matrix.fillna(0)
-
-    # for all movies fill the adjacency matrix, with the weight of the edge as the number of equal properties on the
-    # graph
-    for i in range(0, len(movies)):
-        movie1 = movies[i]
-        movie1_props = movie_props_list(movie1, full_prop_graph)
-
-        for j in range(i, len(movies)):
-            movie2 = movies[j]
-
-            if movie1 != movie2:
-                movie2_props = movie_props_list(movie2, full_prop_graph)
-
-                intersection = pd.Series(list(set(movie1_props).intersection(set(movie2_props))), dtype=str)
-                if len(intersection) > 0:
-                    n = len(intersection)
-                    adj_matrix.at[movie1, movie2] = n
-                    adj_matrix.at[movie2, movie1] = n
-                    print("movie1: " + str(movie1) + " movie2: " + str(movie2) + " adj: " + str(n))
-                else:
-                    adj_matrix.at[movie1, movie2] = 0
-                    adj_matrix.at[movie2, movie1] = 0
-                    print("movie1: " + str(movie1) + " movie2: " + str(movie2) + " adj: 0")
-
-            else:
-                adj_matrix.at[movie1, movie2] = 0
-                adj_matrix.at[movie2, movie1] = 0
-                print("movie1: " + str(movie1) + " movie2: " + str(movie2) + " adj: 0")
+    index = PropertyIndex(full_graph)
+    movies = index.movies.to_numpy()
+
+    # binary incidence matrix, a pair repeated on a movie counts once
+    incidence = sparse.csr_matrix((np.ones(len(index.row_pair)), (index.row_movie, index.row_pair)),
+                                  shape=(len(movies), len(index.pair_prop)))
+    incidence.data[:] = 1
+    transposed = incidence.T.tocsc()
+
+    blocks = []
+    for start in range(0, len(movies), block):
+        shared = (incidence[start:start + block] @ transposed).tocoo()
+        rows = shared.row + start
+        keep = (shared.data >= threshold) & (rows != shared.col)
+        rows, cols, counts = rows[keep], shared.col[keep], shared.data[keep]
+
+        if top_k is not None:
+            # rank the edges of each movie by number of shared pairs
+            order = np.lexsort((-counts, rows))
+            rows, cols, counts = rows[order], cols[order], counts[order]
+            first = np.searchsorted(rows, rows)
+            keep = np.arange(len(rows)) - first < top_k
+            rows, cols, counts = rows[keep], cols[keep], counts[keep]
+
+        blocks.append((rows, cols, counts))
+
+    rows, cols, counts = [np.concatenate(b) for b in zip(*blocks)] if blocks else ([], [], [])
+    adj_matrix = sparse.csr_matrix((np.asarray(counts, dtype=np.int32), (rows, cols)), shape=(len(movies), len(movies)))
 
     # save matrix
-    adj_matrix.to_csv("./movie_to_movie_adj_matrix.csv", mode='w', header=False, index=False)
-
-
-def movie_user_prop_adj_matrix(full_graph: pd.DataFrame, movie_rattings: pd.DataFrame):
-    # create empty dataFrame with  movie id as column and index
-    edgelist = pd.DataFrame(columns=['origin', 'destination'])
-
-    movie_rattings['origin'] = 'U' + movie_rattings['user_id'].astype(str)
-    movie_rattings['destination'] = 'M' + movie_rattings['movie_id'].astype(str)
-    edgelist = pd.concat([edgelist, movie_rattings[['origin', 'destination']]])
-
-    copy = full_graph.copy()
-    copy['origin'] = 'M' + copy.index.astype(str)
-    copy['destination'] = copy['obj_code']
-    copy['weight'] = 1
-    edgelist = pd.concat([edgelist, copy[['origin', 'destination']]])
-
-    # save matrix
-    edgelist.to_csv("./movie_user_prop_adj_matrix.csv", mode='w', header=True, index=False)
-
-
-# read full property graph and set index to movie id
-full_prop_graph = pd.read_csv("../WikidataIntegration/wikidata_integration_small.csv",
-                              usecols=['movie_id', 'prop', 'obj', 'obj_code'])
-full_prop_graph = full_prop_graph.set_index('movie_id')
-
-ratings = pd.read_csv("../dataset/1851_movies_ratings.txt", sep='\t', header=None)
-ratings.columns = ['user_id', 'movie_id', 'rating']
-
-movie_user_prop_adj_matrix(full_prop_graph, ratings)
-
+    if path is not None:
+        np.savez_compressed(path, format=b'csr', shape=adj_matrix.shape, data=adj_matrix.data,
+                            indices=adj_matrix.indices, indptr=adj_matrix.indptr, movies=movies)
 
+    return adj_matrix, movies
 
 
+def movie_user_prop_adj_matrix(full_graph: pd.DataFrame, movie_rattings: pd.DataFrame,
+                               path="./movie_user_prop_adj_matrix", chunk_size=1000000, binary=False, workers=1):
+    """
+    Exports the edge list of the users, movies and objects graph, first the user to movie edges of the ratings and
+    then the movie to object edges of the properties. The nodes are the integer ids of a NodeVocabulary, saved on the
+    vocabulary directory of path to decode them. The edges are written in chunks of bounded size and the completed
+    chunks are recorded on progress.json, so an interrupted export resumes from the missing chunks
+    :param full_graph: full graph of the movie dataset with the movie id as index
+    :param movie_rattings: ratings dataset with user_id and movie_id columns
+    :param path: directory of the export
+    :param chunk_size: maximum number of edges of each chunk
+    :param binary: True to write each chunk as a npy file with an int32 (origin, destination) row for each edge, False
+    to write csv files
+    :param workers: number of chunks written at the same time
+    :return: list with the paths of the chunks
+    """
+    vocabulary = NodeVocabulary.from_data(movie_rattings, full_graph)
+    n_ratings = len(movie_rattings)
+    n_edges = n_ratings + len(full_graph)
+    n_chunks = (n_edges + chunk_size - 1) // chunk_size
+    extension = ".npy" if binary else ".csv"
+
+    # the completed chunks are only reused if they were written with the same settings, nodes and edges
+    h = hashlib.blake2b(digest_size=16)
+    h.update(vocabulary.users.to_numpy().tobytes())
+    h.update(vocabulary.movies.to_numpy().tobytes())
+    h.update("\0".join(vocabulary.objects).encode())
+    edges = hashlib.blake2b(digest_size=16)
+    edges.update(pd.util.hash_pandas_object(movie_rattings[['user_id', 'movie_id']], index=False).to_numpy().tobytes())
+    edges.update(pd.util.hash_pandas_object(pd.DataFrame({'movie_id': full_graph.index.to_numpy(),
+                                                          'obj_code': full_graph['obj_code'].astype(str).to_numpy()}),
+                                            index=False).to_numpy().tobytes())
+    settings = {'edges': n_edges, 'chunk_size': chunk_size, 'binary': binary, 'vocabulary': h.hexdigest(),
+                'content': edges.hexdigest()}
+
+    os.makedirs(path, exist_ok=True)
+    progress_path = os.path.join(path, "progress.json")
+    done = set()
+    if os.path.isfile(progress_path):
+        with open(progress_path) as f:
+            progress = json.load(f)
+        if progress['settings'] == settings:
+            done = set(progress['chunks'])
+    if not done:
+        # remove the chunks of an export with other settings
+        for file in os.listdir(path):
+            if file.startswith("part-"):
+                os.remove(os.path.join(path, file))
+        vocabulary.save(os.path.join(path, "vocabulary"))
+
+    obj_codes = full_graph['obj_code']
+
+    def write_chunk(i: int):
+        # edges of the chunk, the ratings ones and then the properties ones
+        start = i * chunk_size
+        end = min(start + chunk_size, n_edges)
+        rate = slice(min(start, n_ratings), min(end, n_ratings))
+        prop = slice(max(start, n_ratings) - n_ratings, max(end, n_ratings) - n_ratings)
+
+        origin = np.concatenate([vocabulary.user_ids(movie_rattings['user_id'].iloc[rate]),
+                                 vocabulary.movie_ids(full_graph.index[prop])])
+        destination = np.concatenate([vocabulary.movie_ids(movie_rattings['movie_id'].iloc[rate]),
+                                      vocabulary.object_ids(obj_codes.iloc[prop].astype(str).to_numpy(dtype=object))])
+
+        file = os.path.join(path, "part-%05d" % i + extension)
+        with open(file + ".tmp", 'wb') as f:
+            if binary:
+                np.save(f, np.stack([origin, destination], axis=1))
+            else:
+                pd.DataFrame({'origin': origin, 'destination': destination}).to_csv(f, header=True, index=False)
+        os.replace(file + ".tmp", file)
+        return i
+
+    pending = [i for i in range(n_chunks) if i not in done]
+    with ThreadPoolExecutor(workers) as executor:
+        for i in executor.map(write_chunk, pending):
+            done.add(i)
+            with open(progress_path + ".tmp", 'w') as f:
+                json.dump({'settings': settings, 'chunks': sorted(done)}, f)
+            os.replace(progress_path + ".tmp", progress_path)
+            print("chunk " + str(i + 1) + " of " + str(n_chunks))
+
+    return [os.path.join(path, "part-%05d" % i + extension) for i in range(n_chunks)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the edge list of the users, movies and objects graph")
+    parser.add_argument("--out", default="./movie_user_prop_adj_matrix")
+    parser.add_argument("--chunk-size", type=int, default=1000000, help="maximum number of edges of each chunk")
+    parser.add_argument("--binary", action="store_true", help="write npy chunks instead of csv")
+    parser.add_argument("--workers", type=int, default=1, help="number of chunks written at the same time")
+    args = parser.parse_args()
+
+    # read full property graph and set index to movie id
+    full_prop_graph = columnar.read_table("../WikidataIntegration/wikidata_integration_small.csv",
+                                          columns=['movie_id', 'prop', 'obj', 'obj_code'])
+    full_prop_graph = full_prop_graph.set_index('movie_id')
+
+    ratings = columnar.read_table("../dataset/1851_movies_ratings.txt", sep='\t', header=None,
+                                  names=['user_id', 'movie_id', 'rating'])
+
+    movie_user_prop_adj_matrix(full_prop_graph, ratings, args.out, args.chunk_size, args.binary, args.workers)
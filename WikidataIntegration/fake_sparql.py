@@ -0,0 +1,155 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# properties returned by the fake endpoint, some of the ones of the query of wikidata_integration.py
+PROPS = ['genre', 'director', 'screenwriter', 'cast member', 'composer', 'producer', 'production company']
+
+
+class FakeSparqlEndpoint:
+    """
+    Local stand in of the wikidata SPARQL endpoint to run the harvesting offline. It answers the queries of
+    wikidata_integration.py with deterministic properties for each imdb id of the VALUES clause, with an optional
+    latency and rate of failed requests (HTTP 429 and 500) to exercise the retries
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, props_per_movie=20, latency=0.0, failure_rate=0.0, seed=0):
+        """
+        Fake SPARQL endpoint constructor
+        :param host: host to listen
+        :param port: port to listen, 0 to use a free one
+        :param props_per_movie: number of (property, value) rows of each movie
+        :param latency: seconds to wait before answering each request
+        :param failure_rate: probability of a request to fail
+        :param seed: seed of the failures
+        """
+        self.props_per_movie = props_per_movie
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                endpoint._answer(self, parse_qs(urlparse(self.path).query).get('query', [""])[0])
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+                if self.headers.get('Content-Type', '').startswith('application/sparql-query'):
+                    endpoint._answer(self, body)
+                else:
+                    endpoint._answer(self, parse_qs(body).get('query', [""])[0])
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        """
+        :return: url of the endpoint
+        """
+        host, port = self.server.server_address[:2]
+        return "http://" + host + ":" + str(port) + "/sparql"
+
+    def start(self):
+        """
+        Function that starts answering requests on a background thread
+        :return: the endpoint
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Function that stops the endpoint
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def bindings(self, imdb: str):
+        """
+        Function that creates the rows of a movie, the same ones on every request
+        :param imdb: imdb id of the movie, eg tt0120338
+        :return: list of SPARQL json bindings
+        """
+        h = zlib.crc32(imdb.encode())
+        rows = []
+        for i in range(self.props_per_movie):
+            value = (h + i * 7919) % 50000
+            rows.append({'itemLabel': {'type': 'literal', 'value': "Movie " + imdb},
+                         'propertyItemLabel': {'type': 'literal', 'value': PROPS[(h + i) % len(PROPS)]},
+                         'valueLabel': {'type': 'literal', 'value': "Value " + str(value)},
+                         'value': {'type': 'uri', 'value': "http://www.wikidata.org/entity/Q" + str(value)},
+                         'imdbId': {'type': 'literal', 'value': imdb}})
+        return rows
+
+    def _answer(self, handler: BaseHTTPRequestHandler, query: str):
+        """
+        Function that answers a request
+        :param handler: handler of the request
+        :param query: SPARQL query
+        """
+        with self._lock:
+            self.requests = self.requests + 1
+            fail = self._random.random() < self.failure_rate
+            if fail:
+                self.failures = self.failures + 1
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if fail:
+            handler.send_response(429 if self.failures % 2 else 500)
+            handler.send_header('Retry-After', '0')
+            handler.end_headers()
+            return
+
+        values = re.search(r"VALUES\s+\?imdbId\s*\{([^}]*)\}", query)
+        imdbs = sorted(set(re.findall(r'"(tt\d+)"', values.group(1)))) if values else []
+        bindings = [row for imdb in imdbs for row in self.bindings(imdb)]
+        body = json.dumps({'head': {'vars': ['itemLabel', 'propertyItemLabel', 'valueLabel', 'value', 'imdbId']},
+                           'results': {'bindings': bindings}}).encode('utf-8')
+
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/sparql-results+json')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local fake wikidata SPARQL endpoint")
+    parser.add_argument("--port", type=int, default=8890)
+    parser.add_argument("--props-per-movie", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering each request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability of a request to fail")
+    args = parser.parse_args()
+
+    fake = FakeSparqlEndpoint(port=args.port, props_per_movie=args.props_per_movie, latency=args.latency,
+                              failure_rate=args.failure_rate)
+    print("Fake SPARQL endpoint on " + fake.url)
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.server.server_close()
@@ -0,0 +1,160 @@
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RATINGS = ['G', 'PG', 'PG-13', 'R', 'NC-17', 'Not Rated', 'Unrated', 'TV-MA']
+
+
+class OmdbStub:
+    """
+    Local stand in of the OMDb api to run the enrichment of rated_movies.py offline. It answers the requests by imdb id
+    with a deterministic age rating, with an optional latency, rate of failed requests (HTTP 429 and 503) and share of
+    movies not found
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, failure_rate=0.0, not_found_rate=0.0, seed=0):
+        """
+        OMDb stub constructor
+        :param host: host to listen
+        :param port: port to listen, 0 to use a free one
+        :param latency: seconds to wait before answering each request
+        :param failure_rate: probability of a request to fail
+        :param not_found_rate: share of the imdb ids answered with the movie not found error
+        :param seed: seed of the failures
+        """
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.not_found_rate = not_found_rate
+        self.requests = 0
+        self.failures = 0
+        # requests being answered and the maximum of them at the same time
+        self.active = 0
+        self.max_active = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub._answer(self, parse_qs(urlparse(self.path).query))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        """
+        :return: url of the api
+        """
+        host, port = self.server.server_address[:2]
+        return "http://" + host + ":" + str(port) + "/"
+
+    def start(self):
+        """
+        Function that starts answering requests on a background thread
+        :return: the stub
+        """
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Function that stops the stub
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def rating(self, imdb: str):
+        """
+        :param imdb: imdb id of the movie
+        :return: age rating of the movie, None if it is not found
+        """
+        h = zlib.crc32(imdb.encode())
+        if (h % 1000) / 1000 < self.not_found_rate:
+            return None
+        return RATINGS[h % len(RATINGS)]
+
+    def _answer(self, handler: BaseHTTPRequestHandler, params: dict):
+        """
+        Function that answers a request
+        :param handler: handler of the request
+        :param params: parameters of the url
+        """
+        with self._lock:
+            self.requests = self.requests + 1
+            fail = self._random.random() < self.failure_rate
+            if fail:
+                self.failures = self.failures + 1
+            self.active = self.active + 1
+            self.max_active = max(self.max_active, self.active)
+
+        try:
+            self._respond(handler, params, fail)
+        finally:
+            with self._lock:
+                self.active = self.active - 1
+
+    def _respond(self, handler: BaseHTTPRequestHandler, params: dict, fail: bool):
+        """
+        Function that writes the response of a request
+        :param handler: handler of the request
+        :param params: parameters of the url
+        :param fail: if the request fails
+        """
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if fail:
+            handler.send_response(429 if self.failures % 2 else 503)
+            handler.end_headers()
+            return
+
+        imdb = params.get('i', [""])[0]
+        rating = self.rating(imdb)
+        if not params.get('apikey'):
+            data = {'Response': "False", 'Error': "No API key provided."}
+        elif rating is None:
+            data = {'Response': "False", 'Error': "Incorrect IMDb ID."}
+        else:
+            data = {'Title': "Movie " + imdb, 'Rated': rating, 'imdbID': imdb, 'Response': "True"}
+
+        body = json.dumps(data).encode('utf-8')
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json; charset=utf-8')
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stub of the OMDb api")
+    parser.add_argument("--port", type=int, default=8891)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before answering each request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="probability of a request to fail")
+    parser.add_argument("--not-found-rate", type=float, default=0.0, help="share of movies not found")
+    args = parser.parse_args()
+
+    stub = OmdbStub(port=args.port, latency=args.latency, failure_rate=args.failure_rate,
+                    not_found_rate=args.not_found_rate)
+    print("OMDb stub on " + stub.url)
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
@@ -1,50 +1,233 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 
-movies = pd.read_csv("../WikidataIntegration/wikidata_integration_small.csv", usecols=['movie_id', 'title', 'imdbId'])
-movies = movies.set_index('movie_id')
-
-rated_movies = pd.read_csv("./rated_movies.csv", usecols=['movie_id', 'rated'])
-rated_movies = rated_movies.set_index('movie_id')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "SemanticBot"))
+import columnar
 
 # api-endpoint
-api_url = "http://www.omdbapi.com/"
+API_URL = "http://www.omdbapi.com/"
+API_KEY = 'ab3ec363'
 
-for m in rated_movies.loc[rated_movies['rated'].isnull()].index:
-    try:
-        movie_id = str(m)
+# errors of the api that stop the enrichment, the next requests would fail too
+FATAL_ERRORS = ["Request limit reached!", "Invalid API key!", "No API key provided."]
+# errors of the api that are answered again to the same movie, the other ones are not cached and are requested again
+PERMANENT_ERRORS = ["Incorrect IMDb ID.", "Movie not found!"]
 
-        if (type(movies.loc[m, 'title']) is not str) and (movies.loc[m, 'imdbId'] is not str):
-            movie_name = movies.loc[m, 'title'].values[0]
-            imdb = movies.loc[m, 'imdbId'].values[0]
-        else:
-            movie_name = movies.loc[m, 'title']
-            imdb = movies.loc[m, 'imdbId']
 
-        # defining a params dict for the parameters to be sent to the API
-        params = {'i': imdb,
-                  'apikey': 'ab3ec363'}
+class OmdbCache:
+    """
+    Cache of the OMDb responses on disk, keyed by imdbId. Each response is appended to a json lines file as soon as it
+    is received, so the responses of an interrupted run are not requested again
+    """
 
-        # sending get request and saving the response as response object
-        r = requests.get(url=api_url, params=params)
+    def __init__(self, path: str):
+        """
+        OMDb cache constructor
+        :param path: path of the json lines file
+        """
+        self.path = path
+        self.responses = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line of an interrupted write
+                        continue
+                    self.responses[entry['imdbId']] = entry['response']
+        self._lock = threading.Lock()
 
-        # extracting data in json format
-        data = r.json()
+    def __contains__(self, imdb):
+        return imdb in self.responses
 
-        rate = data['Rated']
+    def get(self, imdb: str):
+        """
+        :param imdb: imdb id of the movie
+        :return: cached response, None if it is not on the cache
+        """
+        return self.responses.get(imdb)
+
+    def put(self, imdb: str, response: dict):
+        """
+        Function that caches a response
+        :param imdb: imdb id of the movie
+        :param response: json response of the api
+        """
+        with self._lock:
+            self.responses[imdb] = response
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'imdbId': imdb, 'response': response}) + "\n")
+
+
+def pooled_session(concurrency: int):
+    """
+    Function that creates a session that reuses the connections of the concurrent requests
+    :param concurrency: maximum number of requests at the same time
+    :return: requests session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_rating(session: requests.Session, imdb: str, api_url=API_URL, api_key=API_KEY, retries=3, backoff=1.0,
+                 timeout=10):
+    """
+    Function that requests the data of a movie to the OMDb api, retrying with exponential backoff when the request
+    fails or the server is overloaded
+    :param session: requests session
+    :param imdb: imdb id of the movie
+    :param api_url: url of the api
+    :param api_key: key of the api
+    :param retries: maximum number of times a failed request is sent again
+    :param backoff: seconds to wait before the first retry, the wait doubles on each retry, with random jitter
+    :param timeout: seconds to wait for each response
+    :return: json response of the api
+    """
+    # defining a params dict for the parameters to be sent to the API
+    params = {'i': imdb,
+              'apikey': api_key}
+
+    for attempt in range(retries + 1):
+        try:
+            r = session.get(url=api_url, params=params, timeout=timeout)
+            if r.status_code != 429 and r.status_code < 500:
+                return r.json()
+            error = "HTTP " + str(r.status_code)
+        except (requests.RequestException, ValueError) as e:
+            error = str(e)
+
+        if attempt == retries:
+            raise IOError("Request of " + imdb + " failed: " + error)
+        time.sleep(backoff * (2 ** attempt) * (0.5 + random.random()))
+
+
+def is_final(data: dict):
+    """
+    Function that checks if a response of the api can be cached
+    :param data: response of the api
+    :return: True if it is a success or an error that does not change when the movie is requested again
+    """
+    return data.get('Response') != "False" or data.get('Error') in PERMANENT_ERRORS
 
+
+def save_ratings(rated_movies: pd.DataFrame, path: str):
+    """
+    Function that writes the ratings of the movies replacing the file only when it is complete
+    :param rated_movies: age rating of the movies with movie id as index
+    :param path: path of the csv file
+    """
+    rated_movies.reset_index(level='movie_id').to_csv(path + ".tmp", mode='w', header=True, index=False)
+    os.replace(path + ".tmp", path)
+
+
+def enrich(movies: pd.DataFrame, rated_movies: pd.DataFrame, output: str, cache: OmdbCache, api_url=API_URL,
+           api_key=API_KEY, concurrency=8, retries=3, backoff=1.0, timeout=10, flush_every=50):
+    """
+    Function that obtains the age rating of the movies without it. The cached responses are used first and the
+    other movies are requested concurrently. A failed movie does not stop the others, only the fatal errors of the api
+    :param movies: title and imdbId of the movies with movie id as index
+    :param rated_movies: age rating of the movies with movie id as index, updated with the ratings obtained
+    :param output: path of the csv file of the ratings, written every flush_every ratings and at the end
+    :param cache: cache of the responses
+    :param api_url: url of the api
+    :param api_key: key of the api
+    :param concurrency: maximum number of requests at the same time
+    :param retries: maximum number of times a failed request is sent again
+    :param backoff: seconds to wait before the first retry of a request
+    :param timeout: seconds to wait for each response
+    :param flush_every: number of ratings obtained between the writes of the output file
+    :return: number of ratings obtained
+    """
+    movies = movies.groupby(level=0).first()
+    unrated = [m for m in rated_movies.loc[rated_movies['rated'].isnull()].index if m in movies.index]
+
+    def apply(m, data: dict):
+        # returns True if the movie was rated
+        movie_name = str(movies.loc[m, 'title'])
+        if 'Rated' not in data:
+            print("Movie \"" + movie_name + "\" - id: " + str(m) + ": " + str(data.get('Error')))
+            return False
+        rate = data['Rated']
         rated_movies.loc[m, 'rated'] = rate
+        print("Movie \"" + movie_name + "\" is rated as : \"" + rate + "\" - id: " + str(m))
+        return True
+
+    # movies on the cache
+    obtained = 0
+    missing = []
+    for m in unrated:
+        imdb = movies.loc[m, 'imdbId']
+        # the transient errors cached by previous versions are requested again
+        if imdb in cache and is_final(cache.get(imdb)):
+            obtained = obtained + apply(m, cache.get(imdb))
+        else:
+            missing.append(m)
+
+    since_flush = 0
+    session = pooled_session(concurrency)
+    with ThreadPoolExecutor(concurrency) as executor:
+        futures = {executor.submit(fetch_rating, session, movies.loc[m, 'imdbId'], api_url, api_key, retries,
+                                   backoff, timeout): m for m in missing}
+        try:
+            for future in as_completed(futures):
+                m = futures[future]
+                try:
+                    data = future.result()
+                except IOError:
+                    traceback.print_exc()
+                    continue
+
+                if data.get('Error') in FATAL_ERRORS:
+                    print(data['Error'])
+                    break
+
+                if is_final(data):
+                    cache.put(movies.loc[m, 'imdbId'], data)
+                if apply(m, data):
+                    obtained = obtained + 1
+                    since_flush = since_flush + 1
+                if since_flush >= flush_every:
+                    save_ratings(rated_movies, output)
+                    since_flush = 0
+        finally:
+            for future in futures:
+                future.cancel()
+            save_ratings(rated_movies, output)
+
+    return obtained
+
 
-        print("Movie \"" + movie_name + "\" is rated as : \"" + rate + "\" - id: " + movie_id)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Obtain the age rating of the movies from the OMDb api")
+    parser.add_argument("--api-url", default=API_URL, help="url of the api, eg of omdb_stub.py")
+    parser.add_argument("--api-key", default=API_KEY)
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum number of requests at the same time")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--cache", default="./omdb_cache.jsonl", help="file of the cached responses")
+    parser.add_argument("--flush-every", type=int, default=50, help="ratings obtained between writes of the output")
+    args = parser.parse_args()
 
-    except KeyError:
-        print(data['Error'])
-        break
+    movies = columnar.read_table("../WikidataIntegration/wikidata_integration_small.csv",
+                                 columns=['movie_id', 'title', 'imdbId'])
+    movies = movies.set_index('movie_id')
 
-    except Exception as e:
-        traceback.print_exc()
-        break
+    rated_movies = pd.read_csv("./rated_movies.csv", usecols=['movie_id', 'rated'])
+    rated_movies = rated_movies.set_index('movie_id')
 
-rated_movies = rated_movies.reset_index(level='movie_id')
-rated_movies.to_csv("./rated_movies.csv", mode='w', header=True, index=False)
\ No newline at end of file
+    n = enrich(movies, rated_movies, "./rated_movies.csv", OmdbCache(args.cache), args.api_url, args.api_key,
+               args.concurrency, args.retries, flush_every=args.flush_every)
+    print(str(n) + " movies rated")
@@ -1,13 +1,31 @@
-import pandas as pd
+import argparse
+import hashlib
+import json
+import os
+import random
+import socket
+import threading
 import time
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import pandas as pd
 from SPARQLWrapper import SPARQLWrapper, JSON
+from SPARQLWrapper.SPARQLExceptions import EndPointInternalError
+
+ENDPOINT_URL = "https://query.wikidata.org/sparql"
+COLUMNS = ['movie_id', 'title', 'prop', 'obj', 'obj_code', 'imdbId']
+
+# errors of a request that may succeed if it is sent again: rate limit, server errors, timeouts and network errors
+RETRY_ERRORS = (urllib.error.URLError, socket.timeout, ConnectionError, EndPointInternalError)
 
 
-def get_movie_data_from_wikidata(slice_movie_set: pd.DataFrame):
+def get_movie_data_from_wikidata(slice_movie_set: pd.DataFrame, endpoint_url=ENDPOINT_URL, timeout=None):
     """
     Function that consults the wikidata KG for a slice of the movies set
     :param slice_movie_set: slice of the movie data set with movie id as index and imdbId, Title, year and imdbUrl
     as columns
+    :param endpoint_url: url of the SPARQL endpoint
+    :param timeout: seconds to wait for the response, None to use the default of SPARQLWrapper
     :return: JSON with the results of the query
     """
     imdbIdList = slice_movie_set['full_imdbId'].to_list()
@@ -17,8 +35,6 @@ def get_movie_data_from_wikidata(slice_movie_set: pd.DataFrame):
         imdbId = imdbIdList[i]
         imdbs += " ""\"""" + imdbId + """\" """
 
-    endpoint_url = "https://query.wikidata.org/sparql"
-
     query = """
     SELECT DISTINCT
           ?itemLabel
@@ -49,6 +65,8 @@ def get_movie_data_from_wikidata(slice_movie_set: pd.DataFrame):
     sparql = SPARQLWrapper(endpoint_url, agent=user_agent)
     sparql.setQuery(query)
     sparql.setReturnFormat(JSON)
+    if timeout is not None:
+        sparql.setTimeout(timeout)
     results = sparql.query().convert()
     results_dic = results_to_dict(slice_movie_set, results)
     return results_dic
@@ -65,7 +83,7 @@ def results_to_dict(slice_movie_set: pd.DataFrame, props_movie: dict):
     """
 
     # change the index to the imdbId in order to add the movie_id based on the imdb latter
-    slice_movie_set.reset_index(level=0, inplace=True)
+    slice_movie_set = slice_movie_set.reset_index(level=0)
     slice_movie_set = slice_movie_set.set_index("full_imdbId")
 
     filter_props = []
@@ -83,39 +101,176 @@ def results_to_dict(slice_movie_set: pd.DataFrame, props_movie: dict):
     return filter_props
 
 
-# read movies set dataset, remove moives with nan imdbLink, set index to movie id and sort by the
-# full imdbid that matches with the wikidata format "ttXXXXXXX"
-movies_set = pd.read_csv("../dataset/Items - hetrec_after_2000.dat", "\t",
-                         header=None)
-s_all_movies = len(movies_set)
-movies_set.columns = ['movie_id', 'imdbId', 'title', 'year', 'imdbLink']
-movies_set = movies_set[movies_set['imdbLink'].notnull()]
-movies_set = movies_set.set_index('movie_id')
-movies_set['full_imdbId'] = movies_set['imdbLink'].apply(lambda x: x.split("/")[-2])
-movies_set = movies_set.sort_values(by=['full_imdbId'])
-
-# create output, final dataframe with all properties of movies
-all_movie_props = pd.DataFrame(columns=['movie_id', 'title', 'prop', 'obj', 'obj_code', 'imdbId'])
-
-# obtaind properties of movies in 300 movies batches
-begin = 0
-end = 350
-total = len(movies_set)
-
-print("Start obtaining movie data")
-while end <= total:
-    results = get_movie_data_from_wikidata(movies_set.iloc[begin:end])
-    all_movie_props = all_movie_props.append(results)
-    print("From " + str(begin) + " to " + str(end-1) + " obtained from Wikidata")
-    begin = end
-    end = end + 300
-print("End obtaining movie data")
-
-# save output
-cov = len(all_movie_props['movie_id'].unique())/s_all_movies
-print(str(cov))
-if cov > 0.85:
-    all_movie_props.to_csv("./wikidata_integration_small.csv", mode='w', header=True, index=False)
-print("Coverage: " + str(len(all_movie_props['movie_id'].unique())) + " obtained of " + str(s_all_movies)
-      + ". Percentage: " + str(cov))
-print('Output file generated')
\ No newline at end of file
+class RateLimiter:
+    """
+    Limits the rate of requests shared by the threads of the harvesting, each request starts at least 1 / rate
+    seconds after the previous one
+    """
+
+    def __init__(self, rate: float):
+        """
+        Rate limiter constructor
+        :param rate: maximum number of requests per second, 0 for no limit
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Function that blocks until the next request can start
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def fetch_batch(slice_movie_set: pd.DataFrame, endpoint_url: str, limiter: RateLimiter, retries=5, backoff=1.0,
+                timeout=None):
+    """
+    Function that queries a batch of movies, retrying with exponential backoff when the request fails
+    :param slice_movie_set: slice of the movie data set, see get_movie_data_from_wikidata
+    :param endpoint_url: url of the SPARQL endpoint
+    :param limiter: rate limiter of the requests
+    :param retries: maximum number of times a failed request is sent again
+    :param backoff: seconds to wait before the first retry, the wait doubles on each retry, with random jitter
+    :param timeout: seconds to wait for each response
+    :return: list of dictionaries of the properties of the movies
+    """
+    for attempt in range(retries + 1):
+        limiter.wait()
+        try:
+            return get_movie_data_from_wikidata(slice_movie_set, endpoint_url, timeout)
+        except RETRY_ERRORS as e:
+            if attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt) * (0.5 + random.random())
+            print("Request failed (" + str(e) + "), retrying in " + str(round(delay, 2)) + " seconds")
+            time.sleep(delay)
+
+
+def harvest(movies_set: pd.DataFrame, output: str, checkpoint_dir: str, endpoint_url=ENDPOINT_URL, batch_size=300,
+            concurrency=4, rate=2.0, retries=5, backoff=1.0, timeout=None):
+    """
+    Function that obtains the properties of the movies from wikidata. The batches are queried concurrently and each
+    completed one is saved on checkpoint_dir, so a new run only queries the batches that are missing. The batches are
+    appended to the output file in order as soon as all the previous ones are completed
+    :param movies_set: movie data set with movie id as index and the full_imdbId column
+    :param output: path of the csv file with the properties of the movies
+    :param checkpoint_dir: directory of the completed batches
+    :param endpoint_url: url of the SPARQL endpoint
+    :param batch_size: number of movies of each query
+    :param concurrency: maximum number of queries running at the same time
+    :param rate: maximum number of queries started per second, 0 for no limit
+    :param retries: maximum number of times a failed query is sent again
+    :param backoff: seconds to wait before the first retry of a query
+    :param timeout: seconds to wait for each response
+    :return: set with the ids of the movies with properties
+    """
+    batches = [movies_set.iloc[begin:begin + batch_size] for begin in range(0, len(movies_set), batch_size)]
+
+    # the checkpoints are only reused if they were created with the same movies and batch size
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    h = hashlib.sha256("\0".join(movies_set['full_imdbId'].astype(str)).encode())
+    settings = {'batch_size': batch_size, 'movies': h.hexdigest()}
+    settings_path = os.path.join(checkpoint_dir, "settings.json")
+    saved = None
+    if os.path.isfile(settings_path):
+        with open(settings_path) as f:
+            saved = json.load(f)
+    if saved != settings:
+        for file in os.listdir(checkpoint_dir):
+            os.remove(os.path.join(checkpoint_dir, file))
+        with open(settings_path, 'w') as f:
+            json.dump(settings, f)
+
+    def checkpoint(i: int):
+        return os.path.join(checkpoint_dir, "batch-%05d.csv" % i)
+
+    limiter = RateLimiter(rate)
+    movie_ids = set()
+    streamed = 0
+
+    with open(output, 'w', newline='') as out, ThreadPoolExecutor(concurrency) as executor:
+        pd.DataFrame(columns=COLUMNS).to_csv(out, header=True, index=False)
+
+        running = {}
+        pending = [i for i in range(len(batches)) if not os.path.isfile(checkpoint(i))]
+        print(str(len(batches) - len(pending)) + " of " + str(len(batches)) + " batches obtained before")
+
+        while pending or running or streamed < len(batches):
+            # keep the maximum number of queries running
+            while pending and len(running) < concurrency:
+                i = pending.pop(0)
+                running[executor.submit(fetch_batch, batches[i], endpoint_url, limiter, retries, backoff,
+                                        timeout)] = i
+
+            if running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    i = running.pop(future)
+                    try:
+                        props = pd.DataFrame(future.result(), columns=COLUMNS)
+                    except Exception:
+                        for other in running:
+                            other.cancel()
+                        raise
+                    props.to_csv(checkpoint(i) + ".tmp", header=True, index=False)
+                    os.replace(checkpoint(i) + ".tmp", checkpoint(i))
+                    print("Batch " + str(i + 1) + " of " + str(len(batches)) + " obtained from Wikidata")
+
+            # stream the completed batches that follow the ones already written
+            while streamed < len(batches) and os.path.isfile(checkpoint(streamed)):
+                props = pd.read_csv(checkpoint(streamed))
+                props.to_csv(out, header=False, index=False)
+                movie_ids.update(props['movie_id'].unique())
+                streamed = streamed + 1
+
+    return movie_ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Obtain the properties of the movies from wikidata")
+    parser.add_argument("--endpoint", default=ENDPOINT_URL, help="url of the SPARQL endpoint, eg of fake_sparql.py")
+    parser.add_argument("--output", default="./wikidata_integration_small.csv")
+    parser.add_argument("--checkpoints", default="./wikidata_checkpoints", help="directory of the completed batches")
+    parser.add_argument("--batch-size", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of queries at the same time")
+    parser.add_argument("--rate", type=float, default=2.0, help="maximum number of queries per second")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--backoff", type=float, default=1.0, help="seconds to wait before the first retry")
+    parser.add_argument("--timeout", type=float, default=None, help="seconds to wait for each response")
+    parser.add_argument("--min-coverage", type=float, default=0.85,
+                        help="minimum fraction of movies with properties to replace the output file")
+    args = parser.parse_args()
+
+    # read movies set dataset, remove moives with nan imdbLink, set index to movie id and sort by the
+    # full imdbid that matches with the wikidata format "ttXXXXXXX"
+    movies_set = pd.read_csv("../dataset/Items - hetrec_after_2000.dat", sep="\t",
+                             header=None)
+    s_all_movies = len(movies_set)
+    movies_set.columns = ['movie_id', 'imdbId', 'title', 'year', 'imdbLink']
+    movies_set = movies_set[movies_set['imdbLink'].notnull()]
+    movies_set = movies_set.set_index('movie_id')
+    movies_set['full_imdbId'] = movies_set['imdbLink'].apply(lambda x: x.split("/")[-2])
+    movies_set = movies_set.sort_values(by=['full_imdbId'])
+
+    # obtain properties of movies in batches, streaming them to a partial file that replaces the output when the
+    # coverage is enough
+    print("Start obtaining movie data")
+    partial = args.output + ".partial"
+    obtained = harvest(movies_set, partial, args.checkpoints, args.endpoint, args.batch_size, args.concurrency,
+                       args.rate, args.retries, args.backoff, args.timeout)
+    print("End obtaining movie data")
+
+    # save output
+    cov = len(obtained)/s_all_movies
+    print(str(cov))
+    if cov > args.min_coverage:
+        os.replace(partial, args.output)
+    print("Coverage: " + str(len(obtained)) + " obtained of " + str(s_all_movies)
+          + ". Percentage: " + str(cov))
+    print('Output file generated')